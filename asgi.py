@@ -0,0 +1,10 @@
+"""ASGI entry point, serving the app created in main with plato.asgi.
+
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 80
+
+"""
+from main import app
+from plato.asgi import PlatoASGI
+from plato.settings import ASGI_RENDER_WORKERS, ASGI_IO_WORKERS
+
+asgi_app = PlatoASGI(app, render_workers=ASGI_RENDER_WORKERS, io_workers=ASGI_IO_WORKERS)
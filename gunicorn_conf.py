@@ -0,0 +1,30 @@
+"""Gunicorn configuration for production.
+
+The app is preloaded and warmed up in the master process, so the workers fork with the templates loaded, compiled and
+weasyprint initialized.
+
+    gunicorn --config gunicorn_conf.py main:app
+
+"""
+import multiprocessing
+from os import getenv
+from pathlib import Path
+
+preload_app = True
+bind = getenv("BIND", "0.0.0.0:80")
+workers = int(getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = getenv("WORKER_CLASS", "sync")
+loglevel = getenv("LOG_LEVEL", "info")
+keepalive = 120
+
+
+def when_ready(server):
+    """
+    Runs in the master process after the app is loaded and before the workers are forked.
+    """
+    from main import app
+    from plato.settings import TEMPLATE_DIRECTORY, TEMPLATE_DIRECTORY_NAME
+    from plato.util.warmup import warm_up
+
+    # skips loading the templates when prestart.sh already did so
+    warm_up(app, TEMPLATE_DIRECTORY, TEMPLATE_DIRECTORY_NAME, load_templates=not Path(TEMPLATE_DIRECTORY).exists())
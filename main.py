@@ -3,21 +3,45 @@
 Either create a Flask run configuration on this module or set up to run it locally with main.
 
 """
+from plato import settings
+from plato.compose.render_cache import RenderCache
+from plato.compose.renderer import RenderBudget
+from plato.compose.scheduler import RenderScheduler
+from plato.db.template_events import TemplateSync
 from plato.file_storage import StorageType
 from plato.flask_app import create_app
-from plato.settings import WORKING_DB_URL, PROJECT_NAME, PROJECT_VERSION, TEMPLATE_DIRECTORY, STORAGE_TYPE, \
-    TEMPLATE_DIRECTORY_NAME
+from plato.settings import WORKING_DB_URL, TEMPLATE_DIRECTORY, STORAGE_TYPE, TEMPLATE_DIRECTORY_NAME, \
+    SWAGGER_SPEC_CACHE_DIR, SINGLE_FLIGHT_DIRECTORY, DB_ENGINE_OPTIONS, DB_READ_REPLICA_URLS, \
+    DB_READ_REPLICA_RETRY_INTERVAL, RENDER_TIME_BUDGET, RENDER_MAX_PAGES, RENDER_MAX_OUTPUT_BYTES, \
+    RENDER_MAX_RASTER_PIXELS, RENDER_CONCURRENCY, RENDER_MAX_PER_TEMPLATE, RENDER_MAX_PER_CLIENT, RENDER_QUEUE_TIMEOUT, \
+    RENDER_CACHE_PATH, RENDER_CACHE_MAX_BYTES
 from plato.util.setup_util import create_template_environment, setup_swagger_ui, initialize_file_storage
 
 template_environment = create_template_environment(TEMPLATE_DIRECTORY)
-swagger_ui_config = setup_swagger_ui(PROJECT_NAME, PROJECT_VERSION)
 file_storage = initialize_file_storage(STORAGE_TYPE)
+render_cache = RenderCache(RENDER_CACHE_PATH, max_bytes=RENDER_CACHE_MAX_BYTES)
 
 app = create_app(db_url=WORKING_DB_URL,
                  template_static_directory=f"{TEMPLATE_DIRECTORY}/static",
                  jinja_env=template_environment,
-                 swagger_ui_config=swagger_ui_config,
-                 storage=file_storage)
+                 # pyproject.toml is only parsed for the project name and version when the docs are first served
+                 swagger_ui_config=lambda: setup_swagger_ui(settings.PROJECT_NAME, settings.PROJECT_VERSION),
+                 storage=file_storage,
+                 swagger_spec_cache_dir=SWAGGER_SPEC_CACHE_DIR,
+                 single_flight_directory=SINGLE_FLIGHT_DIRECTORY,
+                 engine_options=DB_ENGINE_OPTIONS,
+                 read_replica_urls=DB_READ_REPLICA_URLS,
+                 read_replica_retry_interval=DB_READ_REPLICA_RETRY_INTERVAL,
+                 render_budget=RenderBudget(render_time=RENDER_TIME_BUDGET,
+                                            max_pages=RENDER_MAX_PAGES,
+                                            max_output_bytes=RENDER_MAX_OUTPUT_BYTES,
+                                            max_raster_pixels=RENDER_MAX_RASTER_PIXELS),
+                 render_scheduler=RenderScheduler(capacity=RENDER_CONCURRENCY,
+                                                  max_per_template=RENDER_MAX_PER_TEMPLATE,
+                                                  max_per_client=RENDER_MAX_PER_CLIENT,
+                                                  queue_timeout=RENDER_QUEUE_TIMEOUT),
+                 render_cache=render_cache,
+                 template_sync=TemplateSync(file_storage, TEMPLATE_DIRECTORY, TEMPLATE_DIRECTORY_NAME, render_cache))
 
 if __name__ == '__main__':
     # in app-context setups
@@ -0,0 +1,41 @@
+"""Template revision history
+
+Revision ID: 8d2b4c6e1f03
+Revises: 3c5e1f2a7d90
+Create Date: 2026-10-19 16:40:12.517904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b4c6e1f03'
+down_revision = '3c5e1f2a7d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('template_revision',
+    sa.Column('template_id', sa.String(), nullable=False),
+    sa.Column('revision', sa.Integer(), nullable=False),
+    sa.Column('schema', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('type', postgresql.ENUM('text/html', name='template_mime_type', create_type=False), nullable=False),
+    sa.Column('metadata', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('example_composition', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('tags', sa.ARRAY(sa.String()), nullable=False, server_default="{}"),
+    sa.Column('files', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+    sa.ForeignKeyConstraint(['template_id'], ['template.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('template_id', 'revision')
+    )
+    # the current state of every template is its first recorded revision, its files were not recorded
+    op.execute("INSERT INTO template_revision "
+               "(template_id, revision, schema, type, metadata, example_composition, tags) "
+               "SELECT id, revision, schema, type, metadata, example_composition, tags FROM template")
+
+
+def downgrade():
+    op.drop_table('template_revision')
@@ -1,3 +1,6 @@
-from .settings import PROJECT_VERSION
-
-__version__ = PROJECT_VERSION
+def __getattr__(name: str):
+    # the version is read lazily, so that importing any plato module does not parse pyproject.toml
+    if name == "__version__":
+        from .settings import PROJECT_VERSION
+        return PROJECT_VERSION
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,27 +1,45 @@
+import io
 import json
+import threading
 import uuid
 import zipfile
 from http import HTTPStatus
 from mimetypes import guess_extension
-from typing import Callable, Tuple
+from contextlib import ExitStack, nullcontext
+from tempfile import TemporaryDirectory
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, Union
 
 from accept_types import get_best_match
-from flask import jsonify, request, Flask, send_file, current_app
+from flask import jsonify, request, Flask, send_file, current_app, Response, stream_with_context
 from jsonschema import validate as json_validate, ValidationError
+from werkzeug.datastructures import MultiDict
 
-from sqlalchemy import String, cast as db_cast
-from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.orm import Session
 
-from plato.compose import PDF_MIME, ALL_AVAILABLE_MIME_TYPES
-from plato.compose.renderer import compose, RendererNotFound, PNG_MIME, InvalidPageNumber
-from plato.views.views import TemplateDetailView, TEMPLATE_UPDATE_SCHEMA
+from plato.compose import PDF_MIME, PNG_MIME, ALL_AVAILABLE_MIME_TYPES, AVAILABLE_IMG_MIME_TYPES
+from plato.compose.attachments import Attachment, UnknownAttachment, save_attachments
+from plato.compose.artifacts import get_thumbnail, get_prerendered_example, prerender_examples
+from plato.compose.renderer import compose, RendererNotFound, InvalidPageNumber, InvalidRenderOption, MergeEntry, \
+    compose_merged_pdf, RenderBudgetExceeded, RenderTimeExceeded, compose_html_stream, HTML_MIME
+from plato.compose.render_cache import RenderCache, template_key
+from plato.compose.scheduler import Priority, RenderScheduler, RenderQueueTimeout
+from plato.compose.single_flight import SingleFlight, compose_key
+from plato.compose.spool import ChunkSpool
+from plato.compose.validation import validate_lines
+from plato.views.views import TemplateDetailView, TEMPLATE_UPDATE_SCHEMA, MERGED_COMPOSE_SCHEMA
 from .db import db
-from .db.models import Template
+from .db.models import Template, TemplateRevision
+from .db.replicas import ReadReplicas
+from .db.template_events import publish_template_changed, RevisionFilesUnavailable, TemplateSync
+from .db.types import array_contains
 from .error_messages import invalid_compose_json, template_not_found, unsupported_mime_type, aspect_ratio_compromised, \
     resizing_unsupported, single_page_unsupported, negative_number_invalid, template_already_exists, invalid_zip_file, \
-    invalid_directory_structure, invalid_json_field, invalid_template_details
-from .settings import TEMPLATE_DIRECTORY_NAME
+    invalid_directory_structure, invalid_json_field, invalid_template_details, encoding_options_unsupported, \
+    invalid_merge_entry, too_many_merge_entries, invalid_render_priority, missing_compose_data_part, \
+    invalid_template_revision, template_revision_not_found, template_revision_files_unavailable
+from .settings import TEMPLATE_DIRECTORY_NAME, THUMBNAIL_WIDTH, THUMBNAIL_MAX_AGE, MERGE_MAX_ENTRIES, \
+    MERGE_RENDER_WORKERS, REVISION_MAX_AGE
 from .util.path_util import tmp_zipfile_path
 
 
@@ -32,6 +50,266 @@ class UnsupportedMIMEType(Exception):
     ...
 
 
+class InvalidComposeRequest(Exception):
+    """
+    Exception to be raised when the compose options requested are invalid
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class TemplateRevisionNotFound(NoResultFound):
+    """
+    Exception to be raised when the template exists but not the revision requested. As a NoResultFound, it is looked
+    up again on the primary when a read replica lags behind.
+    """
+
+    def __init__(self, template_id: str, revision: int):
+        super().__init__(template_revision_not_found.format(template_id, revision))
+        self.message = template_revision_not_found.format(template_id, revision)
+
+
+COMPOSE_ERRORS = (RendererNotFound, UnsupportedMIMEType, InvalidComposeRequest, InvalidPageNumber,
+                  InvalidRenderOption, NoResultFound, ValidationError, RenderBudgetExceeded, RenderQueueTimeout,
+                  UnknownAttachment, RevisionFilesUnavailable)
+
+# the part of multipart compose requests holding the compose data, the other parts being its attachments
+COMPOSE_DATA_PART = "compose_data"
+
+# the render priority class, e.g. "bulk" for batch jobs, otherwise the endpoint's default priority applies
+PRIORITY_HEADER = "X-Render-Priority"
+# identifies the client for the per client concurrency limits, the remote address is used if absent
+CLIENT_HEADER = "X-Client-Id"
+# pins the request to a template revision, the current one being used if absent
+REVISION_ARGUMENT = "revision"
+NDJSON_MIME = "application/x-ndjson"
+# responses pinned to a revision never change
+REVISION_CACHE_CONTROL = f"public, max-age={REVISION_MAX_AGE}, immutable"
+
+
+def parse_render_priority(priority: Optional[str], default: Priority) -> Priority:
+    """
+    Parses the render priority class requested.
+
+    Args:
+        priority: The value of the priority header, if any
+        default: The endpoint's default priority
+
+    Raises:
+        InvalidComposeRequest: If there is no such priority class
+
+    Returns:
+        Priority: The render priority
+    """
+    if priority is None:
+        return default
+    try:
+        return Priority[priority.strip().upper()]
+    except KeyError:
+        raise InvalidComposeRequest(invalid_render_priority.format(
+            priority, ", ".join(priority_.name.lower() for priority_ in Priority)))
+
+
+def parse_revision(revision: Optional[str]) -> Optional[int]:
+    """
+    Parses the template revision requested.
+
+    Args:
+        revision: The value of the revision query argument, if any
+
+    Raises:
+        InvalidComposeRequest: If it is not a positive integer
+
+    Returns:
+        Optional[int]: The revision, None for the current one
+    """
+    if revision is None:
+        return None
+    try:
+        parsed_revision = int(revision)
+    except ValueError:
+        raise InvalidComposeRequest(invalid_template_revision.format(revision))
+    if parsed_revision < 1:
+        raise InvalidComposeRequest(invalid_template_revision.format(revision))
+    return parsed_revision
+
+
+def query_template_revision(session: Session, template_id: str,
+                            revision: Optional[int]) -> Union[Template, TemplateRevision]:
+    """
+    Queries the template, or the recorded revision of it when another revision than the current one is requested.
+
+    Args:
+        session: The session to query on
+        template_id: The id of the template
+        revision: The revision requested, None for the current one
+
+    Raises:
+        NoResultFound: If there is no such template
+        TemplateRevisionNotFound: If the template has no such revision
+
+    Returns:
+        Union[Template, TemplateRevision]: The template when the current revision is requested, otherwise the revision
+    """
+    template = session.query(Template).filter_by(id=template_id).one()
+    if revision is None or revision == template.revision:
+        return template
+    template_revision = session.query(TemplateRevision).filter_by(template_id=template_id, revision=revision) \
+        .one_or_none()
+    if template_revision is None:
+        raise TemplateRevisionNotFound(template_id, revision)
+    return template_revision
+
+
+def pinned_template(template_revision: TemplateRevision) -> Template:
+    """
+    The template of a past revision, its files being written to the local template directory the first time. Must be
+    called within the app context.
+
+    Args:
+        template_revision: The revision, see query_template_revision
+
+    Raises:
+        RevisionFilesUnavailable: When the files of the revision are not available on this node
+
+    Returns:
+        Template: The template to compose the revision with
+    """
+    template_sync: Optional[TemplateSync] = current_app.config["template_sync"]
+    if template_sync is None:
+        raise RevisionFilesUnavailable(template_revision.revision, "No template directory to write them to")
+    return template_sync.pin_revision(template_revision)
+
+
+def pin_to_revision(response: Response, vary_accept: bool = False) -> Response:
+    """
+    Marks a response pinned to a template revision as immutable, so clients and CDNs can cache it indefinitely.
+
+    Args:
+        response: The response
+        vary_accept: Whether the response depends on the Accept header, e.g. compositions
+
+    Returns:
+        Response: The same response
+    """
+    response.headers["Cache-Control"] = REVISION_CACHE_CONTROL
+    if vary_accept:
+        response.vary.add("Accept")
+    return response
+
+
+def parse_compose_options(args: MultiDict, accept_header: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Parses and validates the output MIME type and the renderer options of a compose request.
+
+    Args:
+        args: The request query arguments
+        accept_header: The request Accept header
+
+    Raises:
+        UnsupportedMIMEType: If no available MIME type is accepted
+        InvalidComposeRequest: If the options are invalid for the MIME type
+
+    Returns:
+        Tuple[str, Dict[str, int]]: The output MIME type and the options to be given to the renderer
+    """
+    width = args.get("width", type=int)
+    height = args.get("height", type=int)
+    page = args.get("page", type=int)
+    quality = args.get("quality", type=int)
+    compression = args.get("compression", type=int)
+
+    mime_type = get_best_match(accept_header, ALL_AVAILABLE_MIME_TYPES)
+    if mime_type is None:
+        raise UnsupportedMIMEType(accept_header)
+
+    if (width is not None or height is not None) and mime_type not in AVAILABLE_IMG_MIME_TYPES:
+        raise InvalidComposeRequest(resizing_unsupported.format(mime_type))
+
+    if page is not None and mime_type not in AVAILABLE_IMG_MIME_TYPES:
+        raise InvalidComposeRequest(single_page_unsupported.format(mime_type))
+
+    if (quality is not None or compression is not None) and mime_type not in AVAILABLE_IMG_MIME_TYPES:
+        raise InvalidComposeRequest(encoding_options_unsupported.format(mime_type))
+
+    if width is not None and height is not None:
+        raise InvalidComposeRequest(aspect_ratio_compromised)
+
+    if page is not None and page < 0:
+        raise InvalidComposeRequest(negative_number_invalid.format(page))
+
+    options = {"width": width, "height": height, "page": page, "quality": quality, "compression": compression}
+    return mime_type, {name: value for name, value in options.items() if value is not None}
+
+
+def compose_error_response(error: Exception, template_id: str, accept_header: str) -> Tuple[dict, HTTPStatus]:
+    """
+    Maps an error raised while composing to the response body and status code.
+
+    Args:
+        error: One of COMPOSE_ERRORS
+        template_id: The id of the template being composed
+        accept_header: The request Accept header
+
+    Returns:
+        Tuple[dict, HTTPStatus]: The response body and status code
+    """
+    if isinstance(error, (RendererNotFound, UnsupportedMIMEType)):
+        return {"message": unsupported_mime_type.format(accept_header, ", ".join(ALL_AVAILABLE_MIME_TYPES))}, \
+            HTTPStatus.NOT_ACCEPTABLE
+    if isinstance(error, TemplateRevisionNotFound):
+        return {"message": error.message}, HTTPStatus.NOT_FOUND
+    if isinstance(error, RevisionFilesUnavailable):
+        return {"message": template_revision_files_unavailable.format(template_id, error.revision)}, \
+            HTTPStatus.NOT_FOUND
+    if isinstance(error, NoResultFound):
+        return {"message": template_not_found.format(template_id)}, HTTPStatus.NOT_FOUND
+    if isinstance(error, ValidationError):
+        return {"message": invalid_compose_json.format(error.message)}, HTTPStatus.BAD_REQUEST
+    if isinstance(error, (RenderTimeExceeded, RenderQueueTimeout)):
+        return {"message": error.message}, HTTPStatus.SERVICE_UNAVAILABLE
+    if isinstance(error, RenderBudgetExceeded):
+        return {"message": error.message}, HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    return {"message": error.message}, HTTPStatus.BAD_REQUEST
+
+
+def render_composition(template: Template, compose_data: dict, mime_type: str, compose_params: Dict[str, int],
+                       attachments: Optional[Dict[str, Attachment]] = None,
+                       render_slot: Callable[[], ContextManager] = nullcontext) -> bytes:
+    """
+    Composes the template, served from the host-wide render cache when it was already rendered, coalescing identical
+    compositions being rendered concurrently into a single render. Must be called within the app context.
+
+    Args:
+        template: The Template model
+        compose_data: The data to fill the template with
+        mime_type: The output MIME type
+        compose_params: The options given to the renderer
+        attachments: The files referenced from the compose data, by name
+        render_slot: Context to render in, e.g. a slot of the render scheduler. Only entered when actually rendering,
+         not when waiting for an identical composition.
+
+    Returns:
+        bytes: The composed file
+    """
+    single_flight: SingleFlight = current_app.config["single_flight"]
+    render_cache: RenderCache = current_app.config["render_cache"]
+    attachment_digests = {name: attachment.digest for name, attachment in (attachments or {}).items()}
+    key = template_key(template.id, compose_key(template, compose_data, mime_type, compose_params, attachment_digests))
+
+    def render() -> bytes:
+        with render_slot():
+            return compose(template, compose_data, mime_type, attachments=attachments, **compose_params).getvalue()
+
+    cached_file = render_cache.get(key)
+    if cached_file is not None:
+        return cached_file
+    # checked again by the single render, as another process may have rendered it in the meantime
+    return single_flight.do(key, lambda: render_cache.get_or_render(key, render))
+
+
 def initialize_api(app: Flask):
     """
     Initializes Flask app with the microservice endpoints.
@@ -42,6 +320,8 @@ def initialize_api(app: Flask):
     """
     with app.app_context():
         file_storage = current_app.config["storage"]
+        read_replicas: ReadReplicas = current_app.config["read_replicas"]
+        render_scheduler: RenderScheduler = current_app.config["render_scheduler"]
 
     @app.route("/templates/<string:template_id>", methods=['GET'])
     def template_by_id(template_id: str):
@@ -53,22 +333,40 @@ def initialize_api(app: Flask):
             in: path
             type: string
             required: true
+          - name: revision
+            in: query
+            type: integer
+            minimum: 1
+            required: false
+            description: Template revision to pin the information to, served with immutable cache headers
         responses:
           200:
             description: Information on the template
             schema:
               $ref: '#/definitions/TemplateDetail'
+          400:
+            description: Invalid revision
           404:
-            description: Template not found
+            description: Template or template revision not found
         tags:
            - template
         """
         try:
+            revision = parse_revision(request.args.get(REVISION_ARGUMENT))
+
+            def query_view(session: Session) -> TemplateDetailView:
+                template = query_template_revision(session, template_id, revision)
+                if isinstance(template, TemplateRevision):
+                    template = template.as_template()
+                return TemplateDetailView.view_from_template(template)
 
-            template: Template = Template.query.filter_by(id=template_id).one()
-            view = TemplateDetailView.view_from_template(template)
-            return jsonify(view._asdict())
+            response = jsonify(read_replicas.read(query_view)._asdict())
+            return pin_to_revision(response) if revision is not None else response
 
+        except InvalidComposeRequest as e:
+            return jsonify({"message": e.message}), HTTPStatus.BAD_REQUEST
+        except TemplateRevisionNotFound as e:
+            return jsonify({"message": e.message}), HTTPStatus.NOT_FOUND
         except NoResultFound:
             return jsonify({"message": template_not_found.format(template_id)}), HTTPStatus.NOT_FOUND
 
@@ -95,13 +393,14 @@ def initialize_api(app: Flask):
         """
 
         tags = request.args.getlist("tags", type=str)
-        template_query = Template.query
-        if tags:
-            template_query = template_query.filter(Template.tags.contains(db_cast(tags, ARRAY(String))))
 
-        json_views = [TemplateDetailView.view_from_template(template)._asdict() for
-                      template in
-                      template_query]
+        def query_views(session: Session) -> List[dict]:
+            template_query = session.query(Template)
+            if tags:
+                template_query = template_query.filter(array_contains(Template.tags, tags))
+            return [TemplateDetailView.view_from_template(template)._asdict() for template in template_query]
+
+        json_views = read_replicas.read(query_views)
 
         return jsonify(json_views)
 
@@ -178,16 +477,20 @@ def initialize_api(app: Flask):
 
         try:
             # uploads template files from zip file to file storage
-            file_storage.save_template_files(template_id, TEMPLATE_DIRECTORY_NAME, zip_file_name)
+            template_files = file_storage.save_template_files(template_id, TEMPLATE_DIRECTORY_NAME, zip_file_name)
 
-            # saves template json into database
+            # saves template json into database, along with its first revision
             db.session.add(new_template)
+            db.session.flush()
+            db.session.add(TemplateRevision.from_template(new_template, template_files))
             db.session.commit()
         except IntegrityError:
             return jsonify({"message": template_already_exists.format(template_id)}), HTTPStatus.CONFLICT
         except FileNotFoundError:
             return jsonify({"message": invalid_directory_structure}), HTTPStatus.BAD_REQUEST
 
+        publish_template_changed(new_template)
+        _schedule_example_prerender(template_id)
         return jsonify(TemplateDetailView.view_from_template(new_template)._asdict()), HTTPStatus.CREATED
 
     @app.route("/template/<string:template_id>/update", methods=['PUT'])
@@ -255,20 +558,26 @@ def initialize_api(app: Flask):
 
         try:
             json_validate(template_entry_json, schema=TEMPLATE_UPDATE_SCHEMA)
-            # update template into database
             template = Template.query.filter_by(id=template_id).first_or_404()
-            template.update_fields(template_entry_json)
-            db.session.commit()
 
             # uploads template files from zip file to file storage
-            file_storage.save_template_files(template_id, TEMPLATE_DIRECTORY_NAME, zip_file_name)
+            template_files = file_storage.save_template_files(template_id, TEMPLATE_DIRECTORY_NAME, zip_file_name)
+
+            # update template into database, along with its new revision
+            template.update_fields(template_entry_json)
+            db.session.add(TemplateRevision.from_template(template, template_files))
+            db.session.commit()
         except NoResultFound:
             return jsonify({"message": template_not_found.format(template_id)}), HTTPStatus.NOT_FOUND
         except FileNotFoundError:
             return jsonify({"message": invalid_directory_structure}), HTTPStatus.BAD_REQUEST
         except ValidationError as ve:
             return jsonify({"message": invalid_template_details.format(ve.message)}), HTTPStatus.BAD_REQUEST
+        except KeyError as e:
+            return jsonify({"message": invalid_json_field.format(e.args)}), HTTPStatus.BAD_REQUEST
 
+        publish_template_changed(template)
+        _schedule_example_prerender(template_id)
         return jsonify(TemplateDetailView.view_from_template(template)._asdict())
 
     @app.route("/template/<string:template_id>/update_details", methods=['PATCH'])
@@ -323,17 +632,34 @@ def initialize_api(app: Flask):
 
         template_details = request.get_json()
         try:
-            # update template into database
+            # update template into database, the new revision keeping the files of the previous one
             template = Template.query.filter_by(id=template_id).first_or_404()
+            previous_revision = TemplateRevision.query.filter_by(template_id=template_id,
+                                                                 revision=template.revision).one_or_none()
             template.update_fields(template_details)
+            db.session.add(TemplateRevision.from_template(
+                template, previous_revision.files if previous_revision is not None else None))
             db.session.commit()
         except NoResultFound:
             return jsonify({"message": template_not_found.format(template_id)}), HTTPStatus.NOT_FOUND
         except KeyError as e:
             return jsonify({"message": invalid_json_field.format(e.args)}), HTTPStatus.BAD_REQUEST
 
+        publish_template_changed(template)
+        _schedule_example_prerender(template_id)
         return jsonify(TemplateDetailView.view_from_template(template)._asdict())
 
+    def _schedule_example_prerender(template_id: str) -> None:
+        """
+        Pre-renders the examples of the template's current revision in the background, so that the example endpoint
+        can serve them without rendering.
+
+        Args:
+            template_id: The id of the template
+        """
+        current_app.config["background_executor"].submit(prerender_examples, current_app._get_current_object(),
+                                                         template_id, TEMPLATE_DIRECTORY_NAME, THUMBNAIL_WIDTH)
+
     def _save_and_validate_zipfile() -> Tuple[bool, str]:
         """
         Saves in tmp directory and checks if file is a ZIP file.
@@ -356,12 +682,17 @@ def initialize_api(app: Flask):
     def compose_file(template_id: str):
         """
         Composes file based on the template
+        The compose data can also be sent as multipart/form-data, in a "compose_data" part with the JSON, alongside
+        binary parts (e.g. images) referenced from the data by their part name as "attachment:<part name>".
         ---
         consumes:
             - application/json
+            - multipart/form-data
         produces:
             - application/pdf
             - image/png
+            - image/jpeg
+            - image/webp
             - text/html
         parameters:
             - name: template_id
@@ -377,8 +708,25 @@ def initialize_api(app: Flask):
               name: accept
               required: false
               type: string
-              enum: [application/pdf, image/png, text/html]
+              enum: [application/pdf, image/png, image/jpeg, image/webp, text/html]
               description: MIME type(s) to determine what kind of file is outputted
+            - in: header
+              name: X-Render-Priority
+              required: false
+              type: string
+              enum: [interactive, bulk]
+              description: Render priority class, interactive renders go first. Defaults to interactive
+            - in: header
+              name: X-Client-Id
+              required: false
+              type: string
+              description: Client identifier for the per client concurrency limit, the remote address by default
+            - in: query
+              name: revision
+              required: false
+              type: integer
+              minimum: 1
+              description: Template revision to compose, served with immutable cache headers. The current one by default
             - in: query
               name: page
               required: false
@@ -394,22 +742,52 @@ def initialize_api(app: Flask):
               required: false
               type: integer
               description: Intended width for image output
+            - in: query
+              name: quality
+              required: false
+              type: integer
+              minimum: 1
+              maximum: 100
+              description: Image quality, lower values trade fidelity for smaller files (reduces the palette for PNG)
+            - in: query
+              name: compression
+              required: false
+              type: integer
+              minimum: 0
+              maximum: 9
+              description: Image compression level, higher values trade CPU for smaller files (0 to 6 for WebP)
         responses:
           200:
             description: composed file
             schema:
               type: file
           400:
-            description: Invalid compose data for template schema
+            description: Invalid compose data for template schema, or invalid revision
           404:
-             description: Template not found
+             description: Template, template revision or its files not found
           406:
              description: Unsupported MIME type for file
+          413:
+             description: The composition goes over the template's page, output size or image size budget
+          503:
+             description: Rendering the template took longer than its time budget, or no render slot was available in time
         tags:
            - compose
            - template
         """
-        return _compose(template_id, "compose", lambda t: request.get_json())
+        if request.mimetype != "multipart/form-data":
+            return _compose(template_id, "compose", lambda t: request.get_json())
+
+        try:
+            compose_data = json.loads(request.form[COMPOSE_DATA_PART])
+        except KeyError:
+            return jsonify({"message": missing_compose_data_part.format(COMPOSE_DATA_PART)}), HTTPStatus.BAD_REQUEST
+        except ValueError as e:
+            return jsonify({"message": invalid_compose_json.format(e)}), HTTPStatus.BAD_REQUEST
+
+        with TemporaryDirectory() as attachment_directory:
+            attachments = save_attachments(request.files, attachment_directory)
+            return _compose(template_id, "compose", lambda t: compose_data, attachments=attachments)
 
     @app.route("/template/<string:template_id>/example", methods=["GET"])
     def example_compose(template_id: str):
@@ -421,6 +799,8 @@ def initialize_api(app: Flask):
         produces:
             - application/pdf
             - image/png
+            - image/jpeg
+            - image/webp
             - text/html
         parameters:
             - name: template_id
@@ -431,7 +811,24 @@ def initialize_api(app: Flask):
               name: accept
               required: false
               type: string
-              enum: [application/pdf, image/png, text/html]
+              enum: [application/pdf, image/png, image/jpeg, image/webp, text/html]
+            - in: header
+              name: X-Render-Priority
+              required: false
+              type: string
+              enum: [interactive, bulk]
+              description: Render priority class, interactive renders go first. Defaults to interactive
+            - in: header
+              name: X-Client-Id
+              required: false
+              type: string
+              description: Client identifier for the per client concurrency limit, the remote address by default
+            - in: query
+              name: revision
+              required: false
+              type: integer
+              minimum: 1
+              description: Template revision to compose, served with immutable cache headers. The current one by default
             - in: query
               name: page
               required: false
@@ -447,66 +844,332 @@ def initialize_api(app: Flask):
               required: false
               type: integer
               description: Intended width for image output
+            - in: query
+              name: quality
+              required: false
+              type: integer
+              minimum: 1
+              maximum: 100
+              description: Image quality, lower values trade fidelity for smaller files (reduces the palette for PNG)
+            - in: query
+              name: compression
+              required: false
+              type: integer
+              minimum: 0
+              maximum: 9
+              description: Image compression level, higher values trade CPU for smaller files (0 to 6 for WebP)
         responses:
           200:
             description: composed file
             schema:
               type: file
+          400:
+            description: Invalid revision
           404:
-             description: Template not found
+             description: Template, template revision or its files not found
           406:
              description: Unsupported MIME type for file
+          413:
+             description: The composition goes over the template's page, output size or image size budget
+          503:
+             description: Rendering the template took longer than its time budget, or no render slot was available in time
         tags:
            - compose
            - template
         """
-        return _compose(template_id, "example", lambda t: t.example_composition)
+        return _compose(template_id, "example", lambda t: t.example_composition, serve_prerendered=True)
 
-    def _compose(template_id: str,
-                 file_name: str,
-                 compose_retrieval_function: Callable[[Template], dict]):
-        width = request.args.get("width", type=int)
-        height = request.args.get("height", type=int)
-        page = request.args.get("page", type=int)
+    @app.route("/template/<string:template_id>/validate", methods=["POST"])
+    def validate_compose_data_lines(template_id: str):
+        """
+        Validates a batch of compose data for the template, without rendering
+        Every line of the NDJSON body is a compose data object, blank lines are skipped. A result is streamed back as
+        each line is validated, with every validation error of the line, not only the first one.
+        ---
+        consumes:
+            - application/x-ndjson
+        produces:
+            - application/x-ndjson
+        parameters:
+            - name: template_id
+              in: path
+              type: string
+              required: true
+            - in: body
+              name: compose_data
+              description: compose data objects, one per line, as NDJSON
+              schema:
+                type: string
+            - in: query
+              name: revision
+              required: false
+              type: integer
+              minimum: 1
+              description: Template revision to validate for. The current one by default
+        responses:
+          200:
+            description: the result of each line, as NDJSON, e.g. {"line":1,"valid":false,"errors":[{"path":"$.name","message":"1 is not of type 'string'"}]}
+          400:
+            description: Invalid revision
+          404:
+             description: Template or template revision not found
+        tags:
+           - compose
+           - template
+        """
+        try:
+            revision = parse_revision(request.args.get(REVISION_ARGUMENT))
+            template_schema = read_replicas.read(
+                lambda session: query_template_revision(session, template_id, revision).schema)
+        except (InvalidComposeRequest, NoResultFound) as e:
+            message, status = compose_error_response(e, template_id, NDJSON_MIME)
+            return jsonify(message), status
 
-        accept_header = request.headers.get("Accept", PDF_MIME)
-        mime_type = get_best_match(accept_header, ALL_AVAILABLE_MIME_TYPES)
+        def results() -> Iterator[str]:
+            # the body is read as the results are written, so it is never held in memory as a whole
+            for result in validate_lines(request.stream, template_schema):
+                yield json.dumps(result) + "\n"
 
-        try:
-            if mime_type is None:
-                raise UnsupportedMIMEType(accept_header)
+        return Response(stream_with_context(results()), mimetype=NDJSON_MIME), HTTPStatus.OK
 
-            if (width is not None or height is not None) and mime_type != PNG_MIME:
-                return jsonify({"message": resizing_unsupported.format(mime_type)}), HTTPStatus.BAD_REQUEST
+    @app.route("/template/<string:template_id>/thumbnail", methods=["GET"])
+    def template_thumbnail(template_id: str):
+        """
+        Gets a small preview of the first page of the template's example
+        ---
+        produces:
+            - image/png
+        parameters:
+            - name: template_id
+              in: path
+              type: string
+              required: true
+            - in: header
+              name: X-Render-Priority
+              required: false
+              type: string
+              enum: [interactive, bulk]
+              description: Render priority class, interactive renders go first. Defaults to interactive
+            - in: header
+              name: X-Client-Id
+              required: false
+              type: string
+              description: Client identifier for the per client concurrency limit, the remote address by default
+        responses:
+          200:
+            description: thumbnail of the template, rendered once per template revision
+            schema:
+              type: file
+          304:
+             description: The thumbnail did not change since it was last fetched
+          400:
+             description: Invalid example composition for the template schema, or invalid render priority
+          404:
+             description: Template not found
+          413:
+             description: The example goes over the template's page budget
+          503:
+             description: Rendering the template took longer than its time budget, or no render slot was available in time
+        tags:
+           - compose
+           - template
+        """
+        client_id = request.headers.get(CLIENT_HEADER, request.remote_addr)
+        try:
+            priority = parse_render_priority(request.headers.get(PRIORITY_HEADER), Priority.INTERACTIVE)
+            template_model: Template = Template.query.filter_by(id=template_id).one()
+            thumbnail = get_thumbnail(template_model, file_storage, TEMPLATE_DIRECTORY_NAME, THUMBNAIL_WIDTH,
+                                      current_app.config["single_flight"],
+                                      lambda: render_scheduler.slot(priority, [template_id], client_id))
+        except COMPOSE_ERRORS as e:
+            message, status = compose_error_response(e, template_id, PNG_MIME)
+            return jsonify(message), status
 
-            if page is not None and mime_type != PNG_MIME:
-                return jsonify({"message": single_page_unsupported.format(mime_type)}), HTTPStatus.BAD_REQUEST
+        return send_file(io.BytesIO(thumbnail), mimetype=PNG_MIME, download_name="thumbnail.png",
+                         etag=f"{template_id}-{template_model.revision}-{THUMBNAIL_WIDTH}", max_age=THUMBNAIL_MAX_AGE)
 
-            if width is not None and height is not None:
-                return jsonify({"message": aspect_ratio_compromised}), HTTPStatus.BAD_REQUEST
+    @app.route("/templates/compose", methods=["POST"])
+    def compose_merged():
+        """
+        Composes several documents into a single PDF, with a bookmark per document
+        ---
+        consumes:
+            - application/json
+        produces:
+            - application/pdf
+        parameters:
+            - in: body
+              name: entries
+              required: true
+              description: documents to compose, in order. The title is the bookmark label, the template id by default.
+              schema:
+                type: object
+                properties:
+                  entries:
+                    type: array
+                    items:
+                      type: object
+                      properties:
+                        template_id:
+                          type: string
+                        compose_data:
+                          type: object
+                        title:
+                          type: string
+            - in: header
+              name: X-Render-Priority
+              required: false
+              type: string
+              enum: [interactive, bulk]
+              description: Render priority class, interactive renders go first. Defaults to bulk
+            - in: header
+              name: X-Client-Id
+              required: false
+              type: string
+              description: Client identifier for the per client concurrency limit, the remote address by default
+        responses:
+          200:
+            description: merged PDF file
+            schema:
+              type: file
+          400:
+            description: Invalid request or compose data for one of the template schemas
+          404:
+             description: Template not found
+          413:
+             description: Too many documents to merge, or over the page or size budget
+          503:
+             description: Rendering a document took longer than its time budget, or no render slot was available in time
+        tags:
+           - compose
+        """
+        merge_request = request.get_json()
+        try:
+            json_validate(merge_request, schema=MERGED_COMPOSE_SCHEMA)
+        except ValidationError as ve:
+            return jsonify({"message": invalid_compose_json.format(ve.message)}), HTTPStatus.BAD_REQUEST
 
-            if page is not None and page < 0:
-                return jsonify({"message": negative_number_invalid.format(page)}), HTTPStatus.BAD_REQUEST
+        entries_json = merge_request["entries"]
+        if len(entries_json) > MERGE_MAX_ENTRIES:
+            return jsonify({"message": too_many_merge_entries.format(len(entries_json), MERGE_MAX_ENTRIES)}), \
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE
 
-            compose_params = {}
-            if width is not None:
-                compose_params["width"] = width
-            if height is not None:
-                compose_params["height"] = height
-            if page is not None:
-                compose_params["page"] = page
+        template_ids = {entry["template_id"] for entry in entries_json}
+        templates = {template.id: template for template in Template.query.filter(Template.id.in_(template_ids))}
+        missing_template_ids = sorted(template_ids.difference(templates))
+        if missing_template_ids:
+            return jsonify({"message": template_not_found.format(missing_template_ids[0])}), HTTPStatus.NOT_FOUND
 
-            template_model: Template = Template.query.filter_by(id=template_id).one()
-            compose_data = compose_retrieval_function(template_model)
-            composed_file = compose(template_model, compose_data, mime_type, **compose_params)
-            return send_file(composed_file, mimetype=mime_type, as_attachment=True,
-                             download_name=f"{file_name}{guess_extension(mime_type)}"), HTTPStatus.OK
-        except (RendererNotFound, UnsupportedMIMEType):
-            return jsonify(
-                {"message": unsupported_mime_type.format(accept_header, ", ".join(ALL_AVAILABLE_MIME_TYPES))}), HTTPStatus.NOT_ACCEPTABLE
-        except InvalidPageNumber as e:
-            return jsonify({"message": e.message}), HTTPStatus.BAD_REQUEST
-        except NoResultFound:
-            return jsonify({"message": template_not_found.format(template_id)}), HTTPStatus.NOT_FOUND
+        entries = [MergeEntry(template=templates[entry["template_id"]],
+                              compose_data=entry["compose_data"],
+                              title=entry.get("title", entry["template_id"]))
+                   for entry in entries_json]
+        client_id = request.headers.get(CLIENT_HEADER, request.remote_addr)
+        try:
+            priority = parse_render_priority(request.headers.get(PRIORITY_HEADER), Priority.BULK)
+            # a slot per document laid out, as they are laid out in parallel
+            merged_file = compose_merged_pdf(
+                entries, max_workers=MERGE_RENDER_WORKERS,
+                render_slot=lambda slot_template_ids: render_scheduler.slot(priority, slot_template_ids, client_id))
         except ValidationError as ve:
-            return jsonify({"message": invalid_compose_json.format(ve.message)}), HTTPStatus.BAD_REQUEST
+            return jsonify({"message": invalid_merge_entry.format(ve.relative_path[0], ve.message)}), \
+                HTTPStatus.BAD_REQUEST
+        except (RenderBudgetExceeded, RenderQueueTimeout, InvalidComposeRequest) as e:
+            message, status = compose_error_response(e, "", PDF_MIME)
+            return jsonify(message), status
+
+        return send_file(merged_file, mimetype=PDF_MIME, as_attachment=True, download_name="merged.pdf"), HTTPStatus.OK
+
+    def _stream_html(template_model: Template, compose_data: dict, download_name: str,
+                     render_slot: ContextManager) -> Response:
+        """
+        Streams the HTML composition in a chunked response, as it is rendered. The render runs in a background thread
+        holding the render slot and is spooled for the response, so the slot is freed once the render is done rather
+        than once a slow client has downloaded it.
+
+        Raises:
+            ValidationError: When the compose data is not valid for the template
+            RenderBudgetExceeded: When the first chunk goes over the template's budget
+            RenderQueueTimeout: When no render slot was granted in time
+        """
+        chunks = compose_html_stream(template_model, compose_data)
+        with ExitStack() as stack:
+            stack.enter_context(render_slot)
+            release_slot = stack.pop_all().close
+
+        spool = ChunkSpool()
+
+        def render() -> None:
+            with app.app_context():
+                spool.write_all(chunks, on_done=release_slot)
+
+        threading.Thread(target=render, name="plato-html-render", daemon=True).start()
+        spooled_chunks = spool.read()
+        try:
+            # the first chunk is rendered before responding, so a template failing early, or small enough to fit in a
+            # single chunk, still gets its error response instead of a cut off stream
+            first_chunk = next(spooled_chunks, b"")
+        except Exception:
+            spool.close()
+            raise
+
+        def stream() -> Iterator[bytes]:
+            yield first_chunk
+            yield from spooled_chunks
+
+        response = Response(stream(), mimetype=HTML_MIME,
+                            headers={"Content-Disposition": f"attachment; filename={download_name}"})
+        # also stops the render when the client goes away
+        response.call_on_close(spool.close)
+        return response
+
+    def _compose(template_id: str,
+                 file_name: str,
+                 compose_retrieval_function: Callable[[Template], dict],
+                 serve_prerendered: bool = False,
+                 attachments: Optional[Dict[str, Attachment]] = None):
+        accept_header = request.headers.get("Accept", PDF_MIME)
+        client_id = request.headers.get(CLIENT_HEADER, request.remote_addr)
+
+        try:
+            mime_type, compose_params = parse_compose_options(request.args, accept_header)
+            priority = parse_render_priority(request.headers.get(PRIORITY_HEADER), Priority.INTERACTIVE)
+            revision = parse_revision(request.args.get(REVISION_ARGUMENT))
+
+            template_model = read_replicas.read(
+                lambda session: query_template_revision(session, template_id, revision))
+            if isinstance(template_model, TemplateRevision):
+                template_model = pinned_template(template_model)
+
+            prerendered_file = None
+            if serve_prerendered and not compose_params:
+                prerendered_file = get_prerendered_example(template_model, file_storage, TEMPLATE_DIRECTORY_NAME,
+                                                           mime_type)
+            if prerendered_file is not None:
+                response = send_file(io.BytesIO(prerendered_file), mimetype=mime_type, as_attachment=True,
+                                     download_name=f"{file_name}{guess_extension(mime_type)}")
+            else:
+                response = _compose_response(template_model, compose_retrieval_function(template_model), mime_type,
+                                             compose_params, f"{file_name}{guess_extension(mime_type)}",
+                                             lambda: render_scheduler.slot(priority, [template_id], client_id),
+                                             attachments)
+            return (pin_to_revision(response, vary_accept=True) if revision is not None else response), HTTPStatus.OK
+        except COMPOSE_ERRORS as e:
+            message, status = compose_error_response(e, template_id, accept_header)
+            return jsonify(message), status
+
+    def _compose_response(template_model: Template, compose_data: dict, mime_type: str,
+                          compose_params: Dict[str, int], download_name: str,
+                          render_slot: Callable[[], ContextManager],
+                          attachments: Optional[Dict[str, Attachment]]) -> Response:
+        """
+        Renders the composition, streaming it when it is HTML and there is no render cache to serve it from.
+        """
+        render_cache: RenderCache = current_app.config["render_cache"]
+        if mime_type == HTML_MIME and attachments is None and render_cache.path is None:
+            return _stream_html(template_model, compose_data, download_name, render_slot())
+
+        composed_file = io.BytesIO(render_composition(
+            template_model, compose_data, mime_type, compose_params, attachments=attachments,
+            render_slot=render_slot))
+        return send_file(composed_file, mimetype=mime_type, as_attachment=True, download_name=download_name)
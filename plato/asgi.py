@@ -0,0 +1,332 @@
+"""ASGI serving mode.
+
+The compose and example endpoints are handled natively on the event loop: the template lookups and the file storage
+reads run in a thread pool and the renders in a pool of worker processes, so neither a slow render nor a slow database
+blocks the loop from accepting and serving other requests. Every other endpoint is served by the Flask app, run in a
+thread pool, so both serving modes expose exactly the same API.
+
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 80
+
+"""
+import asyncio
+import json
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.synchronize import Barrier
+from http import HTTPStatus
+from mimetypes import guess_extension
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+
+from plato.api import COMPOSE_ERRORS, CLIENT_HEADER, PRIORITY_HEADER, REVISION_ARGUMENT, REVISION_CACHE_CONTROL, \
+    parse_compose_options, parse_render_priority, parse_revision, compose_error_response, render_composition, \
+    query_template_revision, pinned_template
+from plato.compose import PDF_MIME
+from plato.compose.artifacts import get_prerendered_example
+from plato.compose.scheduler import Priority, RenderScheduler
+from plato.db import db
+from plato.db.models import Template, TemplateRevision
+from plato.db.replicas import ReadReplicas
+from plato.error_messages import invalid_compose_json, render_worker_lost
+from plato.settings import TEMPLATE_DIRECTORY_NAME
+
+Scope = dict
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+
+COMPOSE_PATH = re.compile(r"^/template/(?P<template_id>[^/]+)/compose$")
+EXAMPLE_PATH = re.compile(r"^/template/(?P<template_id>[^/]+)/example$")
+
+# how long the render workers wait for each other to be started, in seconds
+RENDER_WORKERS_START_TIMEOUT = 60.0
+
+# the Flask app of the render worker processes, inherited from the serving process as they are forked
+_render_app: Optional[Flask] = None
+# the barrier every render worker waits on once started, see _wait_for_render_workers
+_render_workers_started: Optional[Barrier] = None
+
+
+def _initialize_render_worker(app: Flask, workers_started: Barrier) -> None:
+    global _render_app, _render_workers_started
+    _render_app = app
+    _render_workers_started = workers_started
+
+
+def _render(template: Template, compose_data: dict, mime_type: str, compose_params: Dict[str, int],
+            accept_header: str) -> Tuple[Optional[bytes], Optional[Tuple[dict, HTTPStatus]]]:
+    """
+    Renders a composition, run in a render worker process. Errors are mapped to their response there, as not all of
+    them can be sent back to the serving process.
+
+    Args:
+        template: The Template model, detached from its session
+        compose_data: The data to fill the template with
+        mime_type: The output MIME type
+        compose_params: The options given to the renderer
+        accept_header: The request Accept header
+
+    Returns:
+        Tuple[Optional[bytes], Optional[Tuple[dict, HTTPStatus]]]: The composed file, or the error response body and
+         status code
+    """
+    with _render_app.app_context():
+        try:
+            return render_composition(template, compose_data, mime_type, compose_params), None
+        except COMPOSE_ERRORS as e:
+            return None, compose_error_response(e, template.id, accept_header)
+
+
+def _wait_for_render_workers() -> None:
+    """
+    Waits for every other render worker to run it too. Running one per worker at once forks all of them, as on
+    Python 3.9 and 3.10 releases before 3.9.13 and 3.10.5 the pool only forks a worker when no other is idle.
+    """
+    _render_workers_started.wait(RENDER_WORKERS_START_TIMEOUT)
+
+
+class PlatoASGI:
+    """
+    ASGI app serving the Plato API.
+
+        Typical usage:
+
+            asgi_app = PlatoASGI(create_app(...), render_workers=4, io_workers=32)
+
+    """
+
+    def __init__(self, app: Flask, render_workers: int, io_workers: int):
+        """
+        Args:
+            app: The Flask app
+            render_workers: Number of processes rendering the compositions
+            io_workers: Number of threads accessing the database and file storage, and of threads running the Flask app
+        """
+        self.app = app
+        self.render_workers = render_workers
+        self.wsgi_app = WSGIMiddleware(app, workers=io_workers)
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="plato-io")
+        self.render_executor = self._new_render_executor()
+
+    def _new_render_executor(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context("fork")
+        # forked, so the workers inherit the app with its jinja environment and the templates already loaded
+        return ProcessPoolExecutor(max_workers=self.render_workers, mp_context=context,
+                                   initializer=_initialize_render_worker,
+                                   initargs=(self.app, context.Barrier(self.render_workers)))
+
+    async def _start_render_workers(self) -> None:
+        """
+        Forks every render worker at once, with connections not shared with them.
+        """
+        loop = asyncio.get_running_loop()
+        with self.app.app_context():
+            # connections must not be shared with the forked render workers
+            db.engine.dispose()
+        await asyncio.gather(*(loop.run_in_executor(self.render_executor, _wait_for_render_workers)
+                               for _ in range(self.render_workers)))
+
+    async def _replace_render_executor(self, broken_executor: ProcessPoolExecutor) -> None:
+        """
+        Replaces the render workers once one of them died, e.g. killed when out of memory, which breaks the pool.
+        Renders failing on the same broken pool only replace it once.
+        """
+        if self.render_executor is not broken_executor:
+            return
+        self.render_executor = self._new_render_executor()
+        broken_executor.shutdown(wait=False)
+        await self._start_render_workers()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if scope["type"] == "http":
+            compose_match = COMPOSE_PATH.match(scope["path"])
+            if compose_match is not None and scope["method"] == "POST" and _is_json(scope):
+                await self._compose(scope, receive, send, compose_match["template_id"], "compose", from_body=True)
+                return
+
+            example_match = EXAMPLE_PATH.match(scope["path"])
+            if example_match is not None and scope["method"] == "GET":
+                await self._compose(scope, receive, send, example_match["template_id"], "example", from_body=False)
+                return
+
+        await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # forks the render workers before any request is served, and any thread or connection is started
+                await self._start_render_workers()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await loop.run_in_executor(None, self.render_executor.shutdown)
+                self.io_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _compose(self, scope: Scope, receive: Receive, send: Send, template_id: str, file_name: str,
+                       from_body: bool) -> None:
+        """
+        Composes a template, with the request body as compose data or with the template example.
+
+        Args:
+            scope: The ASGI connection scope
+            receive: The ASGI receive channel
+            send: The ASGI send channel
+            template_id: The id of the template
+            file_name: The name of the file sent, without extension
+            from_body: Whether the compose data is the request body, the template example is composed otherwise
+        """
+        loop = asyncio.get_running_loop()
+        headers = _request_headers(scope)
+        accept_header = headers.get("accept", PDF_MIME)
+        args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+
+        client = scope.get("client")
+        client_id = headers.get(CLIENT_HEADER.lower(), client[0] if client else "")
+
+        try:
+            mime_type, compose_params = parse_compose_options(args, accept_header)
+            priority = parse_render_priority(headers.get(PRIORITY_HEADER.lower()), Priority.INTERACTIVE)
+            revision = parse_revision(args.get(REVISION_ARGUMENT))
+            template, prerendered_file = await loop.run_in_executor(
+                self.io_executor, self._get_template, template_id, revision, mime_type,
+                not from_body and not compose_params)
+        except COMPOSE_ERRORS as e:
+            await _send_json(send, headers, *compose_error_response(e, template_id, accept_header))
+            return
+
+        file_name = f"{file_name}{guess_extension(mime_type)}"
+        pinned = revision is not None
+        if prerendered_file is not None:
+            await _send_file(send, headers, prerendered_file, mime_type, file_name, pinned)
+            return
+
+        if from_body:
+            try:
+                compose_data = json.loads(await _read_body(receive))
+            except ValueError as e:
+                await _send_json(send, headers, {"message": invalid_compose_json.format(e)}, HTTPStatus.BAD_REQUEST)
+                return
+        else:
+            compose_data = template.example_composition
+
+        scheduler: RenderScheduler = self.app.config["render_scheduler"]
+        ticket = scheduler.submit(priority, [template.id], client_id)
+        try:
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(ticket.future), scheduler.queue_timeout)
+            except asyncio.TimeoutError:
+                await _send_json(send, headers,
+                                 *compose_error_response(scheduler.queue_timeout_error(), template_id, accept_header))
+                return
+            render_executor = self.render_executor
+            try:
+                composed_file, error = await loop.run_in_executor(render_executor, _render, template, compose_data,
+                                                                  mime_type, compose_params, accept_header)
+            except BrokenProcessPool:
+                await self._replace_render_executor(render_executor)
+                await _send_json(send, headers, {"message": render_worker_lost.format(template_id)},
+                                 HTTPStatus.SERVICE_UNAVAILABLE)
+                return
+        finally:
+            scheduler.release(ticket)
+
+        if error is not None:
+            await _send_json(send, headers, *error)
+        else:
+            await _send_file(send, headers, composed_file, mime_type, file_name, pinned)
+
+    def _get_template(self, template_id: str, revision: Optional[int], mime_type: str,
+                      serve_prerendered: bool) -> Tuple[Template, Optional[bytes]]:
+        """
+        Gets the template and, when asked for, its pre-rendered example. Run in the I/O thread pool.
+
+        Args:
+            template_id: The id of the template
+            revision: The revision requested, None for the current one
+            mime_type: The output MIME type
+            serve_prerendered: Whether to look up the pre-rendered example
+
+        Raises:
+            NoResultFound: If the template does not exist
+            TemplateRevisionNotFound: If the template has no such revision
+            RevisionFilesUnavailable: When the files of the revision are not available on this node
+
+        Returns:
+            Tuple[Template, Optional[bytes]]: The template, detached from its session, and its pre-rendered example
+        """
+        with self.app.app_context():
+            read_replicas: ReadReplicas = self.app.config["read_replicas"]
+            template = read_replicas.read(lambda session: query_template_revision(session, template_id, revision))
+            if template in db.session:
+                db.session.expunge(template)
+            if isinstance(template, TemplateRevision):
+                template = pinned_template(template)
+
+            prerendered_file = None
+            if serve_prerendered:
+                prerendered_file = get_prerendered_example(template, self.app.config["storage"],
+                                                           TEMPLATE_DIRECTORY_NAME, mime_type)
+            return template, prerendered_file
+
+
+def _is_json(scope: Scope) -> bool:
+    content_type = _request_headers(scope).get("content-type", "")
+    mime_type = content_type.split(";")[0].strip()
+    return mime_type == "application/json" or (mime_type.startswith("application/") and mime_type.endswith("+json"))
+
+
+def _request_headers(scope: Scope) -> Dict[str, str]:
+    return {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+
+
+async def _read_body(receive: Receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+def _cors_headers(request_headers: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+    """
+    The CORS headers the Flask app sends with every response, see flask_cors.
+    """
+    origin = request_headers.get("origin")
+    if origin is None:
+        return [(b"access-control-allow-origin", b"*")]
+    return [(b"access-control-allow-origin", origin.encode("latin-1")), (b"vary", b"Origin")]
+
+
+async def _send_file(send: Send, request_headers: Dict[str, str], content: bytes, mime_type: str,
+                     file_name: str, pinned: bool = False) -> None:
+    headers = [(b"content-type", mime_type.encode("latin-1")),
+               (b"content-length", str(len(content)).encode("latin-1")),
+               (b"content-disposition", f"attachment; filename={file_name}".encode("latin-1"))]
+    if pinned:
+        # the same headers as pin_to_revision
+        headers += [(b"cache-control", REVISION_CACHE_CONTROL.encode("latin-1")), (b"vary", b"Accept")]
+    await send({"type": "http.response.start", "status": HTTPStatus.OK,
+                "headers": headers + _cors_headers(request_headers)})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def _send_json(send: Send, request_headers: Dict[str, str], message: dict, status: HTTPStatus) -> None:
+    content = json.dumps(message).encode("utf-8")
+    headers = [(b"content-type", b"application/json"),
+               (b"content-length", str(len(content)).encode("latin-1"))]
+    await send({"type": "http.response.start", "status": status, "headers": headers + _cors_headers(request_headers)})
+    await send({"type": "http.response.body", "body": content})
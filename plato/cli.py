@@ -1,14 +1,31 @@
+import os
+import threading
+import urllib.request
+from http import HTTPStatus
 from typing import Optional
 
 import click
+import smart_open
 from flask import Flask
 from flask.cli import with_appcontext
+from flask_migrate import stamp
+from sqlalchemy.exc import NoResultFound
 import json
+
+from .api import TemplateRevisionNotFound, pinned_template, query_template_revision
+from .compose import ALL_AVAILABLE_MIME_TYPES, PDF_MIME
 from .db import db
-from .db.models import Template
+from .db.models import Template, TemplateRevision
+from .db.template_events import RevisionFilesUnavailable, TemplateListener, TemplateSync
+from .error_messages import template_not_found
 from .file_storage import StorageType
 from .settings import TEMPLATE_DIRECTORY, TEMPLATE_DIRECTORY_NAME, STORAGE_TYPE
+from .util.bench_util import parse_mime_mix, run_load
+from .util.bulk_compose import DEFAULT_FILE_NAME, BulkComposeJob, BulkProgress, InvalidCheckpoint, compose_bulk
+from .util.import_report import measure_import_times
 from .util.setup_util import initialize_file_storage
+from .util.snapshot import InvalidSnapshot, create_snapshot, restore_snapshot, template_revisions
+from .util.template_transfer import BATCH_SIZE, InvalidTemplateLine, export_templates, import_templates
 
 
 def register_cli_commands(app: Flask):
@@ -49,6 +66,55 @@ def register_cli_commands(app: Flask):
         template = Template.query.filter_by(id=template_id).one()
         json.dump(template.json_dict(), output)
 
+    @app.cli.command("export-all")
+    @click.argument("output", type=click.File("w"))
+    @click.option("--with-files", is_flag=True, help="Include the template and static files from the file storage")
+    @with_appcontext
+    def export_all_templates(output, with_files: bool):
+        """
+        Export every template to a NDJSON file, one template per line
+        Args:
+            output: output file, - for stdout
+            with_files: whether to include the template files, base64 encoded
+        """
+        file_storage = initialize_file_storage(STORAGE_TYPE) if with_files else None
+        exported = export_templates(output, file_storage, TEMPLATE_DIRECTORY_NAME)
+        click.echo(f"Exported {exported} templates", err=True)
+
+    @app.cli.command("import-all")
+    @click.argument("input_file", type=click.File("r"))
+    @click.option("--batch-size", default=BATCH_SIZE, type=click.IntRange(min=1),
+                  help="Number of templates sent to the database at once")
+    @with_appcontext
+    def import_all_templates(input_file, batch_size: int):
+        """
+        Import the templates of a NDJSON file, as written by export-all, in a single transaction.
+        Existing templates are updated, and the files included are saved to the file storage.
+        Args:
+            input_file: input file, - for stdin
+            batch_size: number of templates sent to the database at once
+        """
+        file_storage = initialize_file_storage(STORAGE_TYPE)
+        try:
+            summary = import_templates(input_file, file_storage, TEMPLATE_DIRECTORY_NAME, batch_size)
+        except InvalidTemplateLine as e:
+            raise click.ClickException(f"No template was imported. {e.message}")
+        click.echo(f"Imported {summary.templates} templates and {summary.files} files")
+
+    @app.cli.command("create-db")
+    @with_appcontext
+    def create_db():
+        """
+        Create the tables of a new SQLite database, e.g. for an edge node, and mark it as up to date with the
+        migrations, which only apply to Postgres
+        """
+        if db.engine.dialect.name == "postgresql":
+            raise click.ClickException("Postgres databases are created by the migrations, run flask db upgrade instead")
+        # the primary database only, not the read replicas
+        db.create_all(bind_key=None)
+        stamp()
+        click.echo(f"Created the tables on {db.engine.url!r}")
+
     @app.cli.command("refresh")
     @with_appcontext
     def refresh_local_templates():
@@ -58,3 +124,216 @@ def register_cli_commands(app: Flask):
         file_storage = initialize_file_storage(STORAGE_TYPE)
         with app.app_context():
             file_storage.load_templates(TEMPLATE_DIRECTORY, TEMPLATE_DIRECTORY_NAME)
+
+    @app.cli.command("listen-templates")
+    @click.option("--catch-up", is_flag=True,
+                  help="Pull every template once listening, e.g. when restarting a listener which stopped")
+    @with_appcontext
+    def listen_templates(catch_up: bool):
+        """
+        Keep the local templates of this node up to date, pulling the files of every template created or updated
+        on any node, as published on Postgres
+        Args:
+            catch_up: whether to pull every template once listening, as changes may have been missed
+        """
+        if db.engine.dialect.name != "postgresql":
+            raise click.ClickException("Template changes are only published on Postgres")
+        file_storage = initialize_file_storage(STORAGE_TYPE)
+        template_sync = TemplateSync(file_storage, TEMPLATE_DIRECTORY, TEMPLATE_DIRECTORY_NAME,
+                                     app.config["render_cache"])
+        TemplateListener(template_sync).run(catch_up=catch_up)
+
+    @app.cli.command("snapshot-create")
+    @click.argument("output", type=click.STRING)
+    @click.option("--refresh", is_flag=True, help="Load the templates from the file storage before packing them")
+    @with_appcontext
+    def snapshot_create(output: str, refresh: bool):
+        """
+        Pack the template rows and the local template files in a single archive, to bootstrap nodes with
+        snapshot-restore
+        Args:
+            output: output path or URL, e.g. s3://bucket/snapshots/templates.tar.gz
+            refresh: whether to load the templates from the file storage first
+        """
+        revisions = template_revisions()
+        if refresh:
+            file_storage = initialize_file_storage(STORAGE_TYPE)
+            file_storage.load_templates(TEMPLATE_DIRECTORY, TEMPLATE_DIRECTORY_NAME)
+        with smart_open.open(output, "wb", compression="disable") as output_file:
+            template_count = create_snapshot(output_file, TEMPLATE_DIRECTORY, revisions)
+        click.echo(f"Packed {template_count} templates in {output}")
+
+    @app.cli.command("snapshot-restore")
+    @click.argument("source", type=click.STRING)
+    @click.option("--with-db", is_flag=True, help="Also upsert the template rows of the snapshot in the database")
+    @with_appcontext
+    def snapshot_restore(source: str, with_db: bool):
+        """
+        Replace the local templates with the ones of a snapshot, read as a stream, and then load the templates
+        changed since the snapshot from the file storage
+        Args:
+            source: snapshot path or URL, e.g. s3://bucket/snapshots/templates.tar.gz
+            with_db: whether to upsert the template rows as well
+        """
+        file_storage = initialize_file_storage(STORAGE_TYPE)
+        try:
+            with smart_open.open(source, "rb", compression="disable") as source_file:
+                summary = restore_snapshot(source_file, TEMPLATE_DIRECTORY, file_storage, TEMPLATE_DIRECTORY_NAME,
+                                           restore_templates=with_db)
+        except (InvalidSnapshot, InvalidTemplateLine) as e:
+            raise click.ClickException(f"The snapshot was not restored. {e.message}")
+        click.echo(f"Restored {summary.templates} templates, "
+                   f"{len(summary.refreshed_template_ids)} loaded from the file storage")
+
+    @app.cli.command("compose-bulk")
+    @click.argument("template_id", type=click.STRING)
+    @click.argument("input_file", type=click.STRING)
+    @click.argument("output", type=click.STRING)
+    @click.option("--mime-type", default=PDF_MIME, type=click.Choice(ALL_AVAILABLE_MIME_TYPES),
+                  help="Type of the files to compose")
+    @click.option("--file-name", default=DEFAULT_FILE_NAME, type=click.STRING, show_default=True,
+                  help="Name of the file of each line, formatted with line, p (the compose data), template_id, "
+                       "revision and extension, e.g. {p[serial_number]}{extension}")
+    @click.option("--workers", default=os.cpu_count() or 1, type=click.IntRange(min=1),
+                  help="Number of worker processes, the number of cores by default")
+    @click.option("--revision", default=None, type=click.IntRange(min=1),
+                  help="Template revision to compose, the current one by default")
+    @click.option("--restart", is_flag=True, help="Compose every line again, instead of resuming from the checkpoint")
+    @with_appcontext
+    def compose_bulk_command(template_id: str, input_file: str, output: str, mime_type: str, file_name: str,
+                             workers: int, revision: Optional[int], restart: bool):
+        """
+        Compose every line of a NDJSON file of compose data, across a pool of processes, without going through the
+        API. An interrupted run resumes where it stopped when run again, as does a run with failed lines, composing
+        those again.
+        Args:
+            template_id: the template to compose
+            input_file: NDJSON path or URL, e.g. s3://bucket/runs/payloads.ndjson
+            output: output directory or storage prefix, e.g. s3://bucket/runs/certificates
+            mime_type: type of the files to compose
+            file_name: name of the file of each line, a format string
+            workers: number of worker processes
+            revision: template revision, the current one when None
+            restart: whether to ignore the checkpoint of a previous run
+        """
+        try:
+            template = query_template_revision(db.session, template_id, revision)
+        except TemplateRevisionNotFound as e:
+            raise click.ClickException(e.message)
+        except NoResultFound:
+            raise click.ClickException(template_not_found.format(template_id))
+        if isinstance(template, TemplateRevision):
+            try:
+                template = pinned_template(template)
+            except RevisionFilesUnavailable as e:
+                raise click.ClickException(e.message)
+        db.session.expunge_all()
+        # connections must not be shared with the forked workers
+        db.engine.dispose()
+
+        def report_progress(progress: BulkProgress):
+            click.echo(f"Composed {progress.composed} lines, {progress.failed} failed, "
+                       f"{progress.throughput:.1f} lines/s", err=True)
+
+        def report_failure(line_number: int, message: str):
+            click.echo(f"Line {line_number}: {message}", err=True)
+
+        job = BulkComposeJob(app=app, template=template, mime_type=mime_type, output=output, file_name=file_name)
+        try:
+            with smart_open.open(input_file, "r", encoding="utf-8") as lines:
+                progress = compose_bulk(job, lines, input_file, workers, resume=not restart,
+                                        on_progress=report_progress, on_failure=report_failure)
+        except InvalidCheckpoint as e:
+            raise click.ClickException(f"{e.message}. Run with --restart to compose every line again")
+        if progress.resumed_from:
+            click.echo(f"Resumed after line {progress.resumed_from}, "
+                       f"composing the {progress.retried} lines which failed before again")
+        click.echo(f"Composed {progress.composed} lines in {progress.elapsed:.1f}s to {output}, "
+                   f"{progress.failed} failed")
+        if progress.failed:
+            raise click.ClickException(f"{progress.failed} lines could not be composed")
+
+    @app.cli.command("bench")
+    @click.option("--url", default=None, type=click.STRING,
+                  help="Base URL of a running Plato, e.g. http://localhost:5000. Runs in-process when omitted.")
+    @click.option("--concurrency", default=4, type=click.IntRange(min=1), help="Number of concurrent clients")
+    @click.option("--duration", default=30.0, type=click.FloatRange(min=0.1), help="Duration in seconds")
+    @click.option("--mime-type", "mime_mix", multiple=True, default=[PDF_MIME],
+                  help="MIME type to request, optionally weighted, e.g. image/png=3. May be repeated.")
+    @with_appcontext
+    def bench(url: Optional[str], concurrency: int, duration: float, mime_mix: tuple):
+        """
+        Load test the compose pipeline by replaying every template's example composition
+        Args:
+            url: base url of the Plato instance to target, in-process when None
+            concurrency: number of concurrent clients
+            duration: duration of the run in seconds
+            mime_mix: MIME types to request, with optional weights
+        """
+        try:
+            mime_weights = parse_mime_mix(mime_mix)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--mime-type")
+        unsupported_mime_types = set(mime_weights).difference(ALL_AVAILABLE_MIME_TYPES)
+        if unsupported_mime_types:
+            raise click.BadParameter(f"Unsupported MIME types: {', '.join(unsupported_mime_types)}",
+                                     param_hint="--mime-type")
+
+        compositions = [(template.id, template.example_composition) for template in Template.query.all()]
+        if not compositions:
+            raise click.ClickException("There are no templates to compose")
+
+        thread_local = threading.local()
+
+        def compose_in_process(template_id: str, compose_data: dict, mime_type: str):
+            if not hasattr(thread_local, "client"):
+                thread_local.client = app.test_client()
+            response = thread_local.client.post(f"/template/{template_id}/compose", json=compose_data,
+                                                headers={"Accept": mime_type})
+            if response.status_code != HTTPStatus.OK:
+                raise RuntimeError(response.status_code)
+
+        def compose_remotely(template_id: str, compose_data: dict, mime_type: str):
+            compose_request = urllib.request.Request(f"{url.rstrip('/')}/template/{template_id}/compose",
+                                                     data=json.dumps(compose_data).encode("utf-8"),
+                                                     headers={"Accept": mime_type,
+                                                              "Content-Type": "application/json"},
+                                                     method="POST")
+            with urllib.request.urlopen(compose_request) as response:
+                response.read()
+
+        click.echo(f"Replaying {len(compositions)} example compositions with {concurrency} clients "
+                   f"for {duration:g}s against {url or 'the in-process app'}")
+        summaries = run_load(compose_remotely if url else compose_in_process,
+                             compositions, mime_weights, concurrency, duration)
+
+        click.echo(f"{'mime type':<20}{'requests':>10}{'error %':>10}{'req/s':>10}"
+                   f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for mime_type, summary in summaries.items():
+            click.echo(f"{mime_type:<20}{summary.count + summary.errors:>10}{summary.error_rate:>10.1%}{summary.throughput:>10.2f}"
+                       f"{summary.p50 * 1000:>10.1f}{summary.p95 * 1000:>10.1f}{summary.p99 * 1000:>10.1f}")
+
+    @app.cli.command("import-report")
+    @click.option("--module", default="main", type=click.STRING, help="Module to be imported")
+    @click.option("--top", default=20, type=click.IntRange(min=1), help="Number of slowest modules to list")
+    @click.option("--max-ms", default=None, type=click.FloatRange(min=0),
+                  help="Fail if importing the module takes longer than this, in milliseconds")
+    def import_report(module: str, top: int, max_ms: Optional[float]):
+        """
+        Reports the import time of a module in a fresh interpreter, listing the slowest imports
+        Args:
+            module: the module to be imported
+            top: number of slowest modules to list
+            max_ms: import time budget for the module in milliseconds
+        """
+        import_times = measure_import_times(module)
+        total_ms = max((import_time.cumulative_us for import_time in import_times), default=0) / 1000
+
+        click.echo(f"{'self ms':>10}{'cumulative ms':>15}  module")
+        for import_time in sorted(import_times, key=lambda import_time: import_time.self_us, reverse=True)[:top]:
+            click.echo(f"{import_time.self_us / 1000:>10.1f}{import_time.cumulative_us / 1000:>15.1f}  "
+                       f"{import_time.module}")
+        click.echo(f"Importing {module} took {total_ms:.1f}ms")
+
+        if max_ms is not None and total_ms > max_ms:
+            raise click.ClickException(f"Importing {module} took {total_ms:.1f}ms, over the {max_ms:g}ms budget")
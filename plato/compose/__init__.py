@@ -1,4 +1,4 @@
-from .renderer import Renderer, PDF_MIME, OCTET_STREAM, PNG_MIME
+from .renderer import Renderer, PDF_MIME, OCTET_STREAM, PNG_MIME, JPEG_MIME, WEBP_MIME
 from .jinja_filters import num_to_ordinal, format_dates, nth
 ALL_AVAILABLE_MIME_TYPES = list(Renderer.renderers.keys())
 AVAILABLE_IMG_MIME_TYPES = [key for key in Renderer.renderers.keys() if key.startswith("image")]
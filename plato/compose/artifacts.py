@@ -0,0 +1,115 @@
+"""
+Rendered artifacts of a template which only change with the template revision, such as its thumbnail and its
+example outputs. They are rendered once per revision and kept in the file storage, so serving them again costs no
+renders.
+"""
+import copy
+import io
+import logging
+from contextlib import nullcontext
+from mimetypes import guess_extension
+from typing import Callable, ContextManager, Optional
+
+from flask import Flask
+
+from plato.compose.renderer import compose, PNG_MIME, PDF_MIME
+from plato.compose.scheduler import Priority, RenderScheduler
+from plato.compose.single_flight import SingleFlight
+from plato.db.models import Template
+from plato.file_storage import PlatoFileStorage
+from plato.util.path_util import thumbnail_path, example_path
+
+logger = logging.getLogger(__name__)
+
+PRERENDERED_EXAMPLE_MIME_TYPES = [PDF_MIME, PNG_MIME]
+# the client the pre-renders are scheduled for
+PRERENDER_CLIENT_ID = "plato-prerender"
+
+
+def get_thumbnail(template: Template, storage: PlatoFileStorage, template_dir: str, width: int,
+                  single_flight: SingleFlight, render_slot: Callable[[], ContextManager] = nullcontext) -> bytes:
+    """
+    Gets the thumbnail for the template's current revision: a PNG of the first page of its example composition,
+    rendered and stored the first time it is requested.
+
+    Args:
+        template: The Template model
+        storage: The file storage the thumbnail is kept in
+        template_dir: The template directory on the file storage
+        width: The thumbnail width in pixels
+        single_flight: Coalesces concurrent renders of the same thumbnail
+        render_slot: Context to render in, e.g. a slot of the render scheduler. Only entered when actually rendering,
+         not when the thumbnail is stored or being rendered by another request.
+
+    Returns:
+        bytes: The thumbnail PNG
+    """
+    path = thumbnail_path(template_dir, template.id, template.revision, width)
+
+    def render_and_store() -> bytes:
+        content = storage.read_file(path)
+        if content is None:
+            with render_slot():
+                # the example is copied as rendering the QR codes alters it
+                content = compose(template, copy.deepcopy(template.example_composition), PNG_MIME,
+                                  width=width, page=0).getvalue()
+            storage.save_file(io.BytesIO(content), path)
+        return content
+
+    return storage.read_file(path) or single_flight.do(f"thumbnail:{path}", render_and_store)
+
+
+def get_prerendered_example(template: Template, storage: PlatoFileStorage, template_dir: str,
+                            mime_type: str) -> Optional[bytes]:
+    """
+    Gets the stored example output for the template's current revision, the whole document for PDF
+    or the first page for PNG.
+
+    Args:
+        template: The Template model
+        storage: The file storage the examples are kept in
+        template_dir: The template directory on the file storage
+        mime_type: The example MIME type
+
+    Returns:
+        Optional[bytes]: The example output, or None if it was not pre-rendered (yet)
+    """
+    if mime_type not in PRERENDERED_EXAMPLE_MIME_TYPES:
+        return None
+    return storage.read_file(example_path(template_dir, template.id, template.revision, guess_extension(mime_type)))
+
+
+def prerender_examples(app: Flask, template_id: str, template_dir: str, thumbnail_width: int) -> None:
+    """
+    Renders the example outputs and the thumbnail of the template's current revision and stores them.
+    Meant to be run in the background after a template is created or updated, errors are logged and not raised.
+
+    Args:
+        app: The Flask app
+        template_id: The id of the template
+        template_dir: The template directory on the file storage
+        thumbnail_width: The thumbnail width in pixels
+    """
+    with app.app_context():
+        storage: PlatoFileStorage = app.config["storage"]
+        template = Template.query.filter_by(id=template_id).one_or_none()
+        if template is None:
+            return
+
+        # pre-rendering is bulk work, it must not hold up the interactive renders
+        scheduler: RenderScheduler = app.config["render_scheduler"]
+        for mime_type in PRERENDERED_EXAMPLE_MIME_TYPES:
+            path = example_path(template_dir, template.id, template.revision, guess_extension(mime_type))
+            try:
+                with scheduler.slot(Priority.BULK, [template.id], PRERENDER_CLIENT_ID):
+                    # the example is copied as rendering the QR codes alters it
+                    content = compose(template, copy.deepcopy(template.example_composition), mime_type)
+                storage.save_file(content, path)
+            except Exception:
+                logger.exception("Unable to pre-render the %s example of template '%s'", mime_type, template_id)
+
+        try:
+            get_thumbnail(template, storage, template_dir, thumbnail_width, app.config["single_flight"],
+                          lambda: scheduler.slot(Priority.BULK, [template.id], PRERENDER_CLIENT_ID))
+        except Exception:
+            logger.exception("Unable to pre-render the thumbnail of template '%s'", template_id)
@@ -0,0 +1,88 @@
+"""
+Binary attachments of multipart compose requests.
+
+Files sent alongside the compose data, e.g. photos or signatures, are stored as they are in a temporary directory and
+referenced from the compose data by their part name, as "attachment:<part name>". Before rendering, the references are
+replaced with the file URL of the attachment, so the template uses them like any other image source and weasyprint
+loads them straight from disk, with no base64 encoding or decoding involved.
+"""
+import hashlib
+from mimetypes import guess_extension
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Mapping
+
+from werkzeug.datastructures import FileStorage
+
+ATTACHMENT_PREFIX = "attachment:"
+CHUNK_SIZE = 64 * 1024
+
+
+class UnknownAttachment(ValueError):
+    """
+    Exception to be raised when the compose data references an attachment that was not sent
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+class Attachment(NamedTuple):
+    """
+    An attachment stored on disk.
+    """
+    path: Path
+    digest: str
+
+
+def save_attachments(files: Mapping[str, FileStorage], directory: str) -> Dict[str, Attachment]:
+    """
+    Stores the attached files in the directory, byte for byte, hashing them along the way.
+
+    Args:
+        files: The attached files by part name
+        directory: The directory to store them in, removed by the caller once the composition is done
+
+    Returns:
+        Dict[str, Attachment]: The stored attachments by part name
+    """
+    attachments = dict()
+    for index, (name, file) in enumerate(files.items()):
+        # the part name is not used in the path, only the extension is kept, which weasyprint needs for SVG images
+        extension = Path(file.filename or "").suffix or guess_extension(file.mimetype or "") or ""
+        path = Path(directory, f"{index}{extension}")
+        digest = hashlib.sha256()
+        with open(path, mode="wb") as attachment_file:
+            for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                attachment_file.write(chunk)
+        attachments[name] = Attachment(path=path, digest=digest.hexdigest())
+    return attachments
+
+
+def resolve_attachments(compose_data: Any, attachments: Mapping[str, Attachment]) -> Any:
+    """
+    Replaces the attachment references in the compose data with the file URLs of the attachments.
+    The compose data is not altered, a copy is returned.
+
+    Args:
+        compose_data: The data to fill the template with
+        attachments: The stored attachments by part name
+
+    Raises:
+        UnknownAttachment: When an attachment that was not sent is referenced
+
+    Returns:
+        The compose data with the references replaced
+    """
+    if isinstance(compose_data, dict):
+        return {key: resolve_attachments(value, attachments) for key, value in compose_data.items()}
+    if isinstance(compose_data, list):
+        return [resolve_attachments(value, attachments) for value in compose_data]
+    if isinstance(compose_data, str) and compose_data.startswith(ATTACHMENT_PREFIX):
+        name = compose_data[len(ATTACHMENT_PREFIX):]
+        if name not in attachments:
+            raise UnknownAttachment(f"Attachment '{name}' is referenced but was not sent")
+        return attachments[name].path.resolve().as_uri()
+    return compose_data
@@ -1,14 +1,70 @@
 from datetime import datetime
-from typing import Union
-
-from babel import dates
-from num2words import num2words
+from functools import lru_cache
+from typing import Callable, Optional, TypeVar, Union
 
 # If a new formatter is implemented, it should be added to the FILTERS list in the __init__.py file so that it
-# is loaded into the Jinja environment
+# is loaded into the Jinja environment.
+# babel and num2words are only imported on first use, as they are slow to import and most processes never call them.
+
+
+# Filters are called thousands of times per render by templates with long tables, usually with few distinct values,
+# so their results are memoized per value and locale.
+FILTER_CACHE_SIZE = 4096
+
+T = TypeVar("T")
+
+
+def _memoized(function: Callable[..., T], *args) -> T:
+    """
+    Calls a memoized function, bypassing the cache when an argument is unhashable, e.g. a list from the compose data,
+    so that the filter fails or succeeds as it would without memoization.
+
+    Args:
+        function: The function, decorated with lru_cache
+        *args: The arguments to call it with
+
+    Returns:
+        T: The result of the function
+    """
+    try:
+        hash(args)
+    except TypeError:
+        return function.__wrapped__(*args)
+    return function(*args)
 
 
-def format_dates(date_str: str, format_='d MMMM yyyy') -> str:
+@lru_cache(maxsize=None)
+def _babel_locale(locale: Optional[str]):
+    """
+    Gets the babel Locale, parsed only once per locale identifier.
+
+    Args:
+        locale: The locale identifier, e.g. 'en_GB', or None for the default time locale of the process
+
+    Returns:
+        babel.Locale: The locale
+    """
+    from babel import Locale, dates
+
+    return Locale.parse(locale or dates.LC_TIME)
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _format_date(date_str: str, format_: str, locale: Optional[str]) -> str:
+    from babel import dates
+
+    date = datetime.fromisoformat(date_str)
+    return dates.format_datetime(date, format_, locale=_babel_locale(locale))
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _ordinal(number: Union[int, str], locale: str) -> str:
+    from num2words import num2words
+
+    return num2words(number, to='ordinal_num', lang=locale)
+
+
+def format_dates(date_str: str, format_='d MMMM yyyy', locale: Optional[str] = None) -> str:
     """
     Formats a date in ISO 8601 format to any valid babel format given as input.
 
@@ -16,21 +72,23 @@ def format_dates(date_str: str, format_='d MMMM yyyy') -> str:
     '1 January 2020'
     >>> format_dates('2020-01-01', 'dd-MMM-yy')
     '01-Jan-20'
+    >>> format_dates('2020-01-01', locale='pt_PT')
+    '1 janeiro 2020'
 
     To check additional formats: http://babel.pocoo.org/en/latest/dates.html#date-fields
 
     Args:
         date_str: The date string in ISO 8601 format
         format_: The intended format for the date, using babel syntax
+        locale: The locale to format the date in, e.g. 'pt_PT', or the default time locale of the process if None
 
     Returns: The formatted string with the specified date format, or the default one
 
     """
-    date = datetime.fromisoformat(date_str)
-    return dates.format_datetime(date, format_)
+    return _memoized(_format_date, date_str, format_, locale)
 
 
-def num_to_ordinal(number: Union[int, str]) -> str:
+def num_to_ordinal(number: Union[int, str], locale: str = 'en') -> str:
     """
     Formats a given cardinal number (can be int or string) into an ordinal number.
 
@@ -40,16 +98,19 @@ def num_to_ordinal(number: Union[int, str]) -> str:
     '3rd'
     >>> num_to_ordinal(10)
     '10th'
+    >>> num_to_ordinal(10, 'fr')
+    '10me'
 
     Args:
         number: A cardinal number in string or int format
+        locale: The num2words language code of the ordinal, e.g. 'fr'
 
     Returns: The number in ordinal format, also as a string
     """
-    return num2words(number, to='ordinal_num')
+    return _memoized(_ordinal, number, locale)
 
 
-def nth(number: Union[str, int]) -> str:
+def nth(number: Union[str, int], locale: str = 'en') -> str:
     """
     Returns the suffix of an ordinal number, obtained from the cardinal number
     For example:
@@ -62,7 +123,18 @@ def nth(number: Union[str, int]) -> str:
 
     Args:
         number: A cardinal number in string or int format
+        locale: The num2words language code of the ordinal, e.g. 'fr'
 
     Returns: The suffix of the ordinal number
     """
-    return num_to_ordinal(number)[-2:]
+    if locale == 'en':
+        try:
+            value = int(number) if isinstance(number, (int, str)) else -1
+        except ValueError:
+            value = -1
+        if value >= 0:
+            # the English suffix only depends on the last two digits, no need to spell out the ordinal
+            if value % 100 in (11, 12, 13):
+                return 'th'
+            return {1: 'st', 2: 'nd', 3: 'rd'}.get(value % 10, 'th')
+    return num_to_ordinal(number, locale)[-2:]
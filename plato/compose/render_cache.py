@@ -0,0 +1,202 @@
+"""
+Host-wide cache of rendered outputs, shared by every worker process on the host.
+
+The entries are kept in a SQLite database in WAL mode, so the workers read it concurrently without blocking each other
+and a composition rendered by any of them is served by all the others. The cache is bounded by a byte budget, the least
+recently used entries being evicted first. Keys identify the rendered content, e.g. a compose_key, so entries never
+need to be invalidated, a new template revision being a new key. The entries of a template, keyed by template_key, are
+still evicted when it changes, so the space they take is freed right away.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# the access time of an entry is only updated when older than this, in seconds, so hot entries do not turn every read
+# into a write
+ACCESS_TIME_RESOLUTION = 1.0
+CONNECTION_TIMEOUT = 5.0
+TEMPLATE_KEY_PREFIX = "template:"
+
+
+def template_key(template_id: str, key: str) -> str:
+    """
+    Key of an entry rendered from a template, so the entries of the template can be evicted together.
+    The template id is length prefixed, as it may contain ":" itself, so the keys of a template never start with the
+    keys of another one, e.g. "template:1:a:..." and "template:3:a:b:...".
+
+    Args:
+        template_id: The id of the template
+        key: The key identifying the rendered content, e.g. a compose_key
+
+    Returns:
+        str: The key of the entry
+    """
+    return f"{TEMPLATE_KEY_PREFIX}{len(template_id)}:{template_id}:{key}"
+
+
+class RenderCache:
+    """
+    Byte budgeted, least recently used, cache shared between the processes of the host.
+
+        Typical usage:
+
+            render_cache = RenderCache("/var/cache/plato/render.db", max_bytes=512 * 1024 * 1024)
+            output = render_cache.get_or_render(key, lambda: compose(template, compose_data, mime_type).getvalue())
+
+    """
+
+    def __init__(self, path: Optional[str], max_bytes: int):
+        """
+        Args:
+            path: The SQLite database file, created if needed, nothing is cached when None
+            max_bytes: The byte budget for the cached content
+        """
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._transaction() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS entry ("
+                                   "key TEXT PRIMARY KEY, content BLOB NOT NULL, size INTEGER NOT NULL, "
+                                   "accessed_at REAL NOT NULL)")
+                connection.execute("CREATE INDEX IF NOT EXISTS entry_accessed_at ON entry (accessed_at)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Gets a cached entry, marking it as recently used.
+
+        Args:
+            key: The key of the entry
+
+        Returns:
+            Optional[bytes]: The cached content, or None if it is not cached
+        """
+        if self.path is None:
+            return None
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT content, accessed_at FROM entry WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            logger.exception("Could not read from the render cache")
+            return None
+        if row is None:
+            return None
+
+        content, accessed_at = row
+        if accessed_at < now - ACCESS_TIME_RESOLUTION:
+            try:
+                connection.execute("UPDATE entry SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error:
+                logger.warning("Could not mark a render cache entry as used", exc_info=True)
+        return content
+
+    def put(self, key: str, content: bytes) -> None:
+        """
+        Caches an entry, evicting the least recently used ones to keep within the byte budget.
+        Entries larger than the whole budget are not cached.
+
+        Args:
+            key: The key of the entry
+            content: The content to cache
+        """
+        if self.path is None or len(content) > self.max_bytes:
+            return
+        try:
+            with self._transaction() as connection:
+                connection.execute("INSERT OR REPLACE INTO entry (key, content, size, accessed_at) VALUES (?, ?, ?, ?)",
+                                   (key, content, len(content), time.time()))
+                self._evict(connection)
+        except sqlite3.Error:
+            logger.exception("Could not write to the render cache")
+
+    def evict_template(self, template_id: str) -> int:
+        """
+        Evicts every entry rendered from a template, see template_key.
+
+        Args:
+            template_id: The id of the template
+
+        Returns:
+            int: The number of entries evicted
+        """
+        if self.path is None:
+            return 0
+        prefix = template_key(template_id, "")
+        # a range on the primary key, ";" being the character after ":"
+        try:
+            with self._transaction() as connection:
+                return connection.execute("DELETE FROM entry WHERE key >= ? AND key < ?",
+                                          (prefix, f"{prefix[:-1]};")).rowcount
+        except sqlite3.Error:
+            logger.exception("Could not evict from the render cache")
+            return 0
+
+    def get_or_render(self, key: str, render: Callable[[], bytes]) -> bytes:
+        """
+        Gets a cached entry, rendering and caching it if it is not cached.
+
+        Args:
+            key: The key of the entry
+            render: Renders the content
+
+        Returns:
+            bytes: The content
+        """
+        content = self.get(key)
+        if content is None:
+            content = render()
+            self.put(key, content)
+        return content
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        """
+        Deletes the least recently used entries until the cache is within its byte budget.
+        """
+        excess = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entry").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        evicted_keys = []
+        for key, size in connection.execute("SELECT key, size FROM entry ORDER BY accessed_at"):
+            evicted_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM entry WHERE key = ?", evicted_keys)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        The connection of the current thread, in autocommit mode. Connections are not shared with forked processes,
+        e.g. the workers.
+        """
+        connection: Optional[sqlite3.Connection] = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=CONNECTION_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Runs the statements of the context in a single immediate transaction, so concurrent writers queue up front
+        instead of failing when upgrading a read to a write. Readers are not blocked.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
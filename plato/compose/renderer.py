@@ -1,22 +1,35 @@
+import hashlib
 import io
+import json
 import tempfile
+import time
 from abc import abstractmethod, ABC
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
 from flask import current_app
+from jinja2 import Template as JinjaTemplate
 from jmespath import search
 from mimetypes import guess_extension
-from typing import Optional, Type, ClassVar, Dict, List
-from qrcode import make
+from typing import Optional, Type, ClassVar, Dict, List, Sequence, NamedTuple, Mapping, Iterator, Tuple, Callable, \
+    ContextManager, Iterable
 from tempfile import TemporaryDirectory
-from weasyprint import HTML
-from jsonschema import validate as validate_schema
+from jsonschema import validators
+from jsonschema.exceptions import best_match, ValidationError
 
+from plato.compose.attachments import Attachment, resolve_attachments
 from plato.db.models import Template
 
 PDF_MIME = "application/pdf"
 HTML_MIME = "text/html"
 PNG_MIME = "image/png"
+JPEG_MIME = "image/jpeg"
+WEBP_MIME = "image/webp"
 OCTET_STREAM = "application/octet-stream"
 
+# size, in bytes, of the chunks the streamed HTML is sent in
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class RendererNotFound(Exception):
     """
@@ -37,6 +50,94 @@ class InvalidPageNumber(ValueError):
         super().__init__()
 
 
+class InvalidRenderOption(ValueError):
+    """
+    Exception to be raised when a render option, such as the quality or compression level, is out of range
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__()
+
+
+class RenderBudgetExceeded(Exception):
+    """
+    Exception to be raised when a render goes over its page, output size or raster size budget
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+class RenderTimeExceeded(RenderBudgetExceeded):
+    """
+    Exception to be raised when rendering the Jinja template takes longer than its time budget
+    """
+    ...
+
+
+class RenderBudget(NamedTuple):
+    """
+    Limits on the resources a single render may use, None meaning unlimited.
+    The global budget is set on the app config as RENDER_BUDGET, and each of its limits can be overridden per template
+    in the "render_budget" entry of the template metadata.
+
+    Attributes:
+        render_time: Seconds the Jinja template may take to render
+        max_pages: Maximum number of pages of the laid out document
+        max_output_bytes: Maximum size of the composed file
+        max_raster_pixels: Maximum number of pixels of a printed image
+    """
+    render_time: Optional[float] = None
+    max_pages: Optional[int] = None
+    max_output_bytes: Optional[int] = None
+    max_raster_pixels: Optional[int] = None
+
+    def override(self, overrides: dict) -> 'RenderBudget':
+        """
+        Builds a budget with some of the limits replaced, ignoring unknown limits.
+
+        Args:
+            overrides: The limits to be replaced
+
+        Returns:
+            RenderBudget: The new budget
+        """
+        return self._replace(**{name: value for name, value in overrides.items() if name in self._fields})
+
+    def check_pages(self, pages: int) -> None:
+        if self.max_pages is not None and pages > self.max_pages:
+            raise RenderBudgetExceeded(f"The document has {pages} pages, the maximum is {self.max_pages}")
+
+    def check_output_size(self, output_bytes: int) -> None:
+        if self.max_output_bytes is not None and output_bytes > self.max_output_bytes:
+            raise RenderBudgetExceeded(f"The composed file has {output_bytes} bytes, "
+                                       f"the maximum is {self.max_output_bytes}")
+
+    def check_raster_pixels(self, width: float, height: float) -> None:
+        if self.max_raster_pixels is not None and width * height > self.max_raster_pixels:
+            raise RenderBudgetExceeded(f"The image would be {round(width)}x{round(height)} pixels, "
+                                       f"the maximum is {self.max_raster_pixels} pixels")
+
+
+def render_budget(template: Template) -> RenderBudget:
+    """
+    The budget for rendering the template: the app's global budget with the template's own overrides.
+    Must be called within the app context.
+
+    Args:
+        template: The Template model
+
+    Returns:
+        RenderBudget: The budget
+    """
+    global_budget: RenderBudget = current_app.config.get("RENDER_BUDGET", RenderBudget())
+    return global_budget.override(template.get_render_budget())
+
+
 class Renderer(ABC):
     """
     Renderer is a factory for every Renderer subclass.
@@ -60,6 +161,7 @@ class Renderer(ABC):
 
     def __init__(self, template_model: Template):
         self.template_model = template_model
+        self._budget: Optional[RenderBudget] = None
 
     def compose_html(self, compose_data: dict) -> str:
         """
@@ -71,28 +173,66 @@ class Renderer(ABC):
         Returns:
             str: HTML string for composed file.
         """
+        if self.budget.render_time is None:
+            jinja_template, context = self._jinja_template(compose_data)
+            return jinja_template.render(**context)
+        return "".join(self.generate_html(compose_data))
+
+    def generate_html(self, compose_data: dict) -> Iterator[str]:
+        """
+        Generates the template HTML in chunks, as Jinja2 renders it, so it can be sent or written before it is complete.
+
+        Args:
+            compose_data: The data to fill the template with
+
+        Raises:
+            RenderTimeExceeded: When rendering takes longer than the template's time budget
+
+        Returns:
+            Iterator[str]: The chunks of the HTML
+        """
+        jinja_template, context = self._jinja_template(compose_data)
+        render_time = self.budget.render_time
+        # checked after each chunk, so a template running over its time budget is cut off instead of being rendered in
+        # full
+        deadline = time.monotonic() + render_time if render_time is not None else None
+        for chunk in jinja_template.generate(**context):
+            yield chunk
+            if deadline is not None and time.monotonic() > deadline:
+                raise RenderTimeExceeded(f"Rendering the template took longer than {render_time} seconds")
+
+    def _jinja_template(self, compose_data: dict) -> Tuple[JinjaTemplate, dict]:
         jinjaenv = current_app.config["JINJAENV"]
         static_directory = current_app.config["TEMPLATE_STATIC"]
-        template_static_directory = f"{static_directory}/{self.template_model.id}/"
-        base_static_directory = f"{static_directory}/"
 
+        files_id = self.template_model.files_id
         jinja_template = jinjaenv.get_template(
-            name=f"{self.template_model.id}/{self.template_model.id}"
+            name=f"{files_id}/{files_id}"
         )  # template id works for the file as well
+        context = dict(p=compose_data,
+                       base_static=f"{static_directory}/",
+                       template_static=f"{static_directory}/{files_id}/")
+        return jinja_template, context
 
-        return jinja_template.render(p=compose_data,
-                                     base_static=base_static_directory,
-                                     template_static=template_static_directory)
+    @property
+    def budget(self) -> RenderBudget:
+        if self._budget is None:
+            self._budget = render_budget(self.template_model)
+        return self._budget
 
     def render(self, compose_data: dict) -> io.BytesIO:
         """
         Renders Template onto a stream according to the Renderer's MIME type.
 
+        Raises:
+            RenderBudgetExceeded: When the render goes over the template's budget
         """
         with TemporaryDirectory() as temp_render_directory:
             compose_data = self.qr_render(temp_render_directory, compose_data)
             html_string = self.compose_html(compose_data)
-            return self.print(html_string)
+            output = self.print(html_string)
+            self.budget.check_output_size(output.getbuffer().nbytes)
+            return output
 
     @abstractmethod
     def print(self, html: str) -> io.BytesIO:
@@ -159,6 +299,9 @@ class Renderer(ABC):
             dict: altered compose_data
         """
         qr_schema_paths = self.template_model.get_qr_entries()
+        if not qr_schema_paths:
+            return compose_data
+        from qrcode import make  # deferred, qrcode pulls in PIL
 
         def set_nested(key_list: List[str], dict_: dict, value: str):
             """
@@ -172,12 +315,19 @@ class Renderer(ABC):
                 dict_ = dict_[key]
             dict_[key_list[-1]] = value
 
+        def render_qr_code(value) -> bytes:
+            qr_image = io.BytesIO()
+            make(value).save(qr_image)
+            return qr_image.getvalue()
+
+        render_cache = current_app.config["render_cache"]
         for i, qr_schema_path in enumerate(qr_schema_paths):
             with open(f"{output_folder}/{i}.png", mode="wb") as qr_file:
                 qr_value = search(qr_schema_path, compose_data) 
                 if qr_value is not None:
-                    img = make(qr_value)
-                    img.save(qr_file)
+                    # the same URLs are encoded over and over, e.g. the verification page of an organization
+                    qr_key = f"qr:{hashlib.sha256(str(qr_value).encode('utf-8')).hexdigest()}"
+                    qr_file.write(render_cache.get_or_render(qr_key, lambda: render_qr_code(qr_value)))
                     set_nested(qr_schema_path.split("."), compose_data, qr_file.name)
 
         return compose_data
@@ -192,24 +342,53 @@ class PdfRenderer(Renderer):
     mime_type = PDF_MIME
 
     def print(self, html_string: str) -> io.BytesIO:
+        from weasyprint import HTML  # deferred, weasyprint is slow to import
 
         with tempfile.NamedTemporaryFile() as target_file_html:
             html = HTML(string=html_string)
-            html.write_pdf(target_file_html.name)
+            document = html.render()
+            self.budget.check_pages(len(document.pages))
+            document.write_pdf(target_file_html.name)
             with open(target_file_html.name, mode='rb') as temp_file_stream:
                 return io.BytesIO(temp_file_stream.read())
 
+    def render_document(self, compose_data: dict):
+        """
+        Renders Template into a laid out weasyprint Document, without writing it, so that its pages can be combined
+        with other documents.
 
-@Renderer.renderer()
-class PNGRenderer(Renderer):
+        Args:
+            compose_data: The data to fill the template with
+
+        Returns:
+            weasyprint.Document: The laid out document
+        """
+        from weasyprint import HTML  # deferred, weasyprint is slow to import
+
+        with TemporaryDirectory() as temp_render_directory:
+            compose_data = self.qr_render(temp_render_directory, compose_data)
+            html_string = self.compose_html(compose_data)
+            # images, including the QR codes, are loaded during layout so the directory can be removed afterwards
+            document = HTML(string=html_string).render()
+            self.budget.check_pages(len(document.pages))
+            return document
+
+
+class RasterRenderer(Renderer, ABC):
     """
-    PNG Renderer which uses weasyprint to generate PNG documents.
+    Base for the image Renderers, which use weasyprint to print a single page as PNG and then encode it to the
+    Renderer's MIME type.
+
+    The quality goes from 1 (smallest output) to 100 (highest fidelity), while the compression level goes from 0
+    (fastest) to the subclass's max_compression (smallest output).
     """
 
-    mime_type = PNG_MIME
+    max_compression: ClassVar[int] = 9
     _width: Optional[int] = None
     _height: Optional[int] = None
     _page: int = 0
+    _quality: Optional[int] = None
+    _compression: Optional[int] = None
 
     @property
     def height(self):
@@ -241,20 +420,46 @@ class PNGRenderer(Renderer):
             raise InvalidPageNumber(f"A negative number is not allowed as a page value: {value}")
         self._page = value
 
+    @property
+    def quality(self):
+        return self._quality
+
+    @quality.setter
+    def quality(self, value):
+        if value is not None and not 1 <= value <= 100:
+            raise InvalidRenderOption(f"Quality must be between 1 and 100: {value}")
+        self._quality = value
+
+    @property
+    def compression(self):
+        return self._compression
+
+    @compression.setter
+    def compression(self, value):
+        if value is not None and not 0 <= value <= self.max_compression:
+            raise InvalidRenderOption(f"Compression level must be between 0 and {self.max_compression}: {value}")
+        self._compression = value
+
     def __init__(self, template_model: Template,
                  height: Optional[int] = None,
                  width: Optional[int] = None,
-                 page: int = 0):
+                 page: int = 0,
+                 quality: Optional[int] = None,
+                 compression: Optional[int] = None):
         self.height = height
         self.width = width
         self.page = page
+        self.quality = quality
+        self.compression = compression
         super().__init__(template_model)
 
     def print(self, html_string: str) -> io.BytesIO:
+        from weasyprint import HTML  # deferred, weasyprint is slow to import
 
         with tempfile.NamedTemporaryFile() as target_file_html:
             html = HTML(string=html_string)
             weasy_doc = html.render(enable_hinting=True)
+            self.budget.check_pages(len(weasy_doc.pages))
 
             if self.page >= len(weasy_doc.pages):
                 raise InvalidPageNumber(f"Page number ({self.page}) is larger than the maximum page number ({len(weasy_doc.pages)-1})")
@@ -266,11 +471,52 @@ class PNGRenderer(Renderer):
                 resolution_multiplier = self.height / page_to_print.height
             elif self.width is not None:
                 resolution_multiplier = self.width / page_to_print.width
+            self.budget.check_raster_pixels(page_to_print.width * resolution_multiplier,
+                                            page_to_print.height * resolution_multiplier)
 
             # 96 is the default resolution provided by weasyprint to maintain aspect ratio
             weasy_doc.copy([page_to_print]).write_png(target=target_file_html.name, resolution=resolution_multiplier * 96)
             with open(target_file_html.name, mode='rb') as temp_file_stream:
-                return io.BytesIO(temp_file_stream.read())
+                return self.encode(io.BytesIO(temp_file_stream.read()))
+
+    @abstractmethod
+    def encode(self, png_stream: io.BytesIO) -> io.BytesIO:
+        """
+        Encodes the page printed by weasyprint into the Renderer's MIME type.
+
+        Args:
+            png_stream: The page, as a PNG stream
+
+        Returns:
+            io.BytesIO: A file stream with the Renderer's MIME type.
+        """
+        ...
+
+
+@Renderer.renderer()
+class PNGRenderer(RasterRenderer):
+    """
+    PNG Renderer which uses weasyprint to generate PNG documents.
+    The PNG is only re-encoded when a quality, which reduces the colour palette, or a compression level is requested.
+    """
+
+    mime_type = PNG_MIME
+
+    def encode(self, png_stream: io.BytesIO) -> io.BytesIO:
+        if self.quality is None and self.compression is None:
+            return png_stream
+
+        from PIL import Image
+
+        with Image.open(png_stream) as image:
+            if self.quality is not None:
+                colors = max(2, round(256 * self.quality / 100))
+                image = image.convert("RGBA").quantize(colors=colors, method=Image.FASTOCTREE)
+            output = io.BytesIO()
+            compression = self.compression if self.compression is not None else 6
+            image.save(output, format="PNG", compress_level=compression, optimize=compression == self.max_compression)
+        output.seek(0)
+        return output
 
 
 @Renderer.renderer()
@@ -284,8 +530,134 @@ class HTMLRenderer(Renderer):
     def print(self, html_string: str) -> io.BytesIO:
         return io.BytesIO(bytes(html_string, encoding="utf-8"))
 
+    def stream(self, compose_data: dict) -> Iterator[bytes]:
+        """
+        Renders the template HTML as UTF-8 encoded chunks of about STREAM_CHUNK_SIZE bytes, without holding the whole
+        document in memory.
+
+        Args:
+            compose_data: The data to fill the template with
+
+        Raises:
+            RenderBudgetExceeded: When the render goes over the template's budget, after the chunks within it were
+             generated
+
+        Returns:
+            Iterator[bytes]: The chunks of the HTML
+        """
+        with TemporaryDirectory() as temp_render_directory:
+            compose_data = self.qr_render(temp_render_directory, compose_data)
+            buffer: List[bytes] = []
+            buffered_bytes = 0
+            output_bytes = 0
+            for chunk in self.generate_html(compose_data):
+                encoded_chunk = chunk.encode("utf-8")
+                buffer.append(encoded_chunk)
+                buffered_bytes += len(encoded_chunk)
+                if buffered_bytes >= STREAM_CHUNK_SIZE:
+                    output_bytes += buffered_bytes
+                    self.budget.check_output_size(output_bytes)
+                    yield b"".join(buffer)
+                    buffer.clear()
+                    buffered_bytes = 0
+            self.budget.check_output_size(output_bytes + buffered_bytes)
+            if buffer:
+                yield b"".join(buffer)
+
+
+@Renderer.renderer()
+class JPEGRenderer(RasterRenderer):
+    """
+    JPEG Renderer which uses weasyprint to print the page and Pillow to encode it as a JPEG.
+    Transparent areas are flattened onto a white background.
+    """
+
+    mime_type = JPEG_MIME
+    default_quality = 85
+
+    def encode(self, png_stream: io.BytesIO) -> io.BytesIO:
+        from PIL import Image
+
+        with Image.open(png_stream) as image:
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel("A"))
+            output = io.BytesIO()
+            quality = self.quality if self.quality is not None else self.default_quality
+            # optimizing the huffman tables costs an extra pass, so it is only done for higher compression levels
+            optimize = self.compression is not None and self.compression >= self.max_compression // 2
+            flattened.save(output, format="JPEG", quality=quality, optimize=optimize, progressive=optimize)
+        output.seek(0)
+        return output
+
+
+@Renderer.renderer()
+class WebPRenderer(RasterRenderer):
+    """
+    WebP Renderer which uses weasyprint to print the page and Pillow to encode it as a lossy WebP,
+    or lossless when the quality is 100.
+    The compression level is WebP's encoding method, from 0 (fastest) to 6 (smallest output).
+    """
+
+    mime_type = WEBP_MIME
+    max_compression = 6
+    default_quality = 80
+    default_compression = 4
+
+    def encode(self, png_stream: io.BytesIO) -> io.BytesIO:
+        from PIL import Image
+
+        with Image.open(png_stream) as image:
+            output = io.BytesIO()
+            quality = self.quality if self.quality is not None else self.default_quality
+            compression = self.compression if self.compression is not None else self.default_compression
+            image.save(output, format="WEBP", quality=quality, method=compression, lossless=quality == 100)
+        output.seek(0)
+        return output
+
+
+@lru_cache(maxsize=1024)
+def _cached_schema_validator(schema_json: str):
+    schema = json.loads(schema_json)
+    validator_class = validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
 
-def compose(template: Template, compose_data: dict, mime_type: str, *args, **kwargs) -> io.BytesIO:
+def schema_validator(schema: dict):
+    """
+    Builds a jsonschema validator for the schema, cached so the schema is only checked and compiled once.
+
+    Args:
+        schema: The jsonschema
+
+    Raises:
+        jsonschema.exceptions.SchemaError: When the schema itself is invalid
+
+    Returns:
+        The validator for the schema
+    """
+    return _cached_schema_validator(json.dumps(schema, sort_keys=True))
+
+
+def validate_compose_data(compose_data: dict, schema: dict) -> None:
+    """
+    Validates compose data against a template schema, raising the same error jsonschema.validate would.
+
+    Args:
+        compose_data: The data to fill the template with
+        schema: The template schema
+
+    Raises:
+        jsonschema.exceptions.ValidationError: When the compose_data is not valid for the schema
+    """
+    error = best_match(schema_validator(schema).iter_errors(compose_data))
+    if error is not None:
+        raise error
+
+
+def compose(template: Template, compose_data: dict, mime_type: str, *args,
+            attachments: Optional[Mapping[str, Attachment]] = None, **kwargs) -> io.BytesIO:
     """
     Composes a file of the given mime_type using the compose_data to fill the given template.
 
@@ -294,14 +666,107 @@ def compose(template: Template, compose_data: dict, mime_type: str, *args, **kwa
         mime_type: The desired output MIME type.
         compose_data: The dict with the data to fill the template.
         args: Additional arguments to be given to the specific renderer
+        attachments: The files referenced from the compose_data, see plato.compose.attachments
         kwargs: Additional keyword arguments to be given to the specific renderer
     Raises:
         jsonschema.exceptions.ValidationError: When the compose_data is not valid for a given template
         RendererNotFound: When there is no Renderer for the given mime_type
+        RenderBudgetExceeded: When the render goes over the template's budget
+        UnknownAttachment: When the compose_data references an attachment that was not given
     Returns:
         io.BytesIO: The Byte stream for the composed file.
     """
-    validate_schema(instance=compose_data, schema=template.schema)
+    validate_compose_data(compose_data, template.schema)
+    if attachments is not None:
+        compose_data = resolve_attachments(compose_data, attachments)
     renderer = Renderer.build_renderer(mime_type, template_model=template, *args, **kwargs)
 
     return renderer.render(compose_data)
+
+
+def compose_html_stream(template: Template, compose_data: dict,
+                        attachments: Optional[Mapping[str, Attachment]] = None) -> Iterator[bytes]:
+    """
+    Composes the template as HTML, streamed in chunks as it is rendered.
+    The compose_data is validated right away, the template is rendered as the chunks are consumed.
+
+    Args:
+        template: The Template model to be used in the composition
+        compose_data: The dict with the data to fill the template.
+        attachments: The files referenced from the compose_data, see plato.compose.attachments
+    Raises:
+        jsonschema.exceptions.ValidationError: When the compose_data is not valid for a given template
+        UnknownAttachment: When the compose_data references an attachment that was not given
+    Returns:
+        Iterator[bytes]: The UTF-8 encoded chunks of the HTML, which may raise RenderBudgetExceeded
+    """
+    validate_compose_data(compose_data, template.schema)
+    if attachments is not None:
+        compose_data = resolve_attachments(compose_data, attachments)
+    return HTMLRenderer(template_model=template).stream(compose_data)
+
+
+class MergeEntry(NamedTuple):
+    """
+    A document to be composed into a merged PDF, under its own bookmark.
+    """
+    template: Template
+    compose_data: dict
+    title: str
+
+
+def _no_render_slot(template_ids: Iterable[str]) -> ContextManager:
+    return nullcontext()
+
+
+def compose_merged_pdf(entries: Sequence[MergeEntry], max_workers: int,
+                       render_slot: Callable[[Iterable[str]], ContextManager] = _no_render_slot) -> io.BytesIO:
+    """
+    Composes several documents into a single PDF. The documents are laid out in parallel and their pages are then
+    written in a single pass, each document under a top level bookmark with its title.
+
+    Args:
+        entries: The documents to be composed, in order
+        max_workers: The maximum number of documents laid out at the same time
+        render_slot: Context to render in for the given template ids, e.g. a slot of the render scheduler. Entered
+         for each document laid out, with its template, and for the final pass, with every template.
+    Raises:
+        jsonschema.exceptions.ValidationError: When the compose_data of an entry is not valid for its template,
+            with the entry index as the first element of its relative_path
+        RenderBudgetExceeded: When an entry goes over its template's budget, or the merged PDF over the global budget
+    Returns:
+        io.BytesIO: The Byte stream for the merged PDF.
+    """
+    for index, entry in enumerate(entries):
+        try:
+            validate_compose_data(entry.compose_data, entry.template.schema)
+        except ValidationError as ve:
+            ve.relative_path.appendleft(index)
+            raise
+
+    app = current_app._get_current_object()
+
+    def render_document(entry: MergeEntry):
+        with app.app_context(), render_slot([entry.template.id]):
+            return PdfRenderer(template_model=entry.template).render_document(entry.compose_data)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        documents = list(executor.map(render_document, entries))
+
+    pages = []
+    for entry, document in zip(entries, documents):
+        for page in document.pages:
+            # nests the document's own bookmarks under the entry bookmark
+            page.bookmarks = [(level + 1, label, target, state) for level, label, target, state in page.bookmarks]
+        if document.pages:
+            document.pages[0].bookmarks.insert(0, (1, entry.title, (0, 0), "closed"))
+        pages.extend(document.pages)
+
+    global_budget: RenderBudget = app.config.get("RENDER_BUDGET", RenderBudget())
+    global_budget.check_pages(len(pages))
+    output = io.BytesIO()
+    with render_slot({entry.template.id for entry in entries}):
+        documents[0].copy(pages).write_pdf(output)
+    global_budget.check_output_size(output.getbuffer().nbytes)
+    output.seek(0)
+    return output
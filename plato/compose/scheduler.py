@@ -0,0 +1,177 @@
+"""
+Scheduling of renders between priority classes, templates and clients.
+
+Renders wait for one of a fixed number of slots in front of the render pipeline. Waiting renders are granted a slot in
+priority order, interactive before bulk and first come first served within a class, skipping over those whose template
+or client already has as many renders running as it is allowed, so one tenant's batch cannot starve the others.
+"""
+import bisect
+import itertools
+import threading
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Iterable, Iterator, List, Optional
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of the renders, lower values are scheduled first.
+    """
+    INTERACTIVE = 0
+    BULK = 1
+
+
+class RenderQueueTimeout(Exception):
+    """
+    Exception to be raised when a render waits longer than allowed for a slot
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+class RenderTicket:
+    """
+    A render waiting for, or holding, a slot. Its future is resolved once the slot is granted.
+    """
+
+    def __init__(self, priority: Priority, template_ids: Iterable[str], client_id: str, sequence: int):
+        self.priority = priority
+        self.template_ids = frozenset(template_ids)
+        self.client_id = client_id
+        self.sequence = sequence
+        self.future: Future = Future()
+        self.granted = False
+
+    def __lt__(self, other: 'RenderTicket') -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class RenderScheduler:
+    """
+    Grants render slots by priority, with concurrency limits per template and per client.
+
+        Typical usage:
+
+            scheduler = RenderScheduler(capacity=8, max_per_template=4, max_per_client=4, queue_timeout=60)
+            with scheduler.slot(Priority.INTERACTIVE, [template.id], client_id):
+                output = compose(template, compose_data, mime_type)
+
+    """
+
+    def __init__(self, capacity: int, max_per_template: Optional[int] = None, max_per_client: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        """
+        Args:
+            capacity: Number of renders running at the same time
+            max_per_template: Number of renders of the same template running at the same time, unlimited when None
+            max_per_client: Number of renders of the same client running at the same time, unlimited when None
+            queue_timeout: For how long, in seconds, a render may wait for a slot, indefinitely when None
+        """
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self.max_per_template = max_per_template
+        self.max_per_client = max_per_client
+        self._waiting: List[RenderTicket] = []
+        self._running = 0
+        self._running_per_template: Counter = Counter()
+        self._running_per_client: Counter = Counter()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, priority: Priority, template_ids: Iterable[str], client_id: str) -> RenderTicket:
+        """
+        Queues a render for a slot. The ticket must always be released, whether it was granted a slot or not.
+
+        Args:
+            priority: The priority class of the render
+            template_ids: The templates rendered
+            client_id: The client the render is for
+
+        Returns:
+            RenderTicket: The ticket, whose future is resolved once the slot is granted
+        """
+        with self._lock:
+            ticket = RenderTicket(priority, template_ids, client_id, next(self._sequence))
+            bisect.insort(self._waiting, ticket)
+            self._dispatch()
+        return ticket
+
+    def release(self, ticket: RenderTicket) -> None:
+        """
+        Frees the ticket's slot, or takes it out of the queue if it was not granted one yet.
+
+        Args:
+            ticket: The ticket from submit
+        """
+        with self._lock:
+            if ticket.granted:
+                ticket.granted = False
+                self._running -= 1
+                self._running_per_client[ticket.client_id] -= 1
+                for template_id in ticket.template_ids:
+                    self._running_per_template[template_id] -= 1
+                # drops the clients and templates with nothing running, so the counters do not grow unbounded
+                self._running_per_client += Counter()
+                self._running_per_template += Counter()
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+                ticket.future.cancel()
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: Priority, template_ids: Iterable[str], client_id: str) -> Iterator[None]:
+        """
+        Waits for a slot and holds it for the duration of the context.
+
+        Args:
+            priority: The priority class of the render
+            template_ids: The templates rendered
+            client_id: The client the render is for
+
+        Raises:
+            RenderQueueTimeout: When no slot was granted within the queue timeout
+        """
+        ticket = self.submit(priority, template_ids, client_id)
+        try:
+            try:
+                ticket.future.result(self.queue_timeout)
+            except FutureTimeoutError:
+                raise self.queue_timeout_error()
+            yield
+        finally:
+            self.release(ticket)
+
+    def queue_timeout_error(self) -> RenderQueueTimeout:
+        return RenderQueueTimeout(f"Timed out after {self.queue_timeout} seconds waiting for a render slot")
+
+    def _dispatch(self) -> None:
+        """
+        Grants the free slots to the waiting tickets, in priority order, skipping those over their template or client
+        limits. Must be called with the lock held.
+        """
+        for ticket in list(self._waiting):
+            if self._running >= self.capacity:
+                return
+            if not self._within_limits(ticket):
+                continue
+
+            self._waiting.remove(ticket)
+            if not ticket.future.set_running_or_notify_cancel():
+                continue  # the waiter gave up
+            ticket.granted = True
+            self._running += 1
+            self._running_per_client[ticket.client_id] += 1
+            for template_id in ticket.template_ids:
+                self._running_per_template[template_id] += 1
+            ticket.future.set_result(None)
+
+    def _within_limits(self, ticket: RenderTicket) -> bool:
+        if self.max_per_client is not None and self._running_per_client[ticket.client_id] >= self.max_per_client:
+            return False
+        return self.max_per_template is None or all(self._running_per_template[template_id] < self.max_per_template
+                                                    for template_id in ticket.template_ids)
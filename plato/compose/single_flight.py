@@ -0,0 +1,179 @@
+"""
+Single-flight coalescing of identical compositions.
+
+Identical compose requests that arrive while the same composition is already being rendered wait for that render
+instead of starting their own. Requests are coalesced between threads of the same process and, when a lock directory
+is configured, between processes on the same host, through file locks on that directory.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from plato.db.models import Template
+
+LOCK_STRIPES = 4096
+
+
+def compose_key(template: Template, compose_data: dict, mime_type: str, options: Dict[str, Any],
+                attachment_digests: Optional[Dict[str, str]] = None) -> str:
+    """
+    Key identifying a composition, two compositions with the same key produce the same file.
+
+    Args:
+        template: The Template model to be used in the composition
+        compose_data: The data to fill the template with, before any QR code is rendered
+        mime_type: The output MIME type
+        options: The options given to the renderer, e.g. page or width
+        attachment_digests: The digests of the files attached to the composition, by name
+
+    Returns:
+        str: The hex digest for the composition
+    """
+    composition = {"template_id": template.id,
+                   "revision": template.revision,
+                   "compose_data": compose_data,
+                   "mime_type": mime_type,
+                   "options": options}
+    if attachment_digests:
+        composition["attachments"] = attachment_digests
+    return hashlib.sha256(json.dumps(composition, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Runs a function only once for all concurrent callers with the same key, sharing its result with all of them.
+
+        Typical usage:
+
+            single_flight = SingleFlight("/tmp/plato-single-flight")
+            output = single_flight.do(key, lambda: compose(template, compose_data, mime_type).getvalue())
+
+    """
+
+    def __init__(self, lock_directory: Optional[str] = None, result_ttl: float = 5.0):
+        """
+        Args:
+            lock_directory: Directory for the host-wide locks and results, only coalesces within the process when None
+            result_ttl: For how long, in seconds, a result rendered by another process may still be served
+        """
+        self.lock_directory = Path(lock_directory) if lock_directory else None
+        self.result_ttl = result_ttl
+        self._calls: Dict[str, _Call] = dict()
+        self._lock = threading.Lock()
+        if self.lock_directory is not None:
+            self.lock_directory.mkdir(parents=True, exist_ok=True)
+
+    def do(self, key: str, function: Callable[[], bytes]) -> bytes:
+        """
+        Runs the function, unless another caller is already running it for the same key, in which case it waits for
+        that call and returns its result instead. Errors are raised to every caller waiting in the same process.
+
+        Args:
+            key: The key identifying the call, e.g. from compose_key
+            function: The function to be run
+
+        Returns:
+            bytes: The result of the function
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_across_processes(key, function)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _do_across_processes(self, key: str, function: Callable[[], bytes]) -> bytes:
+        """
+        Coalesces the call with the other processes on the host. Lock files are striped so their number stays bounded,
+        each one holding the digest of the key currently rendered under it so unrelated keys do not wait for each other.
+
+        Args:
+            key: The key identifying the call
+            function: The function to be run
+
+        Returns:
+            bytes: The result of the function
+        """
+        if self.lock_directory is None:
+            return function()
+
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        lock_path = self.lock_directory / f"{int(digest[:8], 16) % LOCK_STRIPES}.lock"
+        result_path = self.lock_directory / f"{digest}.result"
+
+        with open(lock_path, mode="a+b") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.seek(0)
+                if lock_file.read().decode("ascii", errors="ignore") != digest:
+                    return function()   # another key is being rendered under the same stripe
+
+                fcntl.flock(lock_file, fcntl.LOCK_SH)  # waits for the other process to finish rendering
+                result = self._read_result(result_path)
+                return result if result is not None else function()
+
+            try:
+                lock_file.truncate(0)
+                lock_file.write(digest.encode("ascii"))
+                lock_file.flush()
+                result = function()
+                self._write_result(result_path, result)
+                return result
+            finally:
+                lock_file.truncate(0)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_result(self, result_path: Path) -> Optional[bytes]:
+        try:
+            if time.time() - result_path.stat().st_mtime > self.result_ttl:
+                return None
+            return result_path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_result(self, result_path: Path, result: bytes) -> None:
+        tmp_result_path = result_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_result_path.write_bytes(result)
+        tmp_result_path.replace(result_path)
+        self._sweep_results()
+
+    def _sweep_results(self) -> None:
+        """
+        Removes the results that can no longer be served.
+        """
+        expired = time.time() - self.result_ttl
+        for result_path in self.lock_directory.glob("*.result"):
+            try:
+                if result_path.stat().st_mtime < expired:
+                    result_path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,104 @@
+"""
+Spooling of streamed renders, to decouple rendering a composition from sending it.
+
+The chunks are rendered by a background thread into a spool and sent from it as soon as they are written, so the
+render takes as long as rendering does, whatever the pace of the client, and its render slot is freed as soon as it is
+done instead of once the client has downloaded the whole response.
+"""
+import threading
+from tempfile import SpooledTemporaryFile
+from typing import Callable, Iterator, Optional
+
+# bytes of a spool kept in memory, the rest of the composition being spooled to a temporary file
+SPOOL_MEMORY_SIZE = 1024 * 1024
+SPOOL_READ_SIZE = 64 * 1024
+
+
+class ChunkSpool:
+    """
+    Chunks written by a producer thread and read, in order, as soon as they are written. The producer never waits for
+    the reader, the chunks are kept in memory up to a size and in a temporary file beyond it.
+
+        Typical usage:
+
+            spool = ChunkSpool()
+            threading.Thread(target=spool.write_all, args=(render_chunks(),)).start()
+            for chunk in spool.read():
+                send(chunk)
+            spool.close()
+
+    """
+
+    def __init__(self, memory_size: int = SPOOL_MEMORY_SIZE):
+        """
+        Args:
+            memory_size: Bytes kept in memory before the chunks are spooled to a temporary file
+        """
+        self._file = SpooledTemporaryFile(max_size=memory_size)
+        self._written = 0
+        self._read = 0
+        self._done = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+
+    def write_all(self, chunks: Iterator[bytes], on_done: Callable[[], None] = lambda: None) -> None:
+        """
+        Writes the chunks to the spool until they are exhausted or the spool is closed. Errors raised by the chunks are
+        raised to the reader instead, once it has read everything written before them.
+
+        Args:
+            chunks: The chunks, e.g. of a render
+            on_done: Called once the chunks are written, before the reader is told so, e.g. to free a render slot
+        """
+        error = None
+        try:
+            for chunk in chunks:
+                with self._condition:
+                    if self._closed:
+                        return
+                    self._file.seek(0, 2)
+                    self._file.write(chunk)
+                    self._written += len(chunk)
+                    self._condition.notify_all()
+        except Exception as e:
+            error = e
+        finally:
+            on_done()
+            with self._condition:
+                self._error = error
+                self._done = True
+                self._condition.notify_all()
+
+    def read(self) -> Iterator[bytes]:
+        """
+        Reads the chunks as they are written, until every chunk was read.
+
+        Raises:
+            Exception: The error raised while writing the chunks, once everything written before it was read
+
+        Returns:
+            Iterator[bytes]: The written bytes, in blocks of up to SPOOL_READ_SIZE bytes
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._read < self._written or self._done or self._closed)
+                if self._closed:
+                    return
+                self._file.seek(self._read)
+                data = self._file.read(min(self._written - self._read, SPOOL_READ_SIZE))
+                self._read += len(data)
+                if not data:
+                    if self._error is not None:
+                        raise self._error
+                    return
+            yield data
+
+    def close(self) -> None:
+        """
+        Discards the spool, the producer stopping before its next chunk.
+        """
+        with self._condition:
+            self._closed = True
+            self._file.close()
+            self._condition.notify_all()
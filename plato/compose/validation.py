@@ -0,0 +1,59 @@
+"""
+Bulk validation of compose data, to check a batch of payloads against a template schema without rendering any of them.
+
+The payloads are read as NDJSON, one compose data object per line, and a result is yielded per line as soon as it is
+validated, so batches of any size are validated in constant memory:
+
+    {"line": 1, "valid": true, "errors": []}
+    {"line": 2, "valid": false, "errors": [{"path": "$.serial_number", "message": "'serial_number' is a required ..."}]}
+"""
+import json
+from typing import Iterable, Iterator, List, Union
+
+from jsonschema.exceptions import relevance
+
+from plato.compose.renderer import schema_validator
+from plato.error_messages import invalid_compose_json
+
+
+def compose_data_errors(compose_data: object, schema: dict) -> List[dict]:
+    """
+    Every validation error of the compose data for a template schema, the most relevant first, i.e. the one compose
+    reports.
+
+    Args:
+        compose_data: The data to fill the template with
+        schema: The template schema
+
+    Raises:
+        jsonschema.exceptions.SchemaError: When the schema itself is invalid
+
+    Returns:
+        List[dict]: The errors, each with the JSON path of the invalid value and the error message
+    """
+    errors = sorted(schema_validator(schema).iter_errors(compose_data), key=relevance, reverse=True)
+    return [{"path": error.json_path, "message": error.message} for error in errors]
+
+
+def validate_lines(lines: Iterable[Union[str, bytes]], schema: dict) -> Iterator[dict]:
+    """
+    Validates the compose data of each NDJSON line for a template schema, blank lines being skipped.
+
+    Args:
+        lines: The NDJSON lines
+        schema: The template schema
+
+    Raises:
+        jsonschema.exceptions.SchemaError: When the schema itself is invalid
+
+    Returns:
+        Iterator[dict]: The result of each line, with its number, whether it is valid and its errors
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            errors = compose_data_errors(json.loads(line), schema)
+        except ValueError as e:
+            errors = [{"path": None, "message": invalid_compose_json.format(e)}]
+        yield {"line": line_number, "valid": not errors, "errors": errors}
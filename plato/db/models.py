@@ -5,16 +5,23 @@ All the classes in this module represent the database objects present in the mic
 base from sqlalchemy.
 
 """
-from typing import Sequence, List
+from typing import Sequence, List, Optional
 
 from plato.db import db
-from sqlalchemy import String
-from sqlalchemy.dialects.postgresql import JSONB, ENUM, ARRAY
+from plato.db.types import JSONDocument, StringArray, empty_array
+from sqlalchemy import DateTime, Enum, ForeignKey, String, Integer, func
+
+# the template details which can be updated, by their key in the details and their attribute of the template
+UPDATABLE_FIELDS = {"schema": "schema",
+                    "type": "type",
+                    "metadata": "metadata_",
+                    "example_composition": "example_composition",
+                    "tags": "tags"}
 
 
 class Template(db.Model):
     """
-    Database model for a Template
+    Database model for a Template, mapped to Postgres or to SQLite, see plato.db.types
 
     The unique identifier for the table is `id`.
     The metadata has some optional but relevant entries:
@@ -24,6 +31,12 @@ class Template(db.Model):
 
             Examples
                 "course.organization.contact.website_url"
+        render_budget
+            Overrides the global limits on the resources used to render the template, e.g. its "max_pages",
+            "render_time", "max_output_bytes" or "max_raster_pixels".
+
+            Examples
+                {"max_pages": 2000, "render_time": 120}
 
     Attributes:
         id (str): The id for the template
@@ -32,14 +45,18 @@ class Template(db.Model):
         metadata_ (dict): JSON dictionary for arbitrary data useful for owner
         example_composition (dict): A dictionary containing example compose data for the template
         tags (list): A list of identifying tags for the template
+        revision (int): The revision of the template, incremented on every update
     """
     __tablename__ = "template"
     id = db.Column(String, primary_key=True)
-    schema = db.Column(JSONB, nullable=False)
-    type = db.Column(ENUM("text/html", name="template_mime_type"), nullable=False)
-    metadata_ = db.Column(JSONB, name="metadata", nullable=True)
-    example_composition = db.Column(JSONB, nullable=False)
-    tags = db.Column(ARRAY(String), name="tags", nullable=False, server_default="{}")
+    schema = db.Column(JSONDocument, nullable=False)
+    type = db.Column(Enum("text/html", name="template_mime_type"), nullable=False)
+    metadata_ = db.Column(JSONDocument, name="metadata", nullable=True)
+    example_composition = db.Column(JSONDocument, nullable=False)
+    tags = db.Column(StringArray, name="tags", nullable=False, server_default=empty_array())
+    revision = db.Column(Integer, nullable=False, default=1, server_default="1")
+    # the id the files are found under in the local template directory, differs for a pinned revision
+    _files_id: Optional[str] = None
 
     def __init__(self, id_: str, schema: dict, type_: str,
                  metadata: dict,
@@ -51,6 +68,7 @@ class Template(db.Model):
         self.metadata_ = metadata
         self.example_composition = example_composition
         self.tags = tags
+        self.revision = 1
 
     @classmethod
     def from_json_dict(cls, json_: dict) -> 'Template':
@@ -73,18 +91,20 @@ class Template(db.Model):
 
     def update_fields(self, json_: dict):
         """
-        Updates some fields of a template object from a dictionary. It does not update the template id.
+        Updates some fields of a template object from a dictionary and bumps its revision.
+        Only the template details can be updated, not the template id nor its revision.
 
         Args:
             json_: dict with template details.
 
-        Raises a KeyError exception if key does not exist
+        Raises a KeyError exception if key is not one of the template details
         """
+        unknown_keys = json_.keys() - UPDATABLE_FIELDS.keys()
+        if unknown_keys:
+            raise KeyError(*sorted(unknown_keys))
         for key, value in json_.items():
-            if hasattr(self, key) and key not in self.id:
-                setattr(self, key, value)
-            else:
-                raise KeyError(key)
+            setattr(self, UPDATABLE_FIELDS[key], value)
+        self.revision += 1
 
     def json_dict(self) -> dict:
         """
@@ -102,6 +122,16 @@ class Template(db.Model):
         json_["tags"] = self.tags
         return json_
 
+    @property
+    def files_id(self) -> str:
+        """
+        The id of the template's file and static directory in the local template directory, the template id unless it
+        is a pinned revision, see TemplateRevision.as_template
+        Returns:
+            str
+        """
+        return self._files_id or self.id
+
     def get_qr_entries(self) -> List[str]:
         """
         Fetches all the qr_entries for the template as a list comprised of JMESPath friendly strings
@@ -110,5 +140,99 @@ class Template(db.Model):
         """
         return self.metadata_.get("qr_entries", [])
 
+    def get_render_budget(self) -> dict:
+        """
+        Fetches the limits of the render budget overridden for the template, see plato.compose.renderer.RenderBudget
+        Returns:
+            dict
+        """
+        return self.metadata_.get("render_budget", {})
+
     def __repr__(self):
         return '<Template %r>' % self.id
+
+
+class TemplateRevision(db.Model):
+    """
+    Database model for an immutable revision of a Template, recorded on every create or update
+
+    The unique identifier for the table is `template_id` and `revision`.
+
+    Attributes:
+        template_id (str): The id of the template
+        revision (int): The revision of the template
+        schema (dict): The template schema at that revision
+        type (str): The template MIME type at that revision
+        metadata_ (dict): The template metadata at that revision
+        example_composition (dict): The template example composition at that revision
+        tags (list): The template tags at that revision
+        files (dict): The digests of the template file, under "template", and of each static file, under "static", as
+            stored by PlatoFileStorage.save_template_files. None when they are unknown, e.g. for imported templates
+        created_at (datetime): When the revision was recorded
+    """
+    __tablename__ = "template_revision"
+    template_id = db.Column(String, ForeignKey("template.id", ondelete="CASCADE"), primary_key=True)
+    revision = db.Column(Integer, primary_key=True)
+    schema = db.Column(JSONDocument, nullable=False)
+    type = db.Column(Enum("text/html", name="template_mime_type"), nullable=False)
+    metadata_ = db.Column(JSONDocument, name="metadata", nullable=True)
+    example_composition = db.Column(JSONDocument, nullable=False)
+    tags = db.Column(StringArray, nullable=False, server_default=empty_array())
+    files = db.Column(JSONDocument, nullable=True)
+    created_at = db.Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    @classmethod
+    def from_template(cls, template: Template, files: Optional[dict]) -> 'TemplateRevision':
+        """
+        Builds the revision for the current state of a template.
+
+        Args:
+            template: The template, with its revision already bumped
+            files: The digests of its files, see files
+
+        Returns:
+            TemplateRevision
+        """
+        return TemplateRevision(template_id=template.id,
+                                revision=template.revision,
+                                schema=template.schema,
+                                type=template.type,
+                                metadata_=template.metadata_,
+                                example_composition=template.example_composition,
+                                tags=template.tags,
+                                files=files)
+
+    def as_template(self) -> Template:
+        """
+        Builds a template, not to be added to the session, with the state of this revision. Its files are looked up
+        under the revision's own id, see revision_files_id.
+
+        Returns:
+            Template
+        """
+        template = Template(id_=self.template_id,
+                            schema=self.schema,
+                            type_=self.type,
+                            metadata=self.metadata_,
+                            example_composition=self.example_composition,
+                            tags=self.tags)
+        template.revision = self.revision
+        template._files_id = revision_files_id(self.template_id, self.revision)
+        return template
+
+    def __repr__(self):
+        return '<TemplateRevision %r@%r>' % (self.template_id, self.revision)
+
+
+def revision_files_id(template_id: str, revision: int) -> str:
+    """
+    The id the files of a template revision are found under in the local template directory.
+
+    Args:
+        template_id: The id of the template
+        revision: The revision
+
+    Returns:
+        str
+    """
+    return f"{template_id}@{revision}"
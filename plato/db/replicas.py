@@ -0,0 +1,96 @@
+"""
+Routing of read-only queries to the database read replicas.
+
+The replicas are configured as Flask-SQLAlchemy binds named `replica_<n>`. Reads rotate between the healthy replicas
+and fall back to the primary when they all fail, a replica that failed being skipped for a while before it is tried
+again.
+"""
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, TypeVar
+
+from sqlalchemy.exc import DBAPIError, NoResultFound
+from sqlalchemy.orm import Session
+
+from plato.db import db
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+REPLICA_BIND_PREFIX = "replica_"
+
+
+def replica_binds(replica_urls: Sequence[str]) -> Dict[str, str]:
+    """
+    The Flask-SQLAlchemy binds for the read replicas.
+
+    Args:
+        replica_urls: The database URLs of the read replicas
+
+    Returns:
+        Dict[str, str]: The bind keys and their URLs
+    """
+    return {f"{REPLICA_BIND_PREFIX}{index}": url for index, url in enumerate(replica_urls)}
+
+
+class ReadReplicas:
+    """
+    Runs read-only queries on the read replicas, falling back to the primary. Must be used within the app context.
+
+        Typical usage:
+
+            read_replicas = ReadReplicas(["replica_0", "replica_1"])
+            template = read_replicas.read(lambda session: session.query(Template).filter_by(id=template_id).one())
+
+    """
+
+    def __init__(self, bind_keys: Sequence[str], retry_interval: float = 30.0):
+        """
+        Args:
+            bind_keys: The Flask-SQLAlchemy bind keys of the replicas, reads go to the primary when empty
+            retry_interval: For how long, in seconds, a replica that failed is skipped
+        """
+        self.bind_keys = list(bind_keys)
+        self.retry_interval = retry_interval
+        self._rotation = itertools.cycle(range(len(self.bind_keys))) if self.bind_keys else None
+        self._failed_at: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+
+    def read(self, query: Callable[[Session], T]) -> T:
+        """
+        Runs the query on a replica, or on the primary if no replica is available or they all fail.
+        Queries finding no result are repeated on the primary, as the replicas may lag behind it.
+
+        Args:
+            query: The read-only query, receiving the session to run on. The models it returns are detached when
+             run on a replica, so everything needed from them must be loaded by the query.
+
+        Returns:
+            T: The result of the query
+        """
+        for bind_key in self._available_replicas():
+            try:
+                with Session(bind=db.engines[bind_key]) as session:
+                    return query(session)
+            except NoResultFound:
+                break
+            except DBAPIError:
+                logger.warning("Read replica '%s' failed, falling back", bind_key, exc_info=True)
+                with self._lock:
+                    self._failed_at[bind_key] = time.monotonic()
+
+        return query(db.session)
+
+    def _available_replicas(self) -> List[str]:
+        if self._rotation is None:
+            return []
+
+        with self._lock:
+            start = next(self._rotation)
+            now = time.monotonic()
+            rotated = self.bind_keys[start:] + self.bind_keys[:start]
+            return [bind_key for bind_key in rotated
+                    if now - self._failed_at.get(bind_key, -self.retry_interval) >= self.retry_interval]
@@ -0,0 +1,295 @@
+"""
+Template change events, so every node serves the current revision of a template as soon as it is created or updated.
+
+The endpoints changing a template publish an event on the `plato_template_changed` Postgres channel, through NOTIFY.
+A listener on each node, `flask listen-templates`, then pulls the files of that template only into the local template
+directory and evicts the template's render cache entries. The workers of the node pick the new files up as the Jinja
+environment reloads templates whose file changed. Without Postgres, e.g. on a single SQLite node, there is no other
+node to notify and the change is applied right away by the node that made it.
+"""
+import json
+import logging
+import os
+import select
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from flask import current_app
+from sqlalchemy import text
+
+from plato.compose.render_cache import RenderCache
+from plato.db import db
+from plato.db.models import Template, TemplateRevision, revision_files_id
+from plato.file_storage import PlatoFileStorage, link_file
+from plato.util.path_util import static_file_path
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CHANGED_CHANNEL = "plato_template_changed"
+# how long the listener waits for events at once, in seconds, so it notices when it is stopped
+POLL_INTERVAL = 5.0
+
+
+class TemplateChanged(NamedTuple):
+    """
+    Event published when a template is created or updated.
+    """
+    template_id: str
+    revision: int
+
+    def payload(self) -> str:
+        return json.dumps(self._asdict())
+
+    @classmethod
+    def from_payload(cls, payload: str) -> "TemplateChanged":
+        event = json.loads(payload)
+        return cls(template_id=event["template_id"], revision=event["revision"])
+
+
+class RevisionFilesUnavailable(Exception):
+    """
+    Exception to be raised when the files of a template revision were not recorded or are no longer stored
+    """
+    revision: int
+    message: str
+
+    def __init__(self, revision: int, message: str):
+        self.revision = revision
+        self.message = message
+        super().__init__(message)
+
+
+class TemplateSync:
+    """
+    Applies template change events to the local template directory and to the render cache of the node, and writes
+    the files of the past revisions pinned by requests.
+
+        Typical usage:
+
+            template_sync = TemplateSync(file_storage, "/tmp/plato/templating", "templating", render_cache)
+            template_sync.apply(TemplateChanged("certificate", 3))
+
+    """
+
+    def __init__(self, file_storage: PlatoFileStorage, target_directory: str, template_directory: str,
+                 render_cache: RenderCache):
+        """
+        Args:
+            file_storage: The storage to pull the template files from
+            target_directory: The local template directory, as loaded by load_templates
+            template_directory: The base directory of the template files in the storage
+            render_cache: The render cache of the node
+        """
+        self.file_storage = file_storage
+        self.target_directory = target_directory
+        self.template_directory = template_directory
+        self.render_cache = render_cache
+        self._applied_revisions: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+
+    def apply(self, event: TemplateChanged) -> bool:
+        """
+        Pulls the files of the changed template and evicts its render cache entries, unless a later revision of the
+        template was already applied.
+
+        Args:
+            event: The template change
+
+        Returns:
+            bool: Whether the event was applied
+        """
+        with self._lock:
+            if self._applied_revisions.get(event.template_id, 0) >= event.revision:
+                return False
+            template_files = self.file_storage.get_template_files(event.template_id, self.template_directory)
+            # the static files stored content-addressed are linked to their blob, shared with the other templates and
+            # revisions using it, instead of being copied
+            linked_files: Dict[str, str] = dict()
+            for static_file, address in self.file_storage.get_static_manifest(event.template_id,
+                                                                              self.template_directory).items():
+                path = static_file_path(self.template_directory, event.template_id, static_file)
+                linked_files[path[len(self.template_directory) + 1:]] = address
+            self.file_storage.write_files({path: content for path, content in template_files.items()
+                                           if path not in linked_files}, self.target_directory)
+            for path, address in linked_files.items():
+                link_file(self.file_storage.local_blob(self.template_directory, address),
+                          Path(f"{self.target_directory}/{path}"))
+            evicted = self.render_cache.evict_template(event.template_id)
+            self._applied_revisions[event.template_id] = event.revision
+        logger.info("Applied revision %s of template '%s', %s files pulled and %s render cache entries evicted",
+                    event.revision, event.template_id, len(template_files), evicted)
+        return True
+
+    def apply_all(self, templates: Iterable[Template]) -> None:
+        """
+        Applies the current revision of every template, e.g. when events may have been missed.
+
+        Args:
+            templates: The templates
+        """
+        for template in templates:
+            try:
+                self.apply(TemplateChanged(template.id, template.revision))
+            except Exception:
+                logger.exception("Could not apply revision %s of template '%s'", template.revision, template.id)
+
+    def pin_revision(self, revision: TemplateRevision) -> Template:
+        """
+        Builds the template of a past revision, writing its files to the local template directory under the
+        revision's own id the first time. As revisions are immutable, they are never written again.
+
+        Args:
+            revision: The template revision
+
+        Raises:
+            RevisionFilesUnavailable: When the files of the revision are unknown or missing from the storage
+
+        Returns:
+            Template: The template of the revision, see TemplateRevision.as_template
+        """
+        files_id = revision_files_id(revision.template_id, revision.revision)
+        template_file = Path(f"{self.target_directory}/templates/{files_id}/{files_id}")
+        if not template_file.is_file():
+            if revision.files is None:
+                raise RevisionFilesUnavailable(revision.revision, "The files of the revision were not recorded")
+            try:
+                self._write_revision_files(files_id, revision.files, template_file)
+            except FileNotFoundError as e:
+                raise RevisionFilesUnavailable(revision.revision, f"The files of the revision are missing, {e}")
+        return revision.as_template()
+
+    def _write_revision_files(self, files_id: str, files: dict, template_file: Path) -> None:
+        """
+        Links the blobs of a revision into place, the template file last, so a revision whose template file exists is
+        complete. Concurrent writers of the same revision write the same content.
+        """
+        staging_directory = Path(f"{self.target_directory}/.{files_id}.{uuid.uuid4().hex}")
+        try:
+            staging_directory.mkdir(parents=True)
+            for static_file, address in files["static"].items():
+                link_file(self.file_storage.local_blob(self.template_directory, address),
+                          staging_directory / "static" / static_file)
+            static_directory = Path(f"{self.target_directory}/static/{files_id}")
+            static_directory.parent.mkdir(parents=True, exist_ok=True)
+            if files["static"] and not static_directory.exists():
+                try:
+                    os.rename(staging_directory / "static", static_directory)
+                except OSError:
+                    pass  # written by a concurrent request meanwhile
+
+            staging_template = staging_directory / "template"
+            link_file(self.file_storage.local_blob(self.template_directory, files["template"]), staging_template)
+            template_file.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staging_template, template_file)
+        finally:
+            shutil.rmtree(staging_directory, ignore_errors=True)
+
+
+def publish_template_changed(template: Template) -> None:
+    """
+    Publishes that a template was created or updated, once its row and files are saved. Must be called within the app
+    context.
+
+    Args:
+        template: The template, as committed
+    """
+    event = TemplateChanged(template.id, template.revision)
+    try:
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {"channel": TEMPLATE_CHANGED_CHANNEL, "payload": event.payload()})
+            db.session.commit()
+            return
+
+        template_sync: Optional[TemplateSync] = current_app.config["template_sync"]
+        if template_sync is not None:
+            template_sync.apply(event)
+    except Exception:
+        # the change itself is saved, the nodes will catch up on the next event or refresh
+        db.session.rollback()
+        logger.exception("Could not publish revision %s of template '%s'", event.revision, event.template_id)
+
+
+class TemplateListener:
+    """
+    Listens to the template change events on a dedicated Postgres connection and applies them. When the connection is
+    lost, every template is applied once reconnected, as events may have been missed meanwhile. Must be run within the
+    app context.
+
+        Typical usage:
+
+            with app.app_context():
+                TemplateListener(template_sync).run()
+
+    """
+
+    def __init__(self, template_sync: TemplateSync, reconnect_interval: float = 5.0):
+        """
+        Args:
+            template_sync: Applies the events
+            reconnect_interval: How long to wait before reconnecting, in seconds
+        """
+        self.template_sync = template_sync
+        self.reconnect_interval = reconnect_interval
+        self._stopped = threading.Event()
+
+    def run(self, catch_up: bool = False) -> None:
+        """
+        Listens until stopped.
+
+        Args:
+            catch_up: Whether to apply every template once listening, e.g. as events may have been missed before
+        """
+        missed_events = catch_up
+        while not self._stopped.is_set():
+            try:
+                self._listen(catch_up=missed_events)
+            except Exception:
+                logger.exception("Template change listener disconnected, reconnecting in %ss",
+                                 self.reconnect_interval)
+                missed_events = True
+                self._stopped.wait(self.reconnect_interval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _listen(self, catch_up: bool) -> None:
+        connection = db.engine.raw_connection()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {TEMPLATE_CHANGED_CHANNEL}")
+            logger.info("Listening to template changes")
+            if catch_up:
+                self.template_sync.apply_all(Template.query.all())
+                db.session.remove()
+
+            while not self._stopped.is_set():
+                if select.select([dbapi_connection], [], [], POLL_INTERVAL) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                self._apply(dbapi_connection.notifies)
+                dbapi_connection.notifies.clear()
+        finally:
+            connection.invalidate()
+
+    def _apply(self, notifications: list) -> None:
+        # only the latest revision of each template is pulled when several events arrive at once
+        events: Dict[str, TemplateChanged] = dict()
+        for notification in notifications:
+            try:
+                event = TemplateChanged.from_payload(notification.payload)
+            except (ValueError, KeyError):
+                logger.warning("Ignoring invalid template change event %r", notification.payload)
+                continue
+            if event.revision > events.get(event.template_id, TemplateChanged(event.template_id, 0)).revision:
+                events[event.template_id] = event
+        for event in events.values():
+            try:
+                self.template_sync.apply(event)
+            except Exception:
+                logger.exception("Could not apply revision %s of template '%s'", event.revision, event.template_id)
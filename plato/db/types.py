@@ -0,0 +1,85 @@
+"""
+Column types and expressions that run on Postgres and on SQLite.
+
+Postgres keeps its native types, JSONB documents, enums and text arrays, while other databases, e.g. the SQLite file of
+an edge node or of the tests, fall back to JSON columns and to the equivalent JSON functions.
+"""
+from typing import Sequence
+
+from sqlalchemy import JSON, String, cast, distinct, func, select, type_coerce
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import Boolean
+
+SQLITE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+# a JSON document, stored as JSONB on Postgres
+JSONDocument = JSON().with_variant(JSONB(), "postgresql")
+# a list of strings, stored as a text array on Postgres and as a JSON array elsewhere
+StringArray = JSON().with_variant(ARRAY(String), "postgresql")
+
+
+class empty_array(FunctionElement):
+    """
+    Server default for a StringArray column, the empty array literal of the database.
+    """
+    name = "empty_array"
+    inherit_cache = True
+
+
+@compiles(empty_array)
+def _compile_empty_array(element: empty_array, compiler, **kw) -> str:
+    return "'[]'"
+
+
+@compiles(empty_array, "postgresql")
+def _compile_empty_array_postgresql(element: empty_array, compiler, **kw) -> str:
+    return "'{}'"
+
+
+class array_contains(ColumnElement):
+    """
+    Whether a StringArray column contains all the given values.
+    """
+    type = Boolean()
+    inherit_cache = False
+
+    def __init__(self, column: ColumnElement, values: Sequence[str]):
+        self.column = column
+        self.values = list(values)
+
+
+@compiles(array_contains)
+def _compile_array_contains(element: array_contains, compiler, **kw) -> str:
+    array_values = func.json_each(element.column).table_valued("value")
+    contained_values = (select(func.count(distinct(array_values.c.value)))
+                        .where(array_values.c.value.in_(element.values))
+                        .scalar_subquery())
+    return f"({compiler.process(contained_values == len(set(element.values)), **kw)})"
+
+
+@compiles(array_contains, "postgresql")
+def _compile_array_contains_postgresql(element: array_contains, compiler, **kw) -> str:
+    array_column = type_coerce(element.column, ARRAY(String))
+    return f"({compiler.process(array_column.contains(cast(element.values, ARRAY(String))), **kw)})"
+
+
+def supported_engine_options(db_url: str, options: dict) -> dict:
+    """
+    The engine options supported by the database of the URL, SQLite not pooling its connections by size.
+
+    Args:
+        db_url: The database URL
+        options: The engine options, e.g. DB_ENGINE_OPTIONS
+
+    Returns:
+        dict: The options that apply to the database
+    """
+    if db_url.startswith("sqlite"):
+        sqlite_options = {option: value for option, value in options.items() if option not in SQLITE_POOL_OPTIONS}
+        # sessions are used by the threads of the ASGI server and of the background executor
+        sqlite_options["connect_args"] = {"check_same_thread": False, **options.get("connect_args", {})}
+        return sqlite_options
+    return options
@@ -10,14 +10,25 @@ token_is_invalid_message = "Token is invalid: {0}"
 
 #templating
 invalid_compose_json = "Invalid compose json: {0}"
+missing_compose_data_part = "Multipart compose requests must have a '{0}' part with the compose json"
+invalid_output_file_name = "The output file name {0!r} does not apply to line {1}, or is outside of the output"
+line_not_composed = "The line could not be composed: {0!r}"
+invalid_merge_entry = "Invalid compose json for entry {0}: {1}"
+too_many_merge_entries = "Too many documents to merge: {0}, the maximum is {1}"
 invalid_template_details = "Invalid template details: {0}"
 template_already_exists = "Template '{0}' already exists in database"
 invalid_directory_structure = "Template directories are invalid"
 invalid_zip_file = "File must be of .zip type"
 template_not_found = "Template '{0}' not found"
+invalid_template_revision = "Invalid template revision: {0}, must be a positive integer"
+template_revision_not_found = "Revision {1} of template '{0}' not found"
+template_revision_files_unavailable = "The files of revision {1} of template '{0}' are not available"
 invalid_json_field = "JSON field is not valid: {0} "
 unsupported_mime_type = "No supported format in ACCEPT header: {0}, Available formats: {1}"
 aspect_ratio_compromised = "Specifying both width and height compromises the template's aspect ratio"
 resizing_unsupported = "Resizing unsupported on provided mime_type: {0}"
 single_page_unsupported = "Single page printing unsupported on provided mime_type: {0}"
 negative_number_invalid = "A negative number is not allowed: {0}"
+render_worker_lost = "The render of template '{0}' was interrupted, please try again"
+invalid_render_priority = "Invalid render priority: {0}, Available priorities: {1}"
+encoding_options_unsupported = "Quality and compression settings unsupported on provided mime_type: {0}"
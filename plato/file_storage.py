@@ -1,17 +1,24 @@
+import hashlib
+import io
+import json
 import os
 import pathlib
 import shutil
 import zipfile
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import BinaryIO, Dict, Any
+from typing import BinaryIO, Dict, Any, Optional
 from pathlib import Path
 
+import boto3
+from botocore.exceptions import ClientError
 from smart_open import s3
 
 from plato.db.models import Template
 from plato.util.path_util import tmp_path, tmp_zipfile_path, template_path, static_path, static_file_path, \
-    base_static_path
+    base_static_path, blob_path, static_manifest_path, base_static_manifest_path
+
+BLOB_CHUNK_SIZE = 64 * 1024
 
 
 class StorageType(str, Enum):
@@ -42,18 +49,48 @@ class NoIndexTemplateFound(FileStorageError):
         super(NoIndexTemplateFound, self).__init__(message)
 
 
+def link_file(source: pathlib.Path, target: pathlib.Path) -> None:
+    """
+    Hardlinks the target path to the source file, copying it instead when it cannot be linked, e.g. across file
+    systems. An existing target is replaced atomically, so it is never missing while being read.
+
+    Args:
+        source (pathlib.Path): the existing file
+        target (pathlib.Path): the path to link
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temporary_target = target.with_name(f".{target.name}.link")
+    _remove_file(temporary_target)
+    try:
+        os.link(source, temporary_target)
+    except OSError:
+        shutil.copyfile(source, temporary_target)
+    os.replace(temporary_target, target)
+
+
+def _remove_file(path: pathlib.Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
 class PlatoFileStorage(ABC):
     def __init__(self, data_directory: str):
         self.files_directory_name = data_directory
 
-    def save_template_files(self, template_id: str, template_dir: str, zip_file_name: str) -> None:
+    def save_template_files(self, template_id: str, template_dir: str, zip_file_name: str) -> Dict[str, Any]:
         """
-        Uploads template related files (static and template) to their respective file directories
+        Uploads template related files (static and template) to their respective file directories.
+        The template file is also stored content-addressed, so the files of every revision stay available.
 
         Args:
             template_id (str): the template id
             template_dir (str): The template directory
             zip_file_name (str): the filename for the zipfile
+
+        Returns:
+            Dict[str, Any]: the digest of the template file and of each static file, see TemplateRevision.files
         """
         base_tmp_path = tmp_path(zip_file_name)
         # extract files to temporary directory
@@ -63,12 +100,107 @@ class PlatoFileStorage(ABC):
         local_template = Path(template_path(base_tmp_path, template_id))
         with local_template.open(mode='rb') as tmp_file:
             self.save_file(tmp_file, template_path(template_dir, template_id))
+            tmp_file.seek(0)
+            template_address = self.save_blob(tmp_file, template_dir)
 
         static_files = os.listdir(static_path(base_tmp_path, template_id))
+        manifest = dict()
         for static_file in static_files:
             tmp_static_sys_path = Path(static_file_path(base_tmp_path, template_id, static_file))
             with tmp_static_sys_path.open(mode='rb') as tmp_file:
-                self.save_file(tmp_file, static_file_path(template_dir, template_id, static_file))
+                manifest[static_file] = self.save_blob(tmp_file, template_dir)
+        manifest = self.save_static_manifest(template_id, template_dir, manifest)
+        return {"template": template_address, "static": manifest}
+
+    def save_blob(self, input_file: BinaryIO, template_dir: str) -> str:
+        """
+        Stores a static file content-addressed, by the SHA-256 of its content, so that identical assets shared between
+        templates are only uploaded and stored once
+
+        Args:
+            input_file (BinaryIO): the static file
+            template_dir (str): The template directory
+
+        Returns:
+            str: the digest of the file, its address
+        """
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: input_file.read(BLOB_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        address = digest.hexdigest()
+
+        path = blob_path(template_dir, address)
+        if not self.has_file(path):
+            input_file.seek(0)
+            self.save_file(input_file, path)
+        return address
+
+    def save_static_manifest(self, template_id: str, template_dir: str, manifest: Dict[str, str]) -> Dict[str, str]:
+        """
+        Stores which blobs are the static files of a template, and links them into its static directory.
+        The manifest is merged with the existing one, so static files left out keep their previous content.
+
+        Args:
+            template_id (str): the template id
+            template_dir (str): The template directory
+            manifest (Dict[str, str]): the digest of each static file, by its path in the template's static directory
+
+        Returns:
+            Dict[str, str]: the merged manifest
+        """
+        manifest = {**self.get_static_manifest(template_id, template_dir), **manifest}
+        self.save_file(io.BytesIO(json.dumps(manifest).encode("utf-8")),
+                       static_manifest_path(template_dir, template_id))
+        for static_file, address in manifest.items():
+            link_file(self.local_blob(template_dir, address),
+                      pathlib.Path(f"{self.files_directory_name}/"
+                                   f"{static_file_path(template_dir, template_id, static_file)}"))
+        return manifest
+
+    def local_blob(self, template_dir: str, address: str) -> pathlib.Path:
+        """
+        Gets the local copy of a blob, fetching it when it was stored by another node
+
+        Args:
+            template_dir (str): The template directory
+            address (str): the digest of the blob
+
+        Raises:
+            FileNotFoundError: When the blob is not in the storage
+
+        Returns:
+            pathlib.Path: the local path of the blob
+        """
+        local_blob = pathlib.Path(f"{self.files_directory_name}/{blob_path(template_dir, address)}")
+        if not local_blob.is_file() and self.read_file(blob_path(template_dir, address)) is None:
+            raise FileNotFoundError(blob_path(template_dir, address))
+        return local_blob
+
+    def get_static_manifest(self, template_id: str, template_dir: str) -> Dict[str, str]:
+        """
+        Gets which blobs are the static files of a template
+
+        Args:
+            template_id (str): the template id
+            template_dir (str): The template directory
+
+        Returns:
+            Dict[str, str]: the digest of each static file by its path, empty if the template has no manifest
+        """
+        manifest = self.read_file(static_manifest_path(template_dir, template_id))
+        return json.loads(manifest) if manifest is not None else dict()
+
+    def has_file(self, path: str) -> bool:
+        """
+        Checks whether a file exists in storage
+
+        Args:
+            path (str): the storage path
+
+        Returns:
+            bool: whether the file exists
+        """
+        return pathlib.Path(f"{self.files_directory_name}/{path}").is_file()
 
     @abstractmethod
     def save_file(self, input_file: BinaryIO, path: str) -> None:
@@ -81,6 +213,33 @@ class PlatoFileStorage(ABC):
         """
         raise NotImplementedError
 
+    def read_file(self, path: str) -> Optional[bytes]:
+        """
+        Reads a file from storage
+
+        Args:
+            path (str): the storage path
+
+        Returns:
+            Optional[bytes]: the file content, or None if the file does not exist
+        """
+        return self.read_file_locally(path)
+
+    def read_file_locally(self, path: str) -> Optional[bytes]:
+        """
+        Reads a file from the project's data folder
+
+        Args:
+            path (str): the path inside the data folder
+
+        Returns:
+            Optional[bytes]: the file content, or None if the file does not exist
+        """
+        local_path = pathlib.Path(f"{self.files_directory_name}/{path}")
+        if not local_path.is_file():
+            return None
+        return local_path.read_bytes()
+
     def write_file_locally(self, input_file: BinaryIO, path: str):
         """
         Writes a file to the defined target directory inside the project's data folder
@@ -91,10 +250,31 @@ class PlatoFileStorage(ABC):
         """
         path = pathlib.Path(f"{self.files_directory_name}/{path}")
         path.parent.mkdir(parents=True, exist_ok=True)
+        # written to a new file, as the path may be a hardlink to a blob shared with other templates
+        _remove_file(path)
         with open(path, mode="wb") as file:
             input_file.seek(0)
             file.write(input_file.read())
 
+    def get_template_files(self, template_id: str, template_directory: str) -> Dict[str, bytes]:
+        """
+        Gets the files of a template, its template file and its static files
+
+        Args:
+            template_id (str): the template id
+            template_directory (str): the base directory of the templates
+
+        Returns:
+            Dict[str, bytes]: the file contents, by path relative to the template directory
+        """
+        base_path = pathlib.Path(f"{self.files_directory_name}/{template_directory}")
+        local_template = pathlib.Path(f"{self.files_directory_name}/{template_path(template_directory, template_id)}")
+        local_static = pathlib.Path(f"{self.files_directory_name}/{static_path(template_directory, template_id)}")
+        local_files = [local_template] if local_template.is_file() else []
+        if local_static.is_dir():
+            local_files.extend(path for path in local_static.rglob("*") if path.is_file())
+        return {path.relative_to(base_path).as_posix(): path.read_bytes() for path in local_files}
+
     @staticmethod
     def write_files(files: Dict[str, Any], target_directory: str) -> None:
         """
@@ -108,6 +288,7 @@ class PlatoFileStorage(ABC):
         for key, content in files.items():
             path = pathlib.Path(f"{target_directory}/{key}")
             path.parent.mkdir(parents=True, exist_ok=True)
+            _remove_file(path)
             with open(path, mode="wb") as file:
                 file.write(content)
 
@@ -175,6 +356,70 @@ class S3FileStorage(PlatoFileStorage, ABC):
 
         self.write_file_locally(input_file, path)
 
+    def has_file(self, path: str) -> bool:
+        """
+        Checks whether a file exists in the local folder or in the S3 Bucket
+
+        Args:
+            path (str): the S3 Bucket path
+
+        Returns:
+            bool: whether the file exists
+        """
+        if super().has_file(path):
+            return True
+        try:
+            boto3.client("s3").head_object(Bucket=self.bucket_name, Key=path)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def read_file(self, path: str) -> Optional[bytes]:
+        """
+        Reads a file from the local folder, falling back to the S3 Bucket and keeping a local copy
+
+        Args:
+            path (str): the S3 Bucket path
+
+        Returns:
+            Optional[bytes]: the file content, or None if the file does not exist
+        """
+        content = self.read_file_locally(path)
+        if content is not None:
+            return content
+        try:
+            with s3.open(self.bucket_name, path, mode='rb') as file:
+                content = file.read()
+        except (OSError, ValueError):
+            # smart_open raises either, depending on the version, when the key does not exist
+            return None
+        self.write_file_locally(io.BytesIO(content), path)
+        return content
+
+    def get_template_files(self, template_id: str, template_directory: str) -> Dict[str, bytes]:
+        """
+        Gets the files of a template, its template file and its static files, from the S3 Bucket
+
+        Args:
+            template_id (str): the template id
+            template_directory (str): the s3-bucket path for the templates directory
+
+        Returns:
+            Dict[str, bytes]: the file contents, by path relative to the template directory
+        """
+        template_files = self.get_file(path=template_path(template_directory, template_id),
+                                       template_directory=template_directory)
+        # with the trailing slash, so the static files of templates whose id starts with this one are left out
+        template_files.update(self.get_file(path=f"{static_path(template_directory, template_id)}/",
+                                            template_directory=template_directory))
+        template_files = {path.lstrip("/"): content for path, content in template_files.items()}
+        for static_file, address in self.get_static_manifest(template_id, template_directory).items():
+            relative_path = static_file_path(template_directory, template_id, static_file)[len(template_directory) + 1:]
+            template_files[relative_path] = self.read_file(blob_path(template_directory, address))
+        return template_files
+
     def load_templates(self, target_directory: str, template_directory: str) -> None:
         """
         Gets templates from the AWS S3 bucket which are associated with ones available in the DB.
@@ -196,7 +441,27 @@ class S3FileStorage(PlatoFileStorage, ABC):
 
         self.write_files(files=static_files, target_directory=target_directory)
 
+        manifests = self.get_file(path=f"{base_static_manifest_path(template_directory)}/",
+                                  template_directory=template_directory)
+        # get_file keys are relative to the template directory
+        template_manifests = {template.id: json.loads(manifests.get(
+            static_manifest_path(template_directory, template.id)[len(template_directory):], "{}"))
+            for template in templates}
+
+        # content-addressed static files of the current templates, each downloaded once and linked into the static
+        # directory of every template using it. The blobs of past revisions and of template files are left out, a
+        # past revision fetching its own when it is first composed
+        for address in {address for manifest in template_manifests.values() for address in manifest.values()}:
+            local_blob = pathlib.Path(blob_path(target_directory, address))
+            local_blob.parent.mkdir(parents=True, exist_ok=True)
+            with s3.open(self.bucket_name, blob_path(template_directory, address), mode='rb') as blob_file:
+                local_blob.write_bytes(blob_file.read())
+
         for template in templates:
+            for static_file, address in template_manifests[template.id].items():
+                link_file(pathlib.Path(blob_path(target_directory, address)),
+                          pathlib.Path(static_file_path(target_directory, template.id, static_file)))
+
             # get template content
             template_files = self.get_file(path=template_path(template_directory, template.id),
                                            template_directory=template_directory)
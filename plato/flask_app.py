@@ -4,20 +4,40 @@ Flask app creation is handled here by the create_app function.
 Import the function wherever you decide to create a flask app.
 
 """
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from typing import Callable, Optional, Sequence, Union
+
 from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
 
 from jinja2 import Environment as JinjaEnv
 from plato.api import initialize_api
+from plato.compose.render_cache import RenderCache
+from plato.compose.renderer import RenderBudget
+from plato.compose.scheduler import RenderScheduler
+from plato.compose.single_flight import SingleFlight
 from plato.file_storage import PlatoFileStorage
 from plato.views import swag
 from plato.db import db
+from plato.db.replicas import ReadReplicas, replica_binds
+from plato.db.template_events import TemplateSync
+from plato.db.types import supported_engine_options
 from plato.cli import register_cli_commands
 
 
 def create_app(db_url: str, template_static_directory: str,
-               jinja_env: JinjaEnv, swagger_ui_config: dict, storage: PlatoFileStorage) -> Flask:
+               jinja_env: JinjaEnv, swagger_ui_config: Union[dict, Callable[[], dict]], storage: PlatoFileStorage,
+               swagger_spec_cache_dir: Optional[str] = None,
+               single_flight_directory: Optional[str] = None,
+               engine_options: Optional[dict] = None,
+               read_replica_urls: Sequence[str] = (),
+               read_replica_retry_interval: float = 30.0,
+               render_budget: Optional[RenderBudget] = None,
+               render_scheduler: Optional[RenderScheduler] = None,
+               render_cache: Optional[RenderCache] = None,
+               template_sync: Optional[TemplateSync] = None) -> Flask:
     """
 
     Args:
@@ -26,7 +46,19 @@ def create_app(db_url: str, template_static_directory: str,
         db_url: Database URI
         swagger_ui_config: The Swagger-UI config to be used with Flasgger.
          As defined in https://github.com/flasgger/flasgger#swagger-ui-and-templates
+         A function returning the config is only called when the docs are first served, for config costly to load
         storage: The File Storage class
+        swagger_spec_cache_dir: Directory to cache the generated swagger specs in, only cached in memory when None
+        single_flight_directory: Directory for the locks coalescing identical compositions across processes,
+         only coalesced within the process when None
+        engine_options: The SQLAlchemy engine options, e.g. the pool size, for the primary and the read replicas
+        read_replica_urls: Database URIs of the read replicas for the read endpoints, reads go to the primary if empty
+        read_replica_retry_interval: For how long, in seconds, a read replica that failed is skipped
+        render_budget: The global limits on the resources used by a single render, unlimited when None
+        render_scheduler: Schedules the renders by priority, one slot per CPU without further limits when None
+        render_cache: Host-wide cache of the rendered outputs, nothing is cached when None
+        template_sync: Applies template changes to the node when there is no Postgres to publish them on, see
+         plato.db.template_events
 
     Returns:
 
@@ -34,16 +66,30 @@ def create_app(db_url: str, template_static_directory: str,
     app = Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = db_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = supported_engine_options(db_url, engine_options or {})
+    app.config['SQLALCHEMY_BINDS'] = replica_binds(read_replica_urls)
     db.init_app(app)
     Migrate(app, db)
     CORS(app)
 
-    app.config['SWAGGER'] = swagger_ui_config
+    if callable(swagger_ui_config):
+        app.config['SWAGGER_CONFIG_LOADER'] = swagger_ui_config
+    else:
+        app.config['SWAGGER'] = swagger_ui_config
+    app.config['SWAGGER_SPEC_CACHE_DIR'] = swagger_spec_cache_dir
     swag.init_app(app)
 
     app.config["JINJAENV"] = jinja_env
     app.config["TEMPLATE_STATIC"] = template_static_directory
+    app.config["RENDER_BUDGET"] = render_budget or RenderBudget()
     app.config["storage"] = storage
+    app.config["single_flight"] = SingleFlight(single_flight_directory)
+    app.config["render_cache"] = render_cache or RenderCache(None, max_bytes=0)
+    app.config["template_sync"] = template_sync
+    app.config["render_scheduler"] = render_scheduler or RenderScheduler(capacity=cpu_count() or 1)
+    app.config["read_replicas"] = ReadReplicas(app.config['SQLALCHEMY_BINDS'].keys(), read_replica_retry_interval)
+    # for work done after the response is sent, e.g. pre-rendering the examples of a template
+    app.config["background_executor"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plato-background")
 
     register_cli_commands(app)
     initialize_api(app)
@@ -1,5 +1,6 @@
-import tomlkit
-from os import environ, getenv
+from functools import lru_cache
+from os import environ, getenv, cpu_count
+from typing import Optional
 from dotenv import load_dotenv, find_dotenv
 
 from plato.util.setup_util import inside_container
@@ -8,17 +9,28 @@ if not inside_container():
     load_dotenv(find_dotenv(), override=False)
 
 
+@lru_cache(maxsize=None)
 def _get_project_meta() -> dict:
     with open(find_dotenv(filename='pyproject.toml'), mode='r') as pyproject:
         file_contents = pyproject.read()
 
-    return tomlkit.parse(file_contents)['tool']['poetry']
+    try:
+        from tomllib import loads as parse_toml
+    except ImportError:  # python < 3.11
+        from tomlkit import parse as parse_toml
 
+    return parse_toml(file_contents)['tool']['poetry']
 
-__project_meta = _get_project_meta()
 
-PROJECT_NAME = __project_meta["name"]
-PROJECT_VERSION = __project_meta["version"]
+# project metadata is only read from pyproject.toml when first accessed
+_PROJECT_META_SETTINGS = {"PROJECT_NAME": "name", "PROJECT_VERSION": "version"}
+
+
+def __getattr__(name: str):
+    if name in _PROJECT_META_SETTINGS:
+        return _get_project_meta()[_PROJECT_META_SETTINGS[name]]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Template storage
 S3_BUCKET = environ["S3_BUCKET"]
@@ -27,16 +39,72 @@ TEMPLATE_DIRECTORY = environ["TEMPLATE_DIRECTORY"]
 DATA_DIR = environ["DATA_DIR"]
 STORAGE_TYPE = environ["STORAGE_TYPE"]
 
-# Database
-DB_HOST = environ["DB_HOST"]
-DB_PORT = environ["DB_PORT"]
-DB_USERNAME = environ["DB_USERNAME"]
-DB_PASSWORD = environ["DB_PASSWORD"]
-DB_DATABASE = environ["DB_DATABASE"]
+# Compose
+# directory for the host-wide single-flight locks, identical compositions are only coalesced within a process if unset
+SINGLE_FLIGHT_DIRECTORY = getenv("SINGLE_FLIGHT_DIRECTORY")
+# SQLite database of the render cache shared by the workers of the host, e.g. on a tmpfs, nothing is cached if unset
+RENDER_CACHE_PATH = getenv("RENDER_CACHE_PATH")
+RENDER_CACHE_MAX_BYTES = int(getenv("RENDER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+THUMBNAIL_WIDTH = int(getenv("THUMBNAIL_WIDTH", "200"))
+# thumbnails are stored per template revision, so they can be cached by clients for long
+THUMBNAIL_MAX_AGE = int(getenv("THUMBNAIL_MAX_AGE", "86400"))
+# responses pinned to a template revision never change, so they can be cached for as long as clients and CDNs allow
+REVISION_MAX_AGE = int(getenv("REVISION_MAX_AGE", str(365 * 24 * 60 * 60)))
+
+# global render budgets, each can be overridden per template with the "render_budget" entry of its metadata
+RENDER_TIME_BUDGET = float(getenv("RENDER_TIME_BUDGET", "60"))
+RENDER_MAX_PAGES = int(getenv("RENDER_MAX_PAGES", "1000"))
+RENDER_MAX_OUTPUT_BYTES = int(getenv("RENDER_MAX_OUTPUT_BYTES", str(100 * 1024 * 1024)))
+RENDER_MAX_RASTER_PIXELS = int(getenv("RENDER_MAX_RASTER_PIXELS", "50000000"))
+
+# renders running at the same time per process, interactive renders being granted a slot before bulk ones
+RENDER_CONCURRENCY = int(getenv("RENDER_CONCURRENCY", str(cpu_count() or 1)))
+# renders of the same template or for the same client running at the same time, unlimited if unset
+RENDER_MAX_PER_TEMPLATE = int(getenv("RENDER_MAX_PER_TEMPLATE", "0")) or None
+RENDER_MAX_PER_CLIENT = int(getenv("RENDER_MAX_PER_CLIENT", "0")) or None
+RENDER_QUEUE_TIMEOUT = float(getenv("RENDER_QUEUE_TIMEOUT", "60"))
+
+MERGE_MAX_ENTRIES = int(getenv("MERGE_MAX_ENTRIES", "500"))
+MERGE_RENDER_WORKERS = int(getenv("MERGE_RENDER_WORKERS", "4"))
+
+# ASGI serving, see plato.asgi
+# renders run in worker processes, template lookups and storage reads in threads, off the event loop
+ASGI_RENDER_WORKERS = int(getenv("ASGI_RENDER_WORKERS", "4"))
+ASGI_IO_WORKERS = int(getenv("ASGI_IO_WORKERS", "32"))
+
+# Swagger
+SWAGGER_SPEC_CACHE_DIR = getenv("SWAGGER_SPEC_CACHE_DIR", f"{DATA_DIR}/swagger")
+
+# Database, a DATABASE_URL replaces the Postgres settings, e.g. sqlite:////var/lib/plato/plato.db on an edge node
+DATABASE_URL = getenv("DATABASE_URL")
+
+
+def _db_setting(name: str) -> Optional[str]:
+    return environ[name] if DATABASE_URL is None else getenv(name)
+
+
+DB_HOST = _db_setting("DB_HOST")
+DB_PORT = _db_setting("DB_PORT")
+DB_USERNAME = _db_setting("DB_USERNAME")
+DB_PASSWORD = _db_setting("DB_PASSWORD")
+DB_DATABASE = _db_setting("DB_DATABASE")
 
 
 def db_url(database_name: str) -> str:
     return f'postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{database_name}'
 
 
-WORKING_DB_URL = db_url(DB_DATABASE)
+WORKING_DB_URL = DATABASE_URL or db_url(DB_DATABASE)
+
+# engine pool options, applied to the primary and to the read replicas
+DB_ENGINE_OPTIONS = {
+    "pool_size": int(getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": int(getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+# comma separated URLs of the read replicas the read endpoints are routed to, all reads go to the primary if unset
+DB_READ_REPLICA_URLS = [url.strip() for url in getenv("DB_READ_REPLICA_URLS", "").split(",") if url.strip()]
+# for how long, in seconds, a read replica that failed is skipped
+DB_READ_REPLICA_RETRY_INTERVAL = float(getenv("DB_READ_REPLICA_RETRY_INTERVAL", "30"))
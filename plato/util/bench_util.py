@@ -0,0 +1,151 @@
+"""
+Helpers to summarize latency measurements, shared by the compose benchmark suite and the load generator.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from random import Random
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+
+class LatencySummary(NamedTuple):
+    """
+    Summary of a set of latency samples, all durations in seconds.
+    """
+    count: int
+    errors: int
+    duration: float
+    throughput: float
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+    @property
+    def error_rate(self) -> float:
+        total = self.count + self.errors
+        return self.errors / total if total else 0.0
+
+
+def percentile(sorted_samples: Sequence[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of already sorted samples.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+
+    Args:
+        sorted_samples: The samples, in ascending order
+        percent: The intended percentile, between 0 and 100
+
+    Returns: The sample at the given percentile, or 0.0 when there are no samples
+    """
+    if not sorted_samples:
+        return 0.0
+    rank = max(ceil(percent / 100 * len(sorted_samples)), 1)
+    return sorted_samples[rank - 1]
+
+
+def summarize_latencies(latencies: Sequence[float], duration: float, errors: int = 0) -> LatencySummary:
+    """
+    Builds a LatencySummary from the successful request latencies.
+
+    Args:
+        latencies: Latency of every successful request, in seconds
+        duration: Wall clock duration of the whole run, in seconds
+        errors: Number of failed requests
+
+    Returns:
+        LatencySummary: The summary for the run
+    """
+    samples = sorted(latencies)
+    count = len(samples)
+    return LatencySummary(count=count,
+                          errors=errors,
+                          duration=duration,
+                          throughput=count / duration if duration > 0 else 0.0,
+                          mean=sum(samples) / count if count else 0.0,
+                          p50=percentile(samples, 50),
+                          p95=percentile(samples, 95),
+                          p99=percentile(samples, 99),
+                          max=samples[-1] if samples else 0.0)
+
+
+def parse_mime_mix(mime_mix: Sequence[str]) -> Dict[str, float]:
+    """
+    Parses MIME types with optional weights, in the form 'image/png=3', into a dict of MIME type to weight.
+
+    >>> parse_mime_mix(["application/pdf=3", "image/png"])
+    {'application/pdf': 3.0, 'image/png': 1.0}
+
+    Args:
+        mime_mix: The MIME types, each one optionally followed by '=' and its weight
+
+    Raises:
+        ValueError: When a weight is not a positive number
+
+    Returns:
+        Dict[str, float]: The weight for each MIME type
+    """
+    weights = {}
+    for entry in mime_mix:
+        mime_type, _, weight = entry.partition("=")
+        weights[mime_type] = float(weight) if weight else 1.0
+        if weights[mime_type] <= 0:
+            raise ValueError(f"MIME type weight must be positive: {entry}")
+    return weights
+
+
+def run_load(request_function: Callable[[str, dict, str], None],
+             compositions: Sequence[Tuple[str, dict]],
+             mime_weights: Dict[str, float],
+             concurrency: int,
+             duration: float) -> Dict[str, LatencySummary]:
+    """
+    Replays compositions concurrently for a fixed duration.
+
+    Args:
+        request_function: Composes a (template id, compose data, MIME type), raising an exception when it fails
+        compositions: The (template id, compose data) pairs to be replayed, picked at random
+        mime_weights: The weight of each MIME type on the request mix
+        concurrency: The number of concurrent clients
+        duration: How long to keep on sending requests for, in seconds
+
+    Returns:
+        Dict[str, LatencySummary]: The summary for each MIME type
+    """
+    mime_types = list(mime_weights)
+    weights = [mime_weights[mime_type] for mime_type in mime_types]
+    latencies: Dict[str, List[float]] = {mime_type: [] for mime_type in mime_types}
+    errors: Dict[str, int] = {mime_type: 0 for mime_type in mime_types}
+    lock = Lock()
+    deadline = perf_counter() + duration
+
+    def client(seed: int):
+        random = Random(seed)
+        while perf_counter() < deadline:
+            template_id, compose_data = random.choice(compositions)
+            mime_type = random.choices(mime_types, weights)[0]
+            start = perf_counter()
+            try:
+                request_function(template_id, compose_data, mime_type)
+            except Exception:
+                with lock:
+                    errors[mime_type] += 1
+            else:
+                elapsed = perf_counter() - start
+                with lock:
+                    latencies[mime_type].append(elapsed)
+
+    run_start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client, seed) for seed in range(concurrency)]:
+            future.result()
+    run_duration = perf_counter() - run_start
+
+    return {mime_type: summarize_latencies(latencies[mime_type], run_duration, errors[mime_type])
+            for mime_type in mime_types}
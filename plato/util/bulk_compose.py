@@ -0,0 +1,311 @@
+"""
+Offline bulk composition, to render large batches of compose data for a template without going through the API.
+
+The compose data is read as NDJSON, one object per line, and rendered by a pool of worker processes, each writing its
+outputs straight to the output directory or storage prefix, e.g. s3://bucket/runs/2024-01. Only a bounded window of
+lines is in flight at a time, so a batch of any size is composed in constant memory.
+
+The progress of the run is checkpointed in the output as the number of the last line up to which every line was
+attempted, along with the lines that could not be composed, so an interrupted run resumes from there instead of
+starting over, composing the failed lines again:
+
+    {"template_id": "certificate", "revision": 3, "input": "payloads.ndjson", ..., "line": 120500, "failed_lines": [17]}
+
+"""
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from mimetypes import guess_extension
+from pathlib import PurePosixPath
+from typing import Callable, Deque, Iterable, List, NamedTuple, Optional, Tuple
+
+import smart_open
+from flask import Flask
+
+from plato.api import COMPOSE_ERRORS, compose_error_response
+from plato.compose.renderer import compose
+from plato.db.models import Template
+from plato.error_messages import invalid_compose_json, invalid_output_file_name, line_not_composed
+
+CHECKPOINT_NAME = ".compose-bulk.checkpoint"
+# how often the checkpoint is saved and the progress reported, in seconds
+CHECKPOINT_INTERVAL = 5.0
+# lines in flight per worker, enough to keep the workers busy while the oldest line is awaited
+LINES_PER_WORKER = 4
+DEFAULT_FILE_NAME = "{template_id}-{line:06d}{extension}"
+
+
+class InvalidCheckpoint(Exception):
+    """
+    Exception to be raised when the checkpoint in the output was left by a different run
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+class BulkComposeJob(NamedTuple):
+    """
+    What a bulk composition renders and where it writes it to.
+    """
+    app: Flask
+    template: Template
+    mime_type: str
+    output: str
+    file_name: str
+
+    def checkpoint_run(self, input_name: str) -> dict:
+        """
+        Identifies the run in its checkpoint, so a checkpoint is only resumed by the same run.
+        """
+        return {"template_id": self.template.id,
+                "revision": self.template.revision,
+                "input": input_name,
+                "mime_type": self.mime_type,
+                "file_name": self.file_name}
+
+
+class Checkpoint(NamedTuple):
+    """
+    Progress of a bulk composition, as saved in the output.
+    """
+    # the number of the last line up to which every line was attempted
+    line: int = 0
+    # the lines up to it that could not be composed, in order
+    failed_lines: Tuple[int, ...] = ()
+
+
+class BulkProgress(NamedTuple):
+    """
+    Counts of a bulk composition, so far or once completed.
+    """
+    composed: int
+    failed: int
+    resumed_from: int
+    # lines which failed in the resumed run, composed again
+    retried: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        return (self.composed + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def output_path(output: str, name: str) -> str:
+    """
+    The path or URL of a file within the output directory or storage prefix.
+    """
+    return f"{output.rstrip('/')}/{name}"
+
+
+def read_checkpoint(job: BulkComposeJob, input_name: str) -> Checkpoint:
+    """
+    The progress to resume the run from, from the start when there is no checkpoint in the output.
+
+    Args:
+        job: The bulk composition
+        input_name: The path or URL of the NDJSON input
+
+    Raises:
+        InvalidCheckpoint: When the checkpoint was left by a run of another template, revision, input or output format
+
+    Returns:
+        Checkpoint: The progress of the previous run
+    """
+    try:
+        with smart_open.open(output_path(job.output, CHECKPOINT_NAME), "r", compression="disable") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except OSError:
+        # no checkpoint, smart_open raising a plain OSError for missing objects
+        return Checkpoint()
+    except ValueError as e:
+        raise InvalidCheckpoint(f"Invalid {CHECKPOINT_NAME}, {e}")
+    expected_run = job.checkpoint_run(input_name)
+    mismatches = [f"{field} {checkpoint.get(field)!r} instead of {value!r}" for field, value in expected_run.items()
+                  if checkpoint.get(field) != value]
+    if mismatches:
+        raise InvalidCheckpoint(f"The checkpoint in the output is for another run: {', '.join(mismatches)}")
+    return Checkpoint(line=checkpoint["line"], failed_lines=tuple(checkpoint.get("failed_lines", ())))
+
+
+def write_checkpoint(job: BulkComposeJob, input_name: str, checkpoint: Checkpoint) -> None:
+    """
+    Saves the progress of the run in the output.
+
+    Args:
+        job: The bulk composition
+        input_name: The path or URL of the NDJSON input
+        checkpoint: The progress of the run
+    """
+    _make_parent_directory(output_path(job.output, CHECKPOINT_NAME))
+    with smart_open.open(output_path(job.output, CHECKPOINT_NAME), "w", compression="disable") as checkpoint_file:
+        json.dump(dict(job.checkpoint_run(input_name), line=checkpoint.line, failed_lines=list(checkpoint.failed_lines)),
+                  checkpoint_file)
+
+
+def compose_bulk(job: BulkComposeJob, lines: Iterable[str], input_name: str, workers: int, resume: bool = True,
+                 on_progress: Callable[[BulkProgress], None] = lambda progress: None,
+                 on_failure: Callable[[int, str], None] = lambda line, message: None) -> BulkProgress:
+    """
+    Composes the compose data of every NDJSON line across a pool of worker processes, blank lines being skipped.
+    The renders bypass the render cache and scheduler, as every line is composed once and nothing else runs on them.
+
+    Args:
+        job: The bulk composition
+        lines: The NDJSON lines, read as they are composed
+        input_name: The path or URL of the NDJSON input, recorded in the checkpoint
+        workers: Number of worker processes
+        resume: Whether to skip the lines already composed by a previous run, as checkpointed in the output, the lines
+         it failed to compose being composed again
+        on_progress: Called with the progress every CHECKPOINT_INTERVAL seconds
+        on_failure: Called with the line number and the error message of every line that could not be composed
+
+    Raises:
+        InvalidCheckpoint: When resuming and the checkpoint in the output was left by another run
+
+    Returns:
+        BulkProgress: The counts of the run
+    """
+    resumed = read_checkpoint(job, input_name) if resume else Checkpoint()
+    retried_lines = set(resumed.failed_lines)
+    started_at = time.monotonic()
+    composed = 0
+    failed_lines: List[int] = []
+    completed_line = 0
+    in_flight: Deque[Tuple[int, Future]] = deque()
+
+    def progress() -> BulkProgress:
+        return BulkProgress(composed=composed, failed=len(failed_lines), resumed_from=resumed.line,
+                            retried=len(retried_lines), elapsed=time.monotonic() - started_at)
+
+    def checkpoint() -> Checkpoint:
+        # the failed lines of the previous run not composed again yet are still to be retried
+        return Checkpoint(line=max(resumed.line, completed_line),
+                          failed_lines=tuple(failed_lines + [line for line in resumed.failed_lines
+                                                             if line > completed_line]))
+
+    def complete_oldest() -> None:
+        nonlocal completed_line, composed
+        # lines are awaited in order, so every line up to the awaited one was attempted
+        completed_line, error = _complete_oldest(in_flight)
+        if error is None:
+            composed += 1
+        else:
+            failed_lines.append(completed_line)
+            on_failure(completed_line, error)
+
+    executor = _worker_pool(job, workers)
+    checkpointed_at = time.monotonic()
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            if (line_number <= resumed.line and line_number not in retried_lines) or not line.strip():
+                continue
+            try:
+                future = executor.submit(_compose_line, line_number, line)
+            except BrokenProcessPool:
+                # a worker died, e.g. killed when out of memory, failing the lines in flight: start over with new ones
+                executor.shutdown(wait=False)
+                executor = _worker_pool(job, workers)
+                future = executor.submit(_compose_line, line_number, line)
+            in_flight.append((line_number, future))
+            if len(in_flight) < workers * LINES_PER_WORKER:
+                continue
+            complete_oldest()
+            if time.monotonic() - checkpointed_at >= CHECKPOINT_INTERVAL:
+                write_checkpoint(job, input_name, checkpoint())
+                on_progress(progress())
+                checkpointed_at = time.monotonic()
+        while in_flight:
+            complete_oldest()
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+        executor.shutdown()
+        write_checkpoint(job, input_name, checkpoint())
+    return progress()
+
+
+def _worker_pool(job: BulkComposeJob, workers: int) -> ProcessPoolExecutor:
+    # forked, so the workers inherit the app with its jinja environment and the templates already loaded
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                               initializer=_initialize_worker, initargs=(job,))
+
+
+def _complete_oldest(in_flight: Deque[Tuple[int, Future]]) -> Tuple[int, Optional[str]]:
+    line_number, future = in_flight[0]
+    try:
+        error = future.result()
+    except Exception as e:
+        # the worker composing the line died, so the line fails instead of the run
+        error = line_not_composed.format(e)
+    in_flight.popleft()
+    return line_number, error
+
+
+def _make_parent_directory(path: str) -> None:
+    if "://" not in path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+
+# the job of the worker processes, inherited from the main process as they are forked
+_worker_job: Optional[BulkComposeJob] = None
+
+
+def _initialize_worker(job: BulkComposeJob) -> None:
+    global _worker_job
+    _worker_job = job
+
+
+def _compose_line(line_number: int, line: str) -> Optional[str]:
+    """
+    Composes a line and writes it to the output, run in a worker process.
+
+    Returns:
+        Optional[str]: The error message when the line could not be composed
+    """
+    job = _worker_job
+    try:
+        compose_data = json.loads(line)
+    except ValueError as e:
+        return invalid_compose_json.format(e)
+
+    file_name = _file_name(job, line_number, compose_data)
+    if file_name is None:
+        return invalid_output_file_name.format(job.file_name, line_number)
+
+    try:
+        with job.app.app_context():
+            composed_file = compose(job.template, compose_data, job.mime_type)
+        path = output_path(job.output, file_name)
+        _make_parent_directory(path)
+        with smart_open.open(path, "wb", compression="disable") as output_file:
+            output_file.write(composed_file.getbuffer())
+    except COMPOSE_ERRORS as e:
+        message, _ = compose_error_response(e, job.template.id, job.mime_type)
+        return message["message"]
+    except Exception as e:
+        # e.g. an error of the template on valid compose data, or of the output storage, failing only this line
+        return line_not_composed.format(e)
+    return None
+
+
+def _file_name(job: BulkComposeJob, line_number: int, compose_data: object) -> Optional[str]:
+    """
+    The name of the output file of a line, from the file name template, e.g. "{p[serial_number]}{extension}".
+    None when the template does not apply to the line or names a file outside of the output.
+    """
+    try:
+        file_name = job.file_name.format(line=line_number, p=compose_data, template_id=job.template.id,
+                                         revision=job.template.revision, extension=guess_extension(job.mime_type))
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        return None
+    path = PurePosixPath(file_name)
+    if not file_name or path.is_absolute() or ".." in path.parts or "\\" in file_name:
+        return None
+    return file_name
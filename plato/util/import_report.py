@@ -0,0 +1,60 @@
+"""
+Import time report, to keep the startup cost of the workers and CLI commands in check.
+
+It runs the import in a fresh interpreter with '-X importtime' so that nothing is already cached in sys.modules.
+"""
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+
+class ImportTime(NamedTuple):
+    """
+    Import time of a single module, in microseconds.
+    """
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def measure_import_times(module: str) -> List[ImportTime]:
+    """
+    Measures the import time of a module and of everything it imports.
+
+    Args:
+        module: The module to be imported, e.g. 'main'
+
+    Raises:
+        subprocess.CalledProcessError: When the module fails to import
+
+    Returns:
+        List[ImportTime]: The import time for every imported module, in import order
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    import_times = []
+    for line in process.stderr.splitlines():
+        # lines are in the form 'import time:       self [us] |  cumulative | imported package'
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, imported_module = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header
+        import_times.append(ImportTime(module=imported_module.strip(),
+                                       self_us=int(self_us),
+                                       cumulative_us=int(cumulative_us)))
+    return import_times
+
+
+def imported_modules(module: str) -> List[str]:
+    """
+    Lists every module imported as a consequence of importing the given module, in a fresh interpreter.
+
+    Args:
+        module: The module to be imported
+
+    Returns:
+        List[str]: The names of all the imported modules
+    """
+    return [import_time.module for import_time in measure_import_times(module)]
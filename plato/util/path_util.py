@@ -28,6 +28,48 @@ def base_static_path(template_dir: str) -> str:
     return f"{template_dir}/static"
 
 
+def blob_path(template_dir: str, digest: str) -> str:
+    """
+        Returns the path for a content-addressed static file, by the SHA-256 of its content
+    """
+    return f"{base_blob_path(template_dir)}/{digest}"
+
+
+def base_blob_path(template_dir: str) -> str:
+    """
+        Returns the base path for the content-addressed static files
+    """
+    return f"{template_dir}/blobs"
+
+
+def static_manifest_path(template_dir: str, template_id: str) -> str:
+    """
+        Returns the path for the manifest of the content-addressed static files of a certain template
+    """
+    return f"{base_static_manifest_path(template_dir)}/{template_id}.json"
+
+
+def base_static_manifest_path(template_dir: str) -> str:
+    """
+        Returns the base path for the static file manifests
+    """
+    return f"{template_dir}/manifests"
+
+
+def thumbnail_path(template_dir: str, template_id: str, revision: int, width: int) -> str:
+    """
+        Returns the path for the thumbnail of a certain template revision
+    """
+    return f"{template_dir}/thumbnails/{template_id}/{revision}_{width}.png"
+
+
+def example_path(template_dir: str, template_id: str, revision: int, file_extension: str) -> str:
+    """
+        Returns the path for a pre-rendered example of a certain template revision
+    """
+    return f"{template_dir}/examples/{template_id}/{revision}{file_extension}"
+
+
 def tmp_path(file_name: str) -> str:
     """
         Returns the tmp path where the file (without its extension) can be stored
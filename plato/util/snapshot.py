@@ -0,0 +1,204 @@
+"""
+Template snapshots, to bootstrap a node with a single sequential read instead of downloading every template file.
+
+A snapshot is a gzipped tar archive holding, in order:
+
+    snapshot.json       The format version, the Plato version and the revision of every template when it was taken
+    templates.ndjson    The template rows, as written by export-all
+    files/...           The local template directory, templates, static files and blobs, as loaded by flask refresh.
+                        Static files shared between templates are stored once, as hardlinks
+
+It is read as a stream, so it can be restored straight from an object storage URL or over HTTP, without a local copy.
+Templates created or updated after the snapshot was taken are then fetched one by one from the file storage.
+"""
+import datetime
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Dict, List, NamedTuple
+
+from plato import settings
+from plato.db.models import Template
+from plato.file_storage import PlatoFileStorage
+from plato.util.template_transfer import export_templates, import_templates
+
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_NAME = "snapshot.json"
+TEMPLATES_NAME = "templates.ndjson"
+FILES_DIRECTORY = "files"
+
+
+class InvalidSnapshot(Exception):
+    """
+    Exception to be raised when an archive is not a snapshot that can be restored
+    """
+    message: str
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+class RestoreSummary(NamedTuple):
+    """
+    Outcome of a snapshot restore.
+    """
+    templates: int
+    refreshed_template_ids: List[str]
+
+
+def template_revisions() -> Dict[str, int]:
+    """
+    The current revision of every template, to be recorded in a snapshot before its files are packed.
+
+    Returns:
+        Dict[str, int]: The revisions by template id
+    """
+    return dict(Template.query.with_entities(Template.id, Template.revision).all())
+
+
+def create_snapshot(output: BinaryIO, target_directory: str, revisions: Dict[str, int]) -> int:
+    """
+    Writes a snapshot of the template rows and of the local template directory.
+
+    Args:
+        output: The binary stream to write the archive to
+        target_directory: The local template directory, as loaded by load_templates
+        revisions: The template revisions the files are at least as recent as, see template_revisions
+
+    Returns:
+        int: The number of templates in the snapshot
+    """
+    with tempfile.TemporaryFile() as templates_file:
+        templates_text = io.TextIOWrapper(templates_file, encoding="utf-8", write_through=True)
+        template_count = export_templates(templates_text, None, "")
+        templates_text.detach()
+
+        manifest = {"format_version": SNAPSHOT_FORMAT_VERSION,
+                    "plato_version": settings.PROJECT_VERSION,
+                    "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "revisions": revisions}
+        with tarfile.open(fileobj=output, mode="w|gz") as archive:
+            _add_file(archive, MANIFEST_NAME, io.BytesIO(json.dumps(manifest).encode("utf-8")))
+            _add_file(archive, TEMPLATES_NAME, templates_file)
+            # hardlinks are kept, so each blob is only archived once
+            archive.add(target_directory, arcname=FILES_DIRECTORY)
+    return template_count
+
+
+def restore_snapshot(source: BinaryIO, target_directory: str, file_storage: PlatoFileStorage,
+                     template_directory: str, restore_templates: bool = False) -> RestoreSummary:
+    """
+    Restores the local template directory from a snapshot, replacing it once it is fully unpacked, and then fetches
+    the templates whose revision differs from the one in the snapshot from the file storage.
+
+    Args:
+        source: The binary stream to read the archive from, read sequentially
+        target_directory: The local template directory
+        file_storage: The storage to fetch the templates changed since the snapshot from
+        template_directory: The base directory of the template files in the storage
+        restore_templates: Whether to also upsert the template rows in the database
+
+    Raises:
+        InvalidSnapshot: When the archive is not a snapshot, is of an unsupported version or has unsafe paths
+
+    Returns:
+        RestoreSummary: The number of templates in the snapshot and the templates fetched since
+    """
+    target_path = Path(target_directory)
+    staging_path = target_path.with_name(f".{target_path.name}.restoring")
+    shutil.rmtree(staging_path, ignore_errors=True)
+    staging_path.mkdir(parents=True)
+
+    manifest = None
+    try:
+        with tarfile.open(fileobj=source, mode="r|gz") as archive:
+            for member in archive:
+                if member.name == MANIFEST_NAME:
+                    manifest = _read_manifest(archive.extractfile(member))
+                elif manifest is None:
+                    raise InvalidSnapshot(f"The archive does not start with {MANIFEST_NAME}")
+                elif member.name == TEMPLATES_NAME:
+                    if restore_templates:
+                        lines = (line.decode("utf-8") for line in archive.extractfile(member))
+                        import_templates(lines, file_storage, template_directory)
+                        # the imported rows get new revisions, matching the files of the snapshot
+                        imported_revisions = template_revisions()
+                        manifest["revisions"] = {template_id: imported_revisions.get(template_id)
+                                                 for template_id in manifest["revisions"]}
+                else:
+                    _extract_file(archive, member, staging_path)
+        if manifest is None:
+            raise InvalidSnapshot(f"The archive has no {MANIFEST_NAME}")
+        _replace_directory(staging_path, target_path)
+    except tarfile.TarError as e:
+        raise InvalidSnapshot(f"The archive could not be read, {e}")
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+    snapshot_revisions: Dict[str, int] = manifest["revisions"]
+    refreshed_template_ids = []
+    for template_id, revision in template_revisions().items():
+        if snapshot_revisions.get(template_id) != revision:
+            template_files = file_storage.get_template_files(template_id, template_directory)
+            file_storage.write_files(template_files, target_directory)
+            refreshed_template_ids.append(template_id)
+    return RestoreSummary(templates=len(snapshot_revisions), refreshed_template_ids=refreshed_template_ids)
+
+
+def _add_file(archive: tarfile.TarFile, name: str, file: BinaryIO) -> None:
+    file.seek(0, os.SEEK_END)
+    member = tarfile.TarInfo(name)
+    member.size = file.tell()
+    member.mtime = int(datetime.datetime.now().timestamp())
+    file.seek(0)
+    archive.addfile(member, file)
+
+
+def _read_manifest(manifest_file: BinaryIO) -> dict:
+    try:
+        manifest = json.load(manifest_file)
+    except ValueError as e:
+        raise InvalidSnapshot(f"Invalid {MANIFEST_NAME}, {e}")
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise InvalidSnapshot(f"Unsupported snapshot format version {manifest.get('format_version')}, "
+                              f"expected {SNAPSHOT_FORMAT_VERSION}")
+    return manifest
+
+
+def _extract_file(archive: tarfile.TarFile, member: tarfile.TarInfo, staging_path: Path) -> None:
+    """
+    Extracts a file of the template directory, only allowing regular files, directories and hardlinks within it.
+    """
+    member.name = _template_directory_path(member.name)
+    if member.islnk():
+        member.linkname = _template_directory_path(member.linkname)
+    elif not (member.isfile() or member.isdir()):
+        raise InvalidSnapshot(f"Unsupported member type for {member.name}")
+    if not member.name:
+        return  # the template directory itself
+    member.mode = 0o755 if member.isdir() else 0o644
+    archive.extract(member, path=str(staging_path))
+
+
+def _template_directory_path(name: str) -> str:
+    path = PurePosixPath(name)
+    if path.is_absolute() or ".." in path.parts or path.parts[:1] != (FILES_DIRECTORY,):
+        raise InvalidSnapshot(f"Unsafe path {name}")
+    return str(PurePosixPath(*path.parts[1:])) if len(path.parts) > 1 else ""
+
+
+def _replace_directory(source: Path, target: Path) -> None:
+    """
+    Moves the source directory in place of the target, so the target is never seen partially written.
+    """
+    previous_target = target.with_name(f".{target.name}.previous")
+    shutil.rmtree(previous_target, ignore_errors=True)
+    if target.exists():
+        target.rename(previous_target)
+    source.rename(target)
+    shutil.rmtree(previous_target, ignore_errors=True)
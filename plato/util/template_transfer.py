@@ -0,0 +1,220 @@
+"""
+Bulk export and import of templates as NDJSON, one template per line, to migrate or seed environments.
+
+Every line holds the template in the export standard of Template.json_dict and, optionally, its files under "files",
+by path relative to the template directory, base64 encoded:
+
+    {"title": "certificate", "schema": {...}, ..., "files": {"templates/certificate/certificate": "PGh0bWw+...",
+                                                            "static/certificate/logo.png": "iVBORw0KGgo..."}}
+
+Both directions stream, so only a batch of templates is held in memory at a time.
+"""
+import base64
+import io
+import json
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from plato.db import db
+from plato.db.models import Template, TemplateRevision
+from plato.file_storage import PlatoFileStorage
+from plato.util.path_util import static_path, template_path
+
+BATCH_SIZE = 500
+FILES_KEY = "files"
+TEMPLATE_FIELDS = ("title", "schema", "type", "metadata", "example_composition", "tags")
+
+
+class InvalidTemplateLine(ValueError):
+    """
+    Exception to be raised when a line of an NDJSON import is not a valid template
+    """
+    message: str
+
+    def __init__(self, line_number: int, reason: str):
+        self.message = f"Line {line_number}: {reason}"
+        super().__init__(self.message)
+
+
+class ImportSummary(NamedTuple):
+    """
+    Counts of an NDJSON import.
+    """
+    templates: int
+    files: int
+
+
+def export_templates(output: TextIO, file_storage: Optional[PlatoFileStorage], template_directory: str) -> int:
+    """
+    Writes every template as a line of NDJSON, in id order.
+
+    Args:
+        output: The text stream to write to
+        file_storage: The storage to include the template files from, the files are left out when None
+        template_directory: The base directory of the template files in the storage
+
+    Returns:
+        int: The number of templates exported
+    """
+    exported = 0
+    for template in Template.query.order_by(Template.id).yield_per(BATCH_SIZE):
+        template_json = template.json_dict()
+        if file_storage is not None:
+            template_files = file_storage.get_template_files(template.id, template_directory)
+            template_json[FILES_KEY] = {path: base64.b64encode(content).decode("ascii")
+                                        for path, content in template_files.items()}
+        output.write(json.dumps(template_json))
+        output.write("\n")
+        exported += 1
+    return exported
+
+
+def import_templates(lines: Iterable[str], file_storage: PlatoFileStorage, template_directory: str,
+                     batch_size: int = BATCH_SIZE) -> ImportSummary:
+    """
+    Upserts the templates of the NDJSON lines in batches, all within the current transaction, which is committed once
+    every line was loaded and rolled back otherwise. Existing templates are updated and their revision bumped, each
+    imported revision being recorded in the revision history. The files of each line, if any, are saved to the file
+    storage as the line is read, content-addressed, so the recorded revision can be composed later on.
+
+    Args:
+        lines: The NDJSON lines, blank lines are skipped and, within a batch, only the last line of a template is loaded
+        file_storage: The storage to save the template files to
+        template_directory: The base directory of the template files in the storage
+        batch_size: Number of templates sent to the database at once
+
+    Raises:
+        InvalidTemplateLine: When a line is not a valid template, or has files outside of its template's directories
+
+    Returns:
+        ImportSummary: The number of templates and files imported
+    """
+    templates = 0
+    files = 0
+    try:
+        for lines_batch in _batches(_parse_lines(lines), batch_size):
+            # a template listed more than once in a batch is upserted once, from the last of its lines
+            batch = list({template_json["title"]: (line_number, template_json)
+                          for line_number, template_json in lines_batch}.values())
+            # the files of each revision, when the line holds its template file
+            revision_files: Dict[str, dict] = dict()
+            for line_number, template_json in batch:
+                template_id = template_json["title"]
+                static_directory = f"{static_path(template_directory, template_id)}/"
+                manifest = dict()
+                template_address = None
+                for path, content in _template_files(line_number, template_json, template_directory):
+                    storage_path = f"{template_directory}/{path}"
+                    if storage_path.startswith(static_directory):
+                        manifest[storage_path[len(static_directory):]] = file_storage.save_blob(io.BytesIO(content),
+                                                                                                template_directory)
+                    else:
+                        file_storage.save_file(io.BytesIO(content), storage_path)
+                        template_address = file_storage.save_blob(io.BytesIO(content), template_directory)
+                    files += 1
+                if template_address is not None:
+                    # merged with the static files left out of the line, which the template keeps
+                    revision_files[template_id] = {
+                        "template": template_address,
+                        "static": file_storage.save_static_manifest(template_id, template_directory, manifest)}
+                elif manifest:
+                    file_storage.save_static_manifest(template_id, template_directory, manifest)
+            db.session.execute(_upsert_statement(), [_template_row(template_json) for _, template_json in batch])
+            revisions = dict(db.session.query(Template.id, Template.revision)
+                             .filter(Template.id.in_([template_json["title"] for _, template_json in batch])))
+            db.session.execute(_revision_insert_statement(),
+                               [_revision_row(template_json, revisions[template_json["title"]],
+                                              revision_files.get(template_json["title"]))
+                                for _, template_json in batch])
+            templates += len(batch)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    return ImportSummary(templates=templates, files=files)
+
+
+def _parse_lines(lines: Iterable[str]) -> Iterator[tuple]:
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            template_json = json.loads(line)
+        except ValueError as e:
+            raise InvalidTemplateLine(line_number, f"invalid JSON, {e}")
+        if not isinstance(template_json, dict):
+            raise InvalidTemplateLine(line_number, "not a JSON object")
+        missing_fields = [field for field in TEMPLATE_FIELDS if field not in template_json]
+        if missing_fields:
+            raise InvalidTemplateLine(line_number, f"missing {', '.join(missing_fields)}")
+        yield line_number, template_json
+
+
+def _batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _template_files(line_number: int, template_json: dict, template_directory: str) -> Iterator[tuple]:
+    """
+    Decodes the files of a template line, only allowing paths within the template's own directories.
+    """
+    template_id = template_json["title"]
+    for path, encoded_content in template_json.get(FILES_KEY, {}).items():
+        storage_path = f"{template_directory}/{path}"
+        within_template = storage_path == template_path(template_directory, template_id) or \
+            storage_path.startswith(f"{static_path(template_directory, template_id)}/")
+        if ".." in path.split("/") or not within_template:
+            raise InvalidTemplateLine(line_number, f"file {path} is outside of the template directories")
+        try:
+            content = base64.b64decode(encoded_content, validate=True)
+        except ValueError:
+            raise InvalidTemplateLine(line_number, f"file {path} is not valid base64")
+        yield path, content
+
+
+def _template_row(template_json: dict) -> dict:
+    return {"id": template_json["title"],
+            "schema": template_json["schema"],
+            "type": template_json["type"],
+            "metadata": template_json["metadata"],
+            "example_composition": template_json["example_composition"],
+            "tags": template_json["tags"],
+            "revision": 1}
+
+
+def _revision_row(template_json: dict, revision: int, files: Optional[dict]) -> dict:
+    return {"template_id": template_json["title"],
+            "revision": revision,
+            "schema": template_json["schema"],
+            "type": template_json["type"],
+            "metadata": template_json["metadata"],
+            "example_composition": template_json["example_composition"],
+            "tags": template_json["tags"],
+            "files": files}
+
+
+def _dialect_insert():
+    # both dialects support INSERT ... ON CONFLICT, with the same construct
+    return sqlite.insert if db.engine.dialect.name == "sqlite" else postgresql.insert
+
+
+def _revision_insert_statement():
+    return TemplateRevision.__table__.insert()
+
+
+def _upsert_statement():
+    table = Template.__table__
+    statement = _dialect_insert()(table)
+    updated_columns = {column: statement.excluded[column]
+                       for column in ("schema", "type", "metadata", "example_composition", "tags")}
+    # bumped like on any other update, so the artifacts of the previous revision are not served
+    updated_columns["revision"] = table.c.revision + 1
+    return statement.on_conflict_do_update(index_elements=[table.c.id], set_=updated_columns)
@@ -0,0 +1,85 @@
+"""
+Warm-up of the render state, to be run in the master process before forking the workers.
+
+Everything loaded here is inherited by the workers and shared copy-on-write, so that the first request on a fresh
+worker does not pay for loading the templates, compiling them or initializing weasyprint and fontconfig.
+"""
+import copy
+import gc
+import importlib
+import logging
+
+from flask import Flask
+from jinja2 import TemplateNotFound
+
+from plato.compose import PDF_MIME
+from plato.compose.renderer import compose, schema_validator
+from plato.db import db
+from plato.db.models import Template
+
+logger = logging.getLogger(__name__)
+
+# modules whose import is deferred until first use, see plato.compose
+DEFERRED_MODULES = ["weasyprint", "qrcode", "PIL.Image", "babel.dates", "num2words"]
+
+WARM_UP_HTML = "<!DOCTYPE html><html><body><p>warm-up</p></body></html>"
+
+
+def warm_up(app: Flask, target_directory: str, template_directory: str, load_templates: bool = True) -> None:
+    """
+    Loads the templates and initializes the render pipeline, then freezes every object created so far so that the
+    garbage collector does not touch, and thus copy, the shared memory pages in the forked workers.
+
+    Args:
+        app: The Flask app
+        target_directory: Target directory to store the templates in
+        template_directory: Base directory on the file storage
+        load_templates: Whether to load the templates from the file storage first
+    """
+    for module in DEFERRED_MODULES:
+        importlib.import_module(module)
+
+    with app.app_context():
+        if load_templates:
+            app.config["storage"].load_templates(target_directory, template_directory)
+
+        jinja_env = app.config["JINJAENV"]
+        templates = Template.query.all()
+        for template in templates:
+            try:
+                jinja_env.get_template(name=f"{template.id}/{template.id}")
+            except TemplateNotFound:
+                logger.warning("Template file for '%s' not found while warming up", template.id)
+            schema_validator(template.schema)
+
+        _throwaway_render(templates)
+
+        # connections must not be shared between the forked workers
+        db.session.remove()
+        db.engine.dispose()
+
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    logger.info("Warmed up %d templates", len(templates))
+
+
+def _throwaway_render(templates) -> None:
+    """
+    Renders a document to initialize weasyprint, fontconfig and the font caches. Uses the first template whose example
+    composes successfully, falling back to plain HTML.
+
+    Args:
+        templates: The templates available
+    """
+    for template in templates:
+        try:
+            # the example is copied as rendering the QR codes alters it
+            compose(template, copy.deepcopy(template.example_composition), PDF_MIME)
+            return
+        except Exception:
+            logger.warning("Unable to compose the example of '%s' while warming up", template.id, exc_info=True)
+
+    from weasyprint import HTML
+
+    HTML(string=WARM_UP_HTML).write_pdf()
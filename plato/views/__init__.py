@@ -1,5 +1,75 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional
+
 from flasgger import Swagger
 
+
+class CachedSwagger(Swagger):
+    """
+    Swagger which stores the generated specs on disk, so that the endpoint docstrings are only parsed once per version
+    of the API instead of once per worker process.
+
+    The cache directory is taken from the 'SWAGGER_SPEC_CACHE_DIR' app config entry, if it is not set the specs are
+    only cached in memory. The Swagger config itself is loaded when the docs are first served if the app has a
+    'SWAGGER_CONFIG_LOADER' instead of a 'SWAGGER' config entry, e.g. to not parse pyproject.toml on startup.
+    """
+
+    def init_app(self, app, decorators=None):
+        super().init_app(app, decorators)
+        # every docs view is served by the flasgger blueprint
+        app.before_request_funcs.setdefault(self.config.get("endpoint", "flasgger"), []).append(self._load_config)
+
+    def _load_config(self) -> None:
+        config_loader = self.app.config.get("SWAGGER_CONFIG_LOADER")
+        if config_loader is None:
+            return
+        swagger_config = config_loader()
+        self.config.update(swagger_config)
+        self.app.config["SWAGGER"] = swagger_config
+        self.app.config["SWAGGER_CONFIG_LOADER"] = None
+
+    def get_apispecs(self, endpoint='apispec_1'):
+        if self.app.debug or endpoint in self.apispecs:
+            return super().get_apispecs(endpoint)
+
+        cache_file = self._spec_cache_file(endpoint)
+        if cache_file is not None and cache_file.is_file():
+            self.apispecs[endpoint] = json.loads(cache_file.read_text())
+            return self.apispecs[endpoint]
+
+        apispec = super().get_apispecs(endpoint)
+        if cache_file is not None:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_cache_file = cache_file.with_suffix(".tmp")
+            tmp_cache_file.write_text(json.dumps(apispec))
+            tmp_cache_file.replace(cache_file)
+        return apispec
+
+    def _spec_cache_file(self, endpoint: str) -> Optional[Path]:
+        """
+        The cache file for the spec, named after a digest of every docstring the spec is generated from, so that any
+        change to the documentation invalidates it.
+
+        Args:
+            endpoint: The spec endpoint
+
+        Returns:
+            Optional[Path]: The cache file path, None if caching on disk is disabled
+        """
+        cache_directory = self.app.config.get("SWAGGER_SPEC_CACHE_DIR")
+        if not cache_directory:
+            return None
+        digest = hashlib.sha1(json.dumps(self.app.config.get("SWAGGER"), sort_keys=True, default=str).encode("utf-8"))
+        for rule in sorted(self.app.url_map.iter_rules(), key=str):
+            view_function = self.app.view_functions.get(rule.endpoint)
+            digest.update(f"{rule}{sorted(rule.methods)}{getattr(view_function, '__doc__', None)}".encode("utf-8"))
+        for definition in self.definition_models:
+            digest.update(f"{definition.name}{definition.obj.__doc__}".encode("utf-8"))
+        return Path(cache_directory) / f"{endpoint}_{digest.hexdigest()}.json"
+
+
 # view package might be weird for the swagger object but it is mostly used here and it needs to be in its own file
 # to be moved if needed
-swag = Swagger()
+swag = CachedSwagger()
@@ -30,6 +30,9 @@ class TemplateDetailView(NamedTuple):
         example_composition:
             type: object
             description: a dictionary containing example compose data for the template
+        revision:
+            type: integer
+            description: the template revision, to pin requests to with the revision query parameter
     """
     template_id: str
     template_schema: dict
@@ -37,6 +40,7 @@ class TemplateDetailView(NamedTuple):
     metadata: dict
     tags: Sequence[str]
     example_composition: dict
+    revision: int
 
     @classmethod
     def view_from_template(cls, template: 'Template') -> 'TemplateDetailView':
@@ -54,7 +58,8 @@ class TemplateDetailView(NamedTuple):
                                   type=template.type,
                                   metadata=template.metadata_,
                                   tags=template.tags,
-                                  example_composition=template.example_composition)
+                                  example_composition=template.example_composition,
+                                  revision=template.revision)
 
 
 TEMPLATE_UPDATE_SCHEMA = {
@@ -87,3 +92,35 @@ TEMPLATE_UPDATE_SCHEMA = {
         "tags"
     ]
 }
+
+
+MERGED_COMPOSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "entries": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "template_id": {
+                        "type": "string"
+                    },
+                    "compose_data": {
+                        "type": "object"
+                    },
+                    "title": {
+                        "type": "string"
+                    }
+                },
+                "required": [
+                    "template_id",
+                    "compose_data"
+                ]
+            }
+        }
+    },
+    "required": [
+        "entries"
+    ]
+}
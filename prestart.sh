@@ -1,5 +1,27 @@
 echo "updating database model..."
-sleep 5; # wait for db to be up
-flask db upgrade
-echo "downloading templates..."
-flask refresh
\ No newline at end of file
+if [ "${DATABASE_URL#sqlite}" != "$DATABASE_URL" ]; then
+  flask create-db
+else
+  sleep 5; # wait for db to be up
+  flask db upgrade
+fi
+if [ -n "$TEMPLATE_SNAPSHOT" ]; then
+  echo "restoring templates from $TEMPLATE_SNAPSHOT..."
+  flask snapshot-restore "$TEMPLATE_SNAPSHOT" || flask refresh
+else
+  echo "downloading templates..."
+  flask refresh
+fi
+if [ "${DATABASE_URL#sqlite}" = "$DATABASE_URL" ]; then
+  echo "listening to template changes..."
+  # restarted whenever it stops, catching up on the changes missed meanwhile
+  (
+    options=""
+    while true; do
+      flask listen-templates $options
+      echo "template listener stopped with status $?, restarting in 5s..."
+      options="--catch-up"
+      sleep 5
+    done
+  ) &
+fi
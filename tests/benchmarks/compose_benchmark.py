@@ -0,0 +1,271 @@
+"""
+Compose benchmark suite.
+
+Exercises `compose()` for every available MIME type across a matrix of page counts, image counts, QR entry counts and
+payload sizes, using a `DiskFileStorage` and a `DictLoader` Jinja environment like the test fixtures, so neither S3
+nor a database is needed.
+
+    Typical usage:
+
+        # record a new baseline
+        python -m tests.benchmarks.compose_benchmark run --output tests/benchmarks/baseline.json
+
+        # compare the current tree against the stored baseline
+        python -m tests.benchmarks.compose_benchmark compare --baseline tests/benchmarks/baseline.json
+
+"""
+import copy
+import itertools
+import json
+import platform
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import click
+from jinja2 import DictLoader, Environment as JinjaEnv, select_autoescape
+
+from plato.compose import ALL_AVAILABLE_MIME_TYPES
+from plato.compose.renderer import compose
+from plato.db.models import Template
+from plato.file_storage import DiskFileStorage
+from plato.flask_app import create_app
+from plato.util.bench_util import summarize_latencies
+
+BASELINE_FORMAT_VERSION = 1
+RESOURCES_PATH = Path(__file__).resolve().parent.parent / "resources"
+STATIC_IMAGE = "png_image/balloons.png"
+
+PAGE_COUNTS = (1, 10)
+IMAGE_COUNTS = (0, 5)
+QR_ENTRY_COUNTS = (0, 5)
+PAYLOAD_SIZES = {"small": 1_000, "large": 200_000}
+
+DEFAULT_ITERATIONS = 10
+DEFAULT_WARMUP = 2
+DEFAULT_THRESHOLD = 0.15
+
+# metrics that get worse when they go up, and the ones that get worse when they go down
+HIGHER_IS_WORSE = ("p50", "p95", "p99", "peak_memory_bytes")
+LOWER_IS_WORSE = ("throughput",)
+
+
+class BenchmarkCase(NamedTuple):
+    mime_type: str
+    pages: int
+    images: int
+    qr_entries: int
+    payload: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.mime_type}|pages={self.pages}|images={self.images}|qr={self.qr_entries}|payload={self.payload}"
+
+    @property
+    def template_id(self) -> str:
+        return f"bench_p{self.pages}_i{self.images}_q{self.qr_entries}"
+
+
+def benchmark_cases(mime_types: List[str]) -> Iterator[BenchmarkCase]:
+    for mime_type, pages, images, qr_entries, payload in itertools.product(mime_types, PAGE_COUNTS, IMAGE_COUNTS,
+                                                                          QR_ENTRY_COUNTS, PAYLOAD_SIZES):
+        yield BenchmarkCase(mime_type, pages, images, qr_entries, payload)
+
+
+def _template_markup(case: BenchmarkCase) -> str:
+    images = "".join(f'<img src="file://{{{{ base_static }}}}{STATIC_IMAGE}" width="50">' for _ in range(case.images))
+    qr_codes = "".join(f'<img src="file://{{{{ p.qr_{i} }}}}" width="50">' for i in range(case.qr_entries))
+    return '<!DOCTYPE html>' \
+           '<html>' \
+           '<body>' \
+           '{% for page in range(p.pages) %}' \
+           '<div style="page-break-after: always">' \
+           '<h1>{{ p.title }} {{ page }}</h1>' \
+           f'{images}' \
+           '<p>{{ p.text }}</p>' \
+           '</div>' \
+           '{% endfor %}' \
+           f'{qr_codes}' \
+           '</body>' \
+           '</html>'
+
+
+def _template_model(case: BenchmarkCase) -> Template:
+    qr_entries = [f"qr_{i}" for i in range(case.qr_entries)]
+    return Template(id_=case.template_id,
+                    schema={"type": "object",
+                            "required": ["title", "text", "pages"],
+                            "properties": {"title": {"type": "string"},
+                                           "text": {"type": "string"},
+                                           "pages": {"type": "integer"}}},
+                    type_="text/html",
+                    metadata={"qr_entries": qr_entries},
+                    example_composition={},
+                    tags=[])
+
+
+def _compose_data(case: BenchmarkCase) -> dict:
+    words = itertools.cycle(("lorem", "ipsum", "dolor", "sit", "amet"))
+    text = ""
+    while len(text) < PAYLOAD_SIZES[case.payload]:
+        text += f"{next(words)} "
+    data = {"title": "Benchmark", "text": text, "pages": case.pages}
+    data.update({f"qr_{i}": f"https://plato.vizidox.com/{i}" for i in range(case.qr_entries)})
+    return data
+
+
+def _run_case(case: BenchmarkCase, iterations: int, warmup: int) -> dict:
+    template = _template_model(case)
+    compose_data = _compose_data(case)
+
+    def compose_once():
+        # qr rendering replaces the qr entries in place, so every iteration gets its own payload
+        return compose(template, copy.deepcopy(compose_data), case.mime_type)
+
+    for _ in range(warmup):
+        compose_once()
+
+    latencies = []
+    output_size = 0
+    run_start = perf_counter()
+    for _ in range(iterations):
+        start = perf_counter()
+        output_size = len(compose_once().getvalue())
+        latencies.append(perf_counter() - start)
+    summary = summarize_latencies(latencies, perf_counter() - run_start)
+
+    # measured on a separate pass, tracemalloc slows allocations down and would skew the latencies
+    tracemalloc.start()
+    compose_once()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"iterations": iterations,
+            "throughput": summary.throughput,
+            "mean": summary.mean,
+            "p50": summary.p50,
+            "p95": summary.p95,
+            "p99": summary.p99,
+            "max": summary.max,
+            "peak_memory_bytes": peak_memory,
+            "output_bytes": output_size}
+
+
+def run_benchmarks(iterations: int = DEFAULT_ITERATIONS,
+                   warmup: int = DEFAULT_WARMUP,
+                   mime_types: Optional[List[str]] = None) -> dict:
+    """
+    Runs every benchmark case and returns the results in the baseline format.
+
+    Args:
+        iterations: Number of measured compositions per case
+        warmup: Number of unmeasured compositions per case, run before the measured ones
+        mime_types: The MIME types to benchmark, all available ones by default
+
+    Returns:
+        dict: The benchmark results, keyed by case name
+    """
+    import weasyprint
+
+    mime_types = mime_types or ALL_AVAILABLE_MIME_TYPES
+    cases = list(benchmark_cases(mime_types))
+    template_loader = DictLoader({f"{case.template_id}/{case.template_id}": _template_markup(case) for case in cases})
+    template_environment = JinjaEnv(loader=template_loader, autoescape=select_autoescape(["html", "xml"]))
+
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as file_dir:
+        app = create_app(db_url="sqlite://",
+                         jinja_env=template_environment,
+                         template_static_directory=str(RESOURCES_PATH / "static"),
+                         swagger_ui_config={},
+                         storage=DiskFileStorage(file_dir))
+        with app.app_context():
+            for case in cases:
+                click.echo(f"running {case.name}", err=True)
+                results[case.name] = _run_case(case, iterations, warmup)
+
+    return {"format_version": BASELINE_FORMAT_VERSION,
+            "environment": {"python": platform.python_version(),
+                            "platform": platform.platform(),
+                            "weasyprint": weasyprint.__version__},
+            "results": results}
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """
+    Compares benchmark results against a baseline.
+
+    Args:
+        baseline: The stored baseline results
+        current: The freshly measured results
+        threshold: Allowed relative regression, e.g. 0.15 allows metrics to be 15% worse than the baseline
+
+    Returns:
+        List[str]: A description of every regression found, empty if there are none
+    """
+    regressions = []
+    for case_name, baseline_metrics in baseline["results"].items():
+        current_metrics = current["results"].get(case_name)
+        if current_metrics is None:
+            continue
+        for metric in HIGHER_IS_WORSE:
+            if current_metrics[metric] > baseline_metrics[metric] * (1 + threshold):
+                regressions.append(f"{case_name}: {metric} went from {baseline_metrics[metric]:.4g} "
+                                   f"to {current_metrics[metric]:.4g}")
+        for metric in LOWER_IS_WORSE:
+            if current_metrics[metric] < baseline_metrics[metric] * (1 - threshold):
+                regressions.append(f"{case_name}: {metric} went from {baseline_metrics[metric]:.4g} "
+                                   f"to {current_metrics[metric]:.4g}")
+    return regressions
+
+
+@click.group()
+def cli():
+    """
+    Compose benchmark suite.
+    """
+    ...
+
+
+@cli.command("run")
+@click.option("--output", type=click.File("w"), default="-", help="Where to write the JSON results")
+@click.option("--iterations", default=DEFAULT_ITERATIONS, type=click.IntRange(min=1))
+@click.option("--warmup", default=DEFAULT_WARMUP, type=click.IntRange(min=0))
+@click.option("--mime-type", "mime_types", multiple=True, type=click.Choice(ALL_AVAILABLE_MIME_TYPES))
+def run(output, iterations: int, warmup: int, mime_types: List[str]):
+    """
+    Runs the benchmark suite and stores the results, to be used as a baseline.
+    """
+    results = run_benchmarks(iterations, warmup, list(mime_types))
+    json.dump(results, output, indent=2, sort_keys=True)
+
+
+@cli.command("compare")
+@click.option("--baseline", type=click.File("r"), required=True, help="The stored JSON baseline")
+@click.option("--output", type=click.File("w"), default=None, help="Where to write the current JSON results")
+@click.option("--threshold", default=DEFAULT_THRESHOLD, type=click.FloatRange(min=0))
+@click.option("--iterations", default=DEFAULT_ITERATIONS, type=click.IntRange(min=1))
+@click.option("--warmup", default=DEFAULT_WARMUP, type=click.IntRange(min=0))
+def compare(baseline, output, threshold: float, iterations: int, warmup: int):
+    """
+    Runs the benchmark suite and fails if any metric regressed past the threshold.
+    """
+    baseline_results = json.load(baseline)
+    mime_types = sorted({metrics_name.split("|")[0] for metrics_name in baseline_results["results"]})
+    current_results = run_benchmarks(iterations, warmup, mime_types)
+    if output is not None:
+        json.dump(current_results, output, indent=2, sort_keys=True)
+
+    regressions = compare_results(baseline_results, current_results, threshold)
+    for regression in regressions:
+        click.echo(regression, err=True)
+    if regressions:
+        sys.exit(1)
+    click.echo(f"No regressions over {threshold:.0%} across {len(current_results['results'])} cases", err=True)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,4 +1,5 @@
 import tempfile
+from os import getenv
 from contextlib import nullcontext
 from pathlib import Path
 from time import sleep
@@ -11,15 +12,26 @@ from testcontainers.compose import DockerCompose
 from testcontainers.core.utils import inside_container
 
 from plato.db import db
+from plato.db.models import Template, TemplateRevision
 from plato.file_storage import S3FileStorage, PlatoFileStorage, DiskFileStorage
 from plato.flask_app import create_app
 from tests.test_s3_application_set_up import BUCKET_NAME
 
-TEST_DB_URL = f"postgresql://test:test@{'database:5432' if inside_container() else 'localhost:5456'}/test"
+# e.g. TEST_DATABASE_URL=sqlite:////tmp/plato_test.db to run the tests without Docker
+TEST_DB_URL = getenv("TEST_DATABASE_URL",
+                     f"postgresql://test:test@{'database:5432' if inside_container() else 'localhost:5456'}/test")
 
 FuncType = Callable[..., Any]
 F = TypeVar('F', bound=FuncType)
 
+TEMPLATE_ID = "template_test_1"
+
+PLAIN_TEXT_TEMPLATE_ID = "plain_text"
+PNG_IMAGE_TEMPLATE_ID = "png_image"
+QR_CODE_TEMPLATE_ID = 'qr_code'
+NO_IMAGE_TEMPLATE_ID = PNG_IMAGE_TEMPLATE_ID.replace('p', 'u')
+PNG_IMAGE_NAME = "balloons.png"
+
 
 @pytest.fixture(scope='session')
 def template_loader() -> DictLoader:
@@ -42,7 +54,7 @@ def flask_client(template_loader, file_storage: PlatoFileStorage):
 
     current_folder = str(Path(__file__).resolve().parent)
 
-    if inside_container():
+    if inside_container() or not TEST_DB_URL.startswith("postgresql"):
         context_manager = nullcontext()
     else:
         docker_compose_path = f"{current_folder}/docker/"
@@ -50,7 +62,8 @@ def flask_client(template_loader, file_storage: PlatoFileStorage):
 
     with context_manager:
 
-        sleep(5)
+        if TEST_DB_URL.startswith("postgresql"):
+            sleep(5)
 
         template_environment = JinjaEnv(
             loader=template_loader,
@@ -67,10 +80,147 @@ def flask_client(template_loader, file_storage: PlatoFileStorage):
 
         with plato_app.test_client() as client:
             with plato_app.app_context():
-                db.create_all()
+                db.create_all(bind_key=None)
             yield client
+            # every test class starts from an empty database, as with a new database container
+            with plato_app.app_context():
+                db.session.remove()
+                db.drop_all(bind_key=None)
 
 
 @pytest.fixture(scope='session')
 def jinjaenv(client_local_storage):
     yield client_local_storage.application.config["JINJAENV"]
+
+
+@pytest.fixture
+def disk_storage():
+    with tempfile.TemporaryDirectory() as file_dir:
+        yield DiskFileStorage(file_dir)
+
+
+@pytest.fixture(scope="function")
+def populate_db_s3(client_s3_storage):
+    yield from _fleeting_database(client_s3_storage)
+
+
+@pytest.fixture(scope="function")
+def populate_db(client_local_storage):
+    yield from _fleeting_database(client_local_storage)
+
+
+def _fleeting_database(client):
+    with client.application.test_request_context():
+        t = Template(id_=TEMPLATE_ID,
+                     schema={
+                         "type": "object",
+                         "required": [
+                             "cert_name",
+                             "serial_number"
+                         ],
+                         "properties": {
+                             "qr_code": {
+                                 "type": "string"
+                             },
+                             "cert_name": {
+                                 "type": "string"
+                             },
+                             "serial_number": {
+                                 "type": "string"
+                             }
+                         }
+                     },
+                     type_="text/html", metadata={}, example_composition={}, tags=[])
+        db.session.add(t)
+        db.session.commit()
+    yield
+    with client.application.test_request_context():
+        TemplateRevision.query.delete()
+        Template.query.delete()
+        db.session.commit()
+
+
+@pytest.fixture(scope='class')
+def client_with_jinjaenv():
+        template_loader = DictLoader({})
+        plain_text_jinja_id = f"{PLAIN_TEXT_TEMPLATE_ID}/{PLAIN_TEXT_TEMPLATE_ID}"
+        template_loader.mapping[plain_text_jinja_id] = "{{ p.plain }}"
+
+        png_template_jinja_id = f"{PNG_IMAGE_TEMPLATE_ID}/{PNG_IMAGE_TEMPLATE_ID}"
+        template_loader.mapping[png_template_jinja_id] = \
+            '<!DOCTYPE html>' \
+            '<html>' \
+            '<body>' \
+            '<img id="img_" src="file://{{ template_static }}' \
+            f'{PNG_IMAGE_NAME}">' \
+            '</img>' \
+            '</body>' \
+            '</html>'
+
+        no_image_template_jinja_id = f"{NO_IMAGE_TEMPLATE_ID}/{NO_IMAGE_TEMPLATE_ID}"
+        template_loader.mapping[no_image_template_jinja_id] = \
+            '<!DOCTYPE html>' \
+            '<html>' \
+            '<body>' \
+            '<img id="img_" src="file://{{ template_static }}' \
+            'no_img.png">' \
+            '</img>' \
+            '</body>' \
+            '</html>'
+
+        qr_code_template_jinja_id = f"{QR_CODE_TEMPLATE_ID}/{QR_CODE_TEMPLATE_ID}"
+        template_loader.mapping[qr_code_template_jinja_id] = \
+            '<!DOCTYPE html>' \
+            '<html>' \
+            '<body>' \
+            '<img src="file://{{ p.qr_code }}" alt="qr_fail">' \
+            '</body>' \
+            '</html>'
+
+        with tempfile.TemporaryDirectory() as file_dir:
+            yield from flask_client(template_loader, file_storage=DiskFileStorage(file_dir))
+            del template_loader.mapping[plain_text_jinja_id]
+            del template_loader.mapping[png_template_jinja_id]
+            del template_loader.mapping[no_image_template_jinja_id]
+            del template_loader.mapping[qr_code_template_jinja_id]
+
+
+@pytest.fixture(scope="class")
+def template_test_examples(client_with_jinjaenv):
+    with client_with_jinjaenv.application.app_context():
+        plain_text_template_model = Template(id_=PLAIN_TEXT_TEMPLATE_ID,
+                                             schema={"type": "object",
+                                                     "properties": {"plain": {"type": "string"}}
+                                                     },
+                                             type_="text/html", metadata={},
+                                             example_composition={"plain": "plain_example"}, tags=[])
+        db.session.add(plain_text_template_model)
+
+        png_image_template_model = Template(id_=PNG_IMAGE_TEMPLATE_ID,
+                                            schema={"type": "object",
+                                                    "properties": {}
+                                                    },
+                                            type_="text/html", metadata={}, example_composition={}, tags=[])
+        db.session.add(png_image_template_model)
+
+        no_image_template_model = Template(id_=NO_IMAGE_TEMPLATE_ID,
+                                           schema={"type": "object",
+                                                   "properties": {}
+                                                   },
+                                           type_="text/html", metadata={}, example_composition={}, tags=[])
+        db.session.add(no_image_template_model)
+
+        qr_code_template_model = Template(id_=QR_CODE_TEMPLATE_ID,
+                                          schema={"type": "object",
+                                                  "properties": {}
+                                                  },
+                                          type_="text/html", metadata={"qr_entries": ["qr_code"]},
+                                          example_composition={}, tags=[])
+        db.session.add(qr_code_template_model)
+        db.session.commit()
+
+        yield
+
+        with client_with_jinjaenv.application.test_request_context():
+            Template.query.delete()
+            db.session.commit()
@@ -0,0 +1,138 @@
+import asyncio
+import json
+from http import HTTPStatus
+from typing import Callable, List, Tuple
+
+import pytest
+
+from plato.asgi import PlatoASGI
+from plato.api import REVISION_CACHE_CONTROL
+from plato.error_messages import template_not_found, invalid_compose_json, template_revision_not_found, \
+    render_worker_lost
+from tests.conftest import PLAIN_TEXT_TEMPLATE_ID
+
+
+def asgi_request(asgi_app: PlatoASGI, method: str, path: str, headers: List[Tuple[str, str]],
+                 body: bytes = b"", query_string: str = "") -> Tuple[int, dict, bytes]:
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string.encode(),
+             "headers": [(name.encode(), value.encode()) for name, value in headers], "http_version": "1.1",
+             "scheme": "http", "server": ("testserver", 80), "client": ("testclient", 50000), "root_path": ""}
+    asyncio.run(asgi_app(scope, receive, send))
+
+    response_headers = {name.decode(): value.decode() for name, value in sent[0]["headers"]}
+    return sent[0]["status"], response_headers, b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def asgi_lifespan(asgi_app: PlatoASGI, on_startup: Callable[[], None]) -> None:
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        if message["type"] == "lifespan.startup.complete":
+            on_startup()
+
+    asyncio.run(asgi_app({"type": "lifespan"}, receive, send))
+
+
+@pytest.fixture(scope="class")
+def asgi_app(client_with_jinjaenv):
+    asgi_app = PlatoASGI(client_with_jinjaenv.application, render_workers=1, io_workers=2)
+    yield asgi_app
+    asgi_app.render_executor.shutdown()
+    asgi_app.io_executor.shutdown()
+
+
+@pytest.mark.usefixtures("template_test_examples")
+class TestASGI:
+
+    def test_compose_html(self, asgi_app):
+        status, headers, body = asgi_request(asgi_app, "POST", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/compose",
+                                             [("Content-Type", "application/json"), ("Accept", "text/html")],
+                                             body=json.dumps({"plain": "some text"}).encode())
+        assert status == HTTPStatus.OK
+        assert headers["content-type"] == "text/html"
+        assert headers["content-disposition"] == "attachment; filename=compose.html"
+        assert body == b"some text"
+
+    def test_example_html(self, asgi_app):
+        status, headers, body = asgi_request(asgi_app, "GET", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/example",
+                                             [("Accept", "text/html")])
+        assert status == HTTPStatus.OK
+        assert body == b"plain_example"
+
+    def test_example_pinned_to_revision(self, asgi_app):
+        status, headers, body = asgi_request(asgi_app, "GET", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/example",
+                                             [("Accept", "text/html")], query_string="revision=1")
+        assert status == HTTPStatus.OK
+        assert headers["cache-control"] == REVISION_CACHE_CONTROL
+        assert body == b"plain_example"
+
+        status, headers, body = asgi_request(asgi_app, "GET", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/example",
+                                             [("Accept", "text/html")], query_string="revision=2")
+        assert status == HTTPStatus.NOT_FOUND
+        assert json.loads(body)["message"] == template_revision_not_found.format(PLAIN_TEXT_TEMPLATE_ID, 2)
+
+    def test_compose_pdf(self, asgi_app):
+        status, headers, body = asgi_request(asgi_app, "POST", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/compose",
+                                             [("Content-Type", "application/json")],
+                                             body=json.dumps({"plain": "some text"}).encode())
+        assert status == HTTPStatus.OK
+        assert headers["content-type"] == "application/pdf"
+        assert body.startswith(b"%PDF")
+
+    def test_compose_template_not_found(self, asgi_app):
+        status, _, body = asgi_request(asgi_app, "POST", "/template/not_a_template/compose",
+                                       [("Content-Type", "application/json")], body=b"{}")
+        assert status == HTTPStatus.NOT_FOUND
+        assert json.loads(body)["message"] == template_not_found.format("not_a_template")
+
+    def test_compose_invalid_json(self, asgi_app):
+        status, _, body = asgi_request(asgi_app, "POST", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/compose",
+                                       [("Content-Type", "application/json")], body=b"{")
+        assert status == HTTPStatus.BAD_REQUEST
+        assert json.loads(body)["message"].startswith(invalid_compose_json.format(""))
+
+    def test_compose_invalid_compose_data(self, asgi_app):
+        status, _, _ = asgi_request(asgi_app, "POST", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/compose",
+                                    [("Content-Type", "application/json")], body=json.dumps({"plain": 1}).encode())
+        assert status == HTTPStatus.BAD_REQUEST
+
+    def test_other_endpoints_served_by_flask(self, asgi_app):
+        status, headers, body = asgi_request(asgi_app, "GET", f"/templates/{PLAIN_TEXT_TEMPLATE_ID}", [])
+        assert status == HTTPStatus.OK
+        assert json.loads(body)["template_id"] == PLAIN_TEXT_TEMPLATE_ID
+
+    def test_render_workers_replaced_once_one_died(self, asgi_app):
+        compose_request = ("POST", f"/template/{PLAIN_TEXT_TEMPLATE_ID}/compose",
+                           [("Content-Type", "application/json"), ("Accept", "text/html")],
+                           json.dumps({"plain": "some text"}).encode())
+        assert asgi_request(asgi_app, *compose_request)[0] == HTTPStatus.OK
+        # e.g. killed when out of memory, which breaks the pool
+        for process in list(asgi_app.render_executor._processes.values()):
+            process.kill()
+            process.join()
+
+        status, _, body = asgi_request(asgi_app, *compose_request)
+        assert status == HTTPStatus.SERVICE_UNAVAILABLE
+        assert json.loads(body)["message"] == render_worker_lost.format(PLAIN_TEXT_TEMPLATE_ID)
+        status, _, body = asgi_request(asgi_app, *compose_request)
+        assert status == HTTPStatus.OK
+        assert body == b"some text"
+
+    def test_every_render_worker_started_on_startup(self, client_with_jinjaenv):
+        asgi_app = PlatoASGI(client_with_jinjaenv.application, render_workers=3, io_workers=2)
+        started_workers = []
+        asgi_lifespan(asgi_app, lambda: started_workers.append(len(asgi_app.render_executor._processes)))
+        asgi_app.io_executor.shutdown()
+        assert started_workers == [3]
@@ -0,0 +1,85 @@
+import json
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from plato.db import db
+from plato.db.models import Template
+from plato.util.bulk_compose import CHECKPOINT_NAME, BulkComposeJob, Checkpoint, InvalidCheckpoint, compose_bulk, \
+    write_checkpoint
+from tests.conftest import PLAIN_TEXT_TEMPLATE_ID
+
+LINES = [json.dumps({"plain": "first"}), "", json.dumps({"plain": 2}), json.dumps({"plain": "fourth"})]
+
+
+@pytest.fixture
+def bulk_job(client_with_jinjaenv):
+    app = client_with_jinjaenv.application
+    with app.app_context():
+        template = Template.query.filter_by(id=PLAIN_TEXT_TEMPLATE_ID).one()
+        db.session.expunge(template)
+    with tempfile.TemporaryDirectory() as output:
+        yield BulkComposeJob(app=app, template=template, mime_type="text/html", output=output,
+                             file_name="{line}-{p[plain]}{extension}")
+
+
+@pytest.mark.usefixtures("template_test_examples")
+class TestBulkCompose:
+
+    def test_lines_composed(self, bulk_job):
+        failures = []
+        progress = compose_bulk(bulk_job, LINES, "payloads.ndjson", workers=2,
+                                on_failure=lambda line, message: failures.append(line))
+        assert (progress.composed, progress.failed) == (2, 1)
+        assert failures == [3]
+        assert Path(f"{bulk_job.output}/1-first.html").read_text() == "first"
+        assert Path(f"{bulk_job.output}/4-fourth.html").read_text() == "fourth"
+        checkpoint = json.loads(Path(f"{bulk_job.output}/{CHECKPOINT_NAME}").read_text())
+        assert (checkpoint["line"], checkpoint["failed_lines"]) == (4, [3])
+
+    def test_resumed_from_checkpoint(self, bulk_job):
+        write_checkpoint(bulk_job, "payloads.ndjson", Checkpoint(line=3))
+        progress = compose_bulk(bulk_job, LINES, "payloads.ndjson", workers=1)
+        assert (progress.composed, progress.failed, progress.resumed_from) == (1, 0, 3)
+        assert not Path(f"{bulk_job.output}/1-first.html").exists()
+        assert Path(f"{bulk_job.output}/4-fourth.html").exists()
+
+        with pytest.raises(InvalidCheckpoint):
+            compose_bulk(bulk_job, LINES, "other.ndjson", workers=1)
+        assert compose_bulk(bulk_job, LINES, "other.ndjson", workers=1, resume=False).composed == 2
+
+    def test_failed_lines_composed_again_when_resumed(self, bulk_job):
+        progress = compose_bulk(bulk_job, LINES, "payloads.ndjson", workers=2)
+        assert (progress.composed, progress.failed) == (2, 1)
+
+        fixed_lines = LINES[:2] + [json.dumps({"plain": "third"})] + LINES[3:]
+        progress = compose_bulk(bulk_job, fixed_lines + [json.dumps({"plain": 5})], "payloads.ndjson", workers=2)
+        assert (progress.composed, progress.failed, progress.resumed_from, progress.retried) == (1, 1, 4, 1)
+        assert Path(f"{bulk_job.output}/3-third.html").read_text() == "third"
+        checkpoint = json.loads(Path(f"{bulk_job.output}/{CHECKPOINT_NAME}").read_text())
+        assert (checkpoint["line"], checkpoint["failed_lines"]) == (5, [5])
+
+    def test_render_error_fails_the_line_only(self, bulk_job):
+        loader = bulk_job.app.config["JINJAENV"].loader
+        jinja_id = f"{PLAIN_TEXT_TEMPLATE_ID}/{PLAIN_TEXT_TEMPLATE_ID}"
+        source = loader.mapping[jinja_id]
+        # valid compose data which the template fails to render
+        loader.mapping[jinja_id] = "{% if p.plain == 'first' %}{{ p.plain.missing.attribute }}{% endif %}" + source
+        try:
+            failures = []
+            progress = compose_bulk(bulk_job, LINES, "payloads.ndjson", workers=2,
+                                    on_failure=lambda line, message: failures.append((line, message)))
+        finally:
+            loader.mapping[jinja_id] = source
+        assert (progress.composed, progress.failed) == (1, 2)
+        assert [line for line, _ in failures] == [1, 3]
+        assert "missing" in failures[0][1]
+        assert Path(f"{bulk_job.output}/4-fourth.html").read_text() == "fourth"
+        checkpoint = json.loads(Path(f"{bulk_job.output}/{CHECKPOINT_NAME}").read_text())
+        assert (checkpoint["line"], checkpoint["failed_lines"]) == (4, [1, 3])
+
+    def test_file_name_outside_of_output_fails(self, bulk_job):
+        job = bulk_job._replace(file_name="../{line}{extension}")
+        progress = compose_bulk(job, LINES[:1], "payloads.ndjson", workers=1)
+        assert (progress.composed, progress.failed) == (0, 1)
@@ -1,112 +1,43 @@
 import io
+import json
 import tempfile
+from contextlib import contextmanager
 from http import HTTPStatus
 from itertools import chain
 from PIL import Image
 from math import isclose
 import pytest
 from fitz import Document
-from jinja2 import DictLoader
 
 from plato.compose import ALL_AVAILABLE_MIME_TYPES
 from plato.db import db
 from plato.db.models import Template
-from plato.error_messages import aspect_ratio_compromised, resizing_unsupported, unsupported_mime_type
-from plato.file_storage import DiskFileStorage
+from plato.error_messages import aspect_ratio_compromised, resizing_unsupported, unsupported_mime_type, \
+    encoding_options_unsupported, missing_compose_data_part, invalid_template_revision, template_revision_not_found
+from plato.compose.artifacts import prerender_examples, get_prerendered_example
+from plato.compose.render_cache import RenderCache
+from plato.compose.renderer import RenderBudget, STREAM_CHUNK_SIZE, MergeEntry, compose_merged_pdf
+from plato.compose.scheduler import Priority, RenderScheduler
+from plato.settings import THUMBNAIL_WIDTH, TEMPLATE_DIRECTORY_NAME, REVISION_MAX_AGE
 from tests import get_message
-from tests.conftest import flask_client
-
-PLAIN_TEXT_TEMPLATE_ID = "plain_text"
-PNG_IMAGE_TEMPLATE_ID = "png_image"
-QR_CODE_TEMPLATE_ID = 'qr_code'
-NO_IMAGE_TEMPLATE_ID = PNG_IMAGE_TEMPLATE_ID.replace('p', 'u')
-PNG_IMAGE_NAME = "balloons.png"
-
-
-@pytest.fixture(scope='class')
-def client_with_jinjaenv():
-        template_loader = DictLoader({})
-        plain_text_jinja_id = f"{PLAIN_TEXT_TEMPLATE_ID}/{PLAIN_TEXT_TEMPLATE_ID}"
-        template_loader.mapping[plain_text_jinja_id] = "{{ p.plain }}"
-
-        png_template_jinja_id = f"{PNG_IMAGE_TEMPLATE_ID}/{PNG_IMAGE_TEMPLATE_ID}"
-        template_loader.mapping[png_template_jinja_id] = \
-            '<!DOCTYPE html>' \
-            '<html>' \
-            '<body>' \
-            '<img id="img_" src="file://{{ template_static }}' \
-            f'{PNG_IMAGE_NAME}">' \
-            '</img>' \
-            '</body>' \
-            '</html>'
-
-        no_image_template_jinja_id = f"{NO_IMAGE_TEMPLATE_ID}/{NO_IMAGE_TEMPLATE_ID}"
-        template_loader.mapping[no_image_template_jinja_id] = \
-            '<!DOCTYPE html>' \
-            '<html>' \
-            '<body>' \
-            '<img id="img_" src="file://{{ template_static }}' \
-            'no_img.png">' \
-            '</img>' \
-            '</body>' \
-            '</html>'
-
-        qr_code_template_jinja_id = f"{QR_CODE_TEMPLATE_ID}/{QR_CODE_TEMPLATE_ID}"
-        template_loader.mapping[qr_code_template_jinja_id] = \
-            '<!DOCTYPE html>' \
-            '<html>' \
-            '<body>' \
-            '<img src="file://{{ p.qr_code }}" alt="qr_fail">' \
-            '</body>' \
-            '</html>'
-
-        with tempfile.TemporaryDirectory() as file_dir:
-            yield from flask_client(template_loader, file_storage=DiskFileStorage(file_dir))
-            del template_loader.mapping[plain_text_jinja_id]
-            del template_loader.mapping[png_template_jinja_id]
-            del template_loader.mapping[no_image_template_jinja_id]
-            del template_loader.mapping[qr_code_template_jinja_id]
-
-
-@pytest.fixture(scope="class")
-def template_test_examples(client_with_jinjaenv):
-    with client_with_jinjaenv.application.app_context():
-        plain_text_template_model = Template(id_=PLAIN_TEXT_TEMPLATE_ID,
-                                             schema={"type": "object",
-                                                     "properties": {"plain": {"type": "string"}}
-                                                     },
-                                             type_="text/html", metadata={},
-                                             example_composition={"plain": "plain_example"}, tags=[])
-        db.session.add(plain_text_template_model)
-
-        png_image_template_model = Template(id_=PNG_IMAGE_TEMPLATE_ID,
-                                            schema={"type": "object",
-                                                    "properties": {}
-                                                    },
-                                            type_="text/html", metadata={}, example_composition={}, tags=[])
-        db.session.add(png_image_template_model)
-
-        no_image_template_model = Template(id_=NO_IMAGE_TEMPLATE_ID,
-                                           schema={"type": "object",
-                                                   "properties": {}
-                                                   },
-                                           type_="text/html", metadata={}, example_composition={}, tags=[])
-        db.session.add(no_image_template_model)
-
-        qr_code_template_model = Template(id_=QR_CODE_TEMPLATE_ID,
-                                          schema={"type": "object",
-                                                  "properties": {}
-                                                  },
-                                          type_="text/html", metadata={"qr_entries": ["qr_code"]},
-                                          example_composition={}, tags=[])
-        db.session.add(qr_code_template_model)
-        db.session.commit()
-
+from tests.conftest import PLAIN_TEXT_TEMPLATE_ID, PNG_IMAGE_TEMPLATE_ID, QR_CODE_TEMPLATE_ID, NO_IMAGE_TEMPLATE_ID, \
+    PNG_IMAGE_NAME
+
+@contextmanager
+def render_slots_taken(app):
+    """
+    Holds every render slot of the app, so its renders time out waiting for one.
+    """
+    render_scheduler: RenderScheduler = app.config["render_scheduler"]
+    tickets = [render_scheduler.submit(Priority.INTERACTIVE, ["other_template"], "other_client")
+               for _ in range(render_scheduler.capacity)]
+    queue_timeout, render_scheduler.queue_timeout = render_scheduler.queue_timeout, 0.01
+    try:
         yield
-
-        with client_with_jinjaenv.application.test_request_context():
-            Template.query.delete()
-            db.session.commit()
+    finally:
+        render_scheduler.queue_timeout = queue_timeout
+        for ticket in tickets:
+            render_scheduler.release(ticket)
 
 
 @pytest.mark.usefixtures("template_test_examples")
@@ -216,15 +147,46 @@ class TestCompose:
         assert get_message(response) == resizing_unsupported.format(pdf_mimetype)
 
     def test_unsupported_mimetype(self, client_with_jinjaenv):
-        jpeg_mimetype = "image/jpeg"
+        gif_mimetype = "image/gif"
 
         response = client_with_jinjaenv.get(
             f"{self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)}",
-            headers={"accept": jpeg_mimetype}
+            headers={"accept": gif_mimetype}
         )
 
         assert response.status_code == HTTPStatus.NOT_ACCEPTABLE
-        assert get_message(response) == unsupported_mime_type.format(jpeg_mimetype, ", ".join(ALL_AVAILABLE_MIME_TYPES))
+        assert get_message(response) == unsupported_mime_type.format(gif_mimetype, ", ".join(ALL_AVAILABLE_MIME_TYPES))
+
+    @pytest.mark.parametrize("mime_type, image_format", [("image/jpeg", "JPEG"), ("image/webp", "WEBP")])
+    def test_raster_formats_ok(self, client_with_jinjaenv, mime_type, image_format):
+        expected_resize = 200
+
+        response = client_with_jinjaenv.get(
+            f"{self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)}?width={expected_resize}&quality=50",
+            headers={"accept": mime_type}
+        )
+        assert response.status_code == HTTPStatus.OK
+        with Image.open(io.BytesIO(response.data)) as img:
+            assert img.format == image_format
+            assert isclose(img.size[0], expected_resize, abs_tol=1)
+
+    def test_png_quality_reduces_size(self, client_with_jinjaenv):
+        endpoint = self.EXAMPLE_COMPOSE_ENDPOINT.format(PNG_IMAGE_TEMPLATE_ID)
+        response = client_with_jinjaenv.get(endpoint, headers={"accept": "image/png"})
+        reduced_response = client_with_jinjaenv.get(f"{endpoint}?quality=10&compression=9",
+                                                    headers={"accept": "image/png"})
+        assert reduced_response.status_code == HTTPStatus.OK
+        assert len(reduced_response.data) < len(response.data)
+
+    def test_encoding_options_nok(self, client_with_jinjaenv):
+        endpoint = self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+
+        response = client_with_jinjaenv.get(f"{endpoint}?quality=50", headers={"accept": "application/pdf"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert get_message(response) == encoding_options_unsupported.format("application/pdf")
+
+        response = client_with_jinjaenv.get(f"{endpoint}?compression=7", headers={"accept": "image/webp"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
 
     def test_compose_qr_code_exists(self, client_with_jinjaenv):
         response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(QR_CODE_TEMPLATE_ID), json={"qr_code": "qr_url.com"})
@@ -235,3 +197,231 @@ class TestCompose:
         blocks = chain.from_iterable((page.getText("dict")["blocks"] for page in pdf_document))
         images = [block["image"] for block in blocks]
         assert len(images) == 1
+
+    def test_thumbnail_ok(self, client_with_jinjaenv):
+        thumbnail_endpoint = f"/template/{PLAIN_TEXT_TEMPLATE_ID}/thumbnail"
+        response = client_with_jinjaenv.get(thumbnail_endpoint)
+        assert response.status_code == HTTPStatus.OK
+        with Image.open(io.BytesIO(response.data)) as img:
+            assert isclose(img.size[0], THUMBNAIL_WIDTH, abs_tol=1)
+
+        cached_response = client_with_jinjaenv.get(thumbnail_endpoint, headers={"If-None-Match": response.headers["ETag"]})
+        assert cached_response.status_code == HTTPStatus.NOT_MODIFIED
+
+    def test_thumbnail_not_found(self, client_with_jinjaenv):
+        response = client_with_jinjaenv.get("/template/not_a_template/thumbnail")
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_thumbnail_waits_for_render_slot(self, client_with_jinjaenv):
+        with render_slots_taken(client_with_jinjaenv.application):
+            response = client_with_jinjaenv.get(f"/template/{PNG_IMAGE_TEMPLATE_ID}/thumbnail")
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+    def test_example_served_prerendered(self, client_with_jinjaenv):
+        app = client_with_jinjaenv.application
+        prerender_examples(app, PLAIN_TEXT_TEMPLATE_ID, TEMPLATE_DIRECTORY_NAME, THUMBNAIL_WIDTH)
+
+        with app.app_context():
+            template = Template.query.filter_by(id=PLAIN_TEXT_TEMPLATE_ID).one()
+            for mime_type in ("application/pdf", "image/png"):
+                prerendered = get_prerendered_example(template, app.config["storage"], TEMPLATE_DIRECTORY_NAME,
+                                                      mime_type)
+                assert prerendered is not None
+                response = client_with_jinjaenv.get(self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                                    headers={"accept": mime_type})
+                assert response.status_code == HTTPStatus.OK
+                assert response.data == prerendered
+
+    def test_compose_merged_ok(self, client_with_jinjaenv):
+        entries = [{"template_id": PLAIN_TEXT_TEMPLATE_ID, "compose_data": {"plain": "first"}, "title": "First"},
+                   {"template_id": QR_CODE_TEMPLATE_ID, "compose_data": {"qr_code": "qr_url.com"}},
+                   {"template_id": PLAIN_TEXT_TEMPLATE_ID, "compose_data": {"plain": "third"}, "title": "Third"}]
+        response = client_with_jinjaenv.post("/templates/compose", json={"entries": entries})
+        assert response.status_code == HTTPStatus.OK
+
+        pdf_document = Document(filetype="bytes", stream=response.data)
+        assert len(pdf_document) == len(entries)
+        assert pdf_document[0].getText().strip() == "first"
+        assert pdf_document[2].getText().strip() == "third"
+        assert [title for _, title, _ in pdf_document.getToC()] == ["First", QR_CODE_TEMPLATE_ID, "Third"]
+
+    def test_compose_merged_slot_per_document(self, client_with_jinjaenv):
+        render_slots = []
+
+        @contextmanager
+        def render_slot(template_ids):
+            render_slots.append(sorted(template_ids))
+            yield
+
+        with client_with_jinjaenv.application.app_context():
+            plain_text_template = Template.query.filter_by(id=PLAIN_TEXT_TEMPLATE_ID).one()
+            qr_code_template = Template.query.filter_by(id=QR_CODE_TEMPLATE_ID).one()
+            compose_merged_pdf([MergeEntry(plain_text_template, {"plain": "first"}, "First"),
+                                MergeEntry(qr_code_template, {"qr_code": "qr_url.com"}, "Second")],
+                               max_workers=2, render_slot=render_slot)
+
+        assert sorted(render_slots[:2]) == [[PLAIN_TEXT_TEMPLATE_ID], [QR_CODE_TEMPLATE_ID]]
+        assert render_slots[2:] == [sorted([PLAIN_TEXT_TEMPLATE_ID, QR_CODE_TEMPLATE_ID])]
+
+        entries = [{"template_id": PLAIN_TEXT_TEMPLATE_ID, "compose_data": {"plain": "first"}}]
+        with render_slots_taken(client_with_jinjaenv.application):
+            response = client_with_jinjaenv.post("/templates/compose", json={"entries": entries})
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+    def test_compose_merged_nok(self, client_with_jinjaenv):
+        entries = [{"template_id": PLAIN_TEXT_TEMPLATE_ID, "compose_data": {"plain": "first"}},
+                   {"template_id": PLAIN_TEXT_TEMPLATE_ID, "compose_data": {"plain": 2}}]
+        response = client_with_jinjaenv.post("/templates/compose", json={"entries": entries})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+        entries = [{"template_id": "not_a_template", "compose_data": {}}]
+        response = client_with_jinjaenv.post("/templates/compose", json={"entries": entries})
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_render_budget_exceeded(self, client_with_jinjaenv):
+        app = client_with_jinjaenv.application
+        endpoint = self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        app.config["RENDER_BUDGET"] = RenderBudget(max_raster_pixels=1000 * 1000, max_output_bytes=100)
+        try:
+            response = client_with_jinjaenv.post(f"{endpoint}?width=100000", json={"plain": "text"},
+                                                 headers={"accept": "image/png"})
+            assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+            response = client_with_jinjaenv.post(endpoint, json={"plain": "text" * 100},
+                                                 headers={"accept": "text/html"})
+            assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+            response = client_with_jinjaenv.post(endpoint, json={"plain": "text"}, headers={"accept": "text/html"})
+            assert response.status_code == HTTPStatus.OK
+        finally:
+            app.config["RENDER_BUDGET"] = RenderBudget()
+
+    def test_render_budget_overridden_by_template(self, client_with_jinjaenv):
+        with client_with_jinjaenv.application.app_context():
+            template = Template.query.filter_by(id=PLAIN_TEXT_TEMPLATE_ID).one()
+            template.metadata_ = {"render_budget": {"max_pages": 0}}
+            db.session.commit()
+        try:
+            response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                                 json={"plain": "text"})
+            assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        finally:
+            with client_with_jinjaenv.application.app_context():
+                template = Template.query.filter_by(id=PLAIN_TEXT_TEMPLATE_ID).one()
+                template.metadata_ = {}
+                db.session.commit()
+
+    def test_compose_multipart_attachments(self, client_with_jinjaenv):
+        endpoint = self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        static_directory = client_with_jinjaenv.application.config["TEMPLATE_STATIC"]
+        with open(f"{static_directory}/{PNG_IMAGE_TEMPLATE_ID}/{PNG_IMAGE_NAME}", "rb") as image:
+            image_bytes = image.read()
+
+        response = client_with_jinjaenv.post(endpoint,
+                                             data={"compose_data": json.dumps({"plain": "attachment:photo"}),
+                                                   "photo": (io.BytesIO(image_bytes), "photo.png", "image/png")},
+                                             content_type="multipart/form-data", headers={"accept": "text/html"})
+        assert response.status_code == HTTPStatus.OK
+        attachment_url = response.data.decode("utf-8")
+        assert attachment_url.startswith("file://") and attachment_url.endswith(".png")
+
+        response = client_with_jinjaenv.post(endpoint,
+                                             data={"compose_data": json.dumps({"plain": "attachment:missing"})},
+                                             content_type="multipart/form-data")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+        response = client_with_jinjaenv.post(endpoint, data={"photo": (io.BytesIO(image_bytes), "photo.png")},
+                                             content_type="multipart/form-data")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert get_message(response) == missing_compose_data_part.format("compose_data")
+
+    def test_compose_html_streamed(self, client_with_jinjaenv):
+        plain_text = "streamed text " * STREAM_CHUNK_SIZE
+        response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                             json={"plain": plain_text}, headers={"accept": "text/html"})
+        assert response.status_code == HTTPStatus.OK
+        assert response.is_streamed
+        assert response.mimetype == "text/html"
+        assert response.data.decode("utf-8") == plain_text
+
+        response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                             json={"plain": 1}, headers={"accept": "text/html"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_compose_html_streamed_frees_render_slot(self, client_with_jinjaenv):
+        render_scheduler: RenderScheduler = client_with_jinjaenv.application.config["render_scheduler"]
+        plain_text = "streamed text " * STREAM_CHUNK_SIZE
+        response = client_with_jinjaenv.post(self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID),
+                                             json={"plain": plain_text}, headers={"accept": "text/html"},
+                                             buffered=False)
+        # every slot is granted while the response was not read yet
+        tickets = [render_scheduler.submit(Priority.INTERACTIVE, ["other_template"], "other_client")
+                   for _ in range(render_scheduler.capacity)]
+        try:
+            for ticket in tickets:
+                ticket.future.result(5)
+        finally:
+            for ticket in tickets:
+                render_scheduler.release(ticket)
+
+        assert response.get_data().decode("utf-8") == plain_text
+        response.close()
+
+    def test_compose_html_served_from_render_cache(self, client_with_jinjaenv):
+        app = client_with_jinjaenv.application
+        endpoint = self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            app.config["render_cache"] = RenderCache(f"{cache_dir}/render_cache.db", max_bytes=1024 * 1024)
+            try:
+                response = client_with_jinjaenv.post(endpoint, json={"plain": "cached"},
+                                                     headers={"accept": "text/html"})
+                assert response.status_code == HTTPStatus.OK
+                assert response.data == b"cached"
+
+                # a render slot is not needed to serve it again
+                with render_slots_taken(app):
+                    response = client_with_jinjaenv.post(endpoint, json={"plain": "cached"},
+                                                         headers={"accept": "text/html"})
+                assert response.status_code == HTTPStatus.OK
+                assert response.data == b"cached"
+            finally:
+                app.config["render_cache"] = RenderCache(None, max_bytes=0)
+
+    def test_compose_pinned_to_revision(self, client_with_jinjaenv):
+        compose_endpoint = self.COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        response = client_with_jinjaenv.post(f"{compose_endpoint}?revision=1", json={"plain": "pinned"},
+                                             headers={"accept": "text/html"})
+        assert response.status_code == HTTPStatus.OK
+        assert response.data.decode("utf-8") == "pinned"
+        assert response.headers["Cache-Control"] == f"public, max-age={REVISION_MAX_AGE}, immutable"
+        assert "Accept" in response.vary
+
+        response = client_with_jinjaenv.post(compose_endpoint, json={"plain": "current"},
+                                             headers={"accept": "text/html"})
+        assert response.status_code == HTTPStatus.OK
+        assert "immutable" not in response.headers.get("Cache-Control", "")
+
+    def test_compose_pinned_to_revision_nok(self, client_with_jinjaenv):
+        example_endpoint = self.EXAMPLE_COMPOSE_ENDPOINT.format(PLAIN_TEXT_TEMPLATE_ID)
+        response = client_with_jinjaenv.get(f"{example_endpoint}?revision=0", headers={"accept": "text/html"})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert get_message(response) == invalid_template_revision.format(0)
+        assert "immutable" not in response.headers.get("Cache-Control", "")
+
+        response = client_with_jinjaenv.get(f"{example_endpoint}?revision=2", headers={"accept": "text/html"})
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        assert get_message(response) == template_revision_not_found.format(PLAIN_TEXT_TEMPLATE_ID, 2)
+
+    def test_validate_compose_data_lines(self, client_with_jinjaenv):
+        lines = [json.dumps({"plain": "valid"}), "", json.dumps({"plain": 1}), "{not json"]
+        response = client_with_jinjaenv.post(f"/template/{PLAIN_TEXT_TEMPLATE_ID}/validate", data="\n".join(lines),
+                                             content_type="application/x-ndjson")
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == "application/x-ndjson"
+        results = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+        assert [(result["line"], result["valid"]) for result in results] == [(1, True), (3, False), (4, False)]
+        assert results[1]["errors"] == [{"path": "$.plain", "message": "1 is not of type 'string'"}]
+
+        response = client_with_jinjaenv.post("/template/no_template/validate", data=lines[0],
+                                             content_type="application/x-ndjson")
+        assert response.status_code == HTTPStatus.NOT_FOUND
@@ -0,0 +1,55 @@
+import uuid
+import zipfile
+from pathlib import Path
+
+from plato.file_storage import DiskFileStorage
+from plato.util.path_util import tmp_zipfile_path
+
+TEMPLATE_DIRECTORY_NAME = "templating"
+
+
+def save_template_zip(file_storage: DiskFileStorage, template_id: str, static_files: dict) -> None:
+    # the zip file is extracted next to it, so every upload gets its own name
+    zip_file_name = str(uuid.uuid4())
+    with zipfile.ZipFile(tmp_zipfile_path(zip_file_name), mode="w") as zip_file:
+        zip_file.writestr(f"templates/{template_id}/{template_id}", "<html></html>")
+        for file_name, content in static_files.items():
+            zip_file.writestr(f"static/{template_id}/{file_name}", content)
+    file_storage.save_template_files(template_id, TEMPLATE_DIRECTORY_NAME, zip_file_name)
+
+
+class TestStaticFileDeduplication:
+
+    def static_file(self, file_storage: DiskFileStorage, template_id: str, file_name: str) -> Path:
+        return Path(f"{file_storage.files_directory_name}/{TEMPLATE_DIRECTORY_NAME}/static/{template_id}/{file_name}")
+
+    def test_shared_static_files_are_stored_once(self, disk_storage):
+        save_template_zip(disk_storage, "template_a", {"logo.png": b"logo", "style.css": b"a"})
+        save_template_zip(disk_storage, "template_b", {"logo.png": b"logo", "style.css": b"b"})
+
+        blobs = list(Path(f"{disk_storage.files_directory_name}/{TEMPLATE_DIRECTORY_NAME}/blobs").iterdir())
+        # the logo, both styles and the template file, identical for both templates
+        assert len(blobs) == 4
+
+        logo_a = self.static_file(disk_storage, "template_a", "logo.png")
+        logo_b = self.static_file(disk_storage, "template_b", "logo.png")
+        assert logo_a.read_bytes() == logo_b.read_bytes() == b"logo"
+        assert logo_a.stat().st_ino == logo_b.stat().st_ino
+        assert self.static_file(disk_storage, "template_b", "style.css").read_bytes() == b"b"
+
+    def test_update_does_not_alter_other_templates(self, disk_storage):
+        save_template_zip(disk_storage, "template_a", {"logo.png": b"logo", "style.css": b"a"})
+        save_template_zip(disk_storage, "template_b", {"logo.png": b"logo"})
+        save_template_zip(disk_storage, "template_a", {"logo.png": b"new logo"})
+
+        assert self.static_file(disk_storage, "template_a", "logo.png").read_bytes() == b"new logo"
+        assert self.static_file(disk_storage, "template_a", "style.css").read_bytes() == b"a"
+        assert self.static_file(disk_storage, "template_b", "logo.png").read_bytes() == b"logo"
+        assert disk_storage.get_static_manifest("template_a", TEMPLATE_DIRECTORY_NAME).keys() == {"logo.png",
+                                                                                                  "style.css"}
+
+    def test_template_files_include_static_files(self, disk_storage):
+        save_template_zip(disk_storage, "template_a", {"logo.png": b"logo"})
+        assert disk_storage.get_template_files("template_a", TEMPLATE_DIRECTORY_NAME) == {
+            "templates/template_a/template_a": b"<html></html>",
+            "static/template_a/logo.png": b"logo"}
@@ -0,0 +1,40 @@
+import pytest
+from num2words import num2words
+
+from plato.compose.jinja_filters import format_dates, num_to_ordinal, nth
+
+
+class TestJinjaFilters:
+
+    @pytest.mark.parametrize("number", [*range(0, 130), 1011, 1012, 1021, "1", "13", "22", "103"])
+    def test_nth_matches_ordinal_suffix(self, number):
+        assert nth(number) == num2words(number, to='ordinal_num')[-2:]
+
+    @pytest.mark.parametrize("number", ["-1", -3, 2.5])
+    def test_nth_invalid_number(self, number):
+        with pytest.raises(TypeError):
+            nth(number)
+
+    def test_ordinal_locale(self):
+        assert num_to_ordinal(3) == "3rd"
+        assert num_to_ordinal(3, "fr") == "3me"
+        assert nth(3, "fr") == "me"
+
+    def test_format_dates_locale(self):
+        assert format_dates("2020-03-01") == "1 March 2020"
+        assert format_dates("2020-03-01", locale="pt_PT") == "1 março 2020"
+        assert format_dates("2020-03-01", "MMMM", locale="de") == "März"
+        # memoized results must not leak between locales
+        assert format_dates("2020-03-01") == "1 March 2020"
+
+    def test_unhashable_arguments(self):
+        class UnhashableNumber(str):
+            __hash__ = None
+
+        assert num_to_ordinal(UnhashableNumber("3")) == "3rd"
+        assert nth(UnhashableNumber("3"), "fr") == "me"
+        # fails as num2words does, instead of on the filter cache
+        with pytest.raises(TypeError, match="not 'list'"):
+            num_to_ordinal([3])
+        with pytest.raises(TypeError, match="argument must be str"):
+            format_dates(["2020-03-01"])
@@ -7,12 +7,14 @@ import boto3
 import pytest
 from moto import mock_s3
 
-from plato.db.models import Template
-from plato.db import db
+from plato.db.models import Template, TemplateRevision
+from plato.error_messages import template_revision_not_found
+from plato.settings import REVISION_MAX_AGE
+from tests import get_message
+from tests.conftest import TEMPLATE_ID
 
 from tests.test_s3_application_set_up import BUCKET_NAME
 
-TEMPLATE_ID = "template_test_1"
 CURRENT_TEST_PATH = str(Path(__file__).resolve().parent)
 TEMPLATE_DETAILS_1 = {"title": TEMPLATE_ID,
                       "schema": {
@@ -151,46 +153,6 @@ TEMPLATE_DETAILS_2_UPDATE = {
     ]}
 
 
-@pytest.fixture(scope="function")
-def populate_db_s3(client_s3_storage):
-    yield from _fleeting_database(client_s3_storage)
-
-
-@pytest.fixture(scope="function")
-def populate_db(client_local_storage):
-    yield from _fleeting_database(client_local_storage)
-
-
-def _fleeting_database(client):
-    with client.application.test_request_context():
-        t = Template(id_=TEMPLATE_ID,
-                     schema={
-                         "type": "object",
-                         "required": [
-                             "cert_name",
-                             "serial_number"
-                         ],
-                         "properties": {
-                             "qr_code": {
-                                 "type": "string"
-                             },
-                             "cert_name": {
-                                 "type": "string"
-                             },
-                             "serial_number": {
-                                 "type": "string"
-                             }
-                         }
-                     },
-                     type_="text/html", metadata={}, example_composition={}, tags=[])
-        db.session.add(t)
-        db.session.commit()
-    yield
-    with client.application.test_request_context():
-        Template.query.delete()
-        db.session.commit()
-
-
 @pytest.fixture(scope="class")
 @mock_s3
 def setup_s3():
@@ -341,6 +303,25 @@ class TestManageTemplates:
         result = client_local_storage.patch(self.UPDATE_TEMPLATE_DETAILS.format(TEMPLATE_ID), json=data)
         assert result.status_code == HTTPStatus.BAD_REQUEST
 
+    def test_update_template_details_revision_invalid(self, client_local_storage):
+        result = client_local_storage.patch(self.UPDATE_TEMPLATE_DETAILS.format(TEMPLATE_ID), json={"revision": 0})
+        assert result.status_code == HTTPStatus.BAD_REQUEST
+        assert "revision" in result.json["message"]
+
+        result = client_local_storage.patch(self.UPDATE_TEMPLATE_DETAILS.format(TEMPLATE_ID),
+                                            json={"tags": ["revised"]})
+        assert result.status_code == HTTPStatus.OK
+        assert result.json["revision"] == 2
+
+    def test_update_template_details_metadata_ok(self, client_local_storage):
+        metadata = {"qr_entries": ["qr_code"]}
+
+        result = client_local_storage.patch(self.UPDATE_TEMPLATE_DETAILS.format(TEMPLATE_ID),
+                                            json={"metadata": metadata})
+        assert result.status_code == HTTPStatus.OK
+        assert result.json["metadata"] == metadata
+        assert Template.query.filter_by(id=TEMPLATE_ID).one().metadata_ == metadata
+
     def test_update_template_details_ok(self, client_local_storage):
         example_composition_data = {"qr_code": "https://google.com",
                                     "cert_date": "2021-01-12",
@@ -355,6 +336,48 @@ class TestManageTemplates:
         assert template_model.example_composition is not None
         assert template_model.example_composition == example_composition_data
 
+    def test_update_template_records_revisions(self, client_local_storage):
+        with open(f'{CURRENT_TEST_PATH}/resources/{TEMPLATE_ID}.zip', 'rb') as file:
+            data: dict = {'template_details': json.dumps(TEMPLATE_DETAILS_1_UPDATE),
+                          'zipfile': (file, f'{TEMPLATE_ID}.zip')}
+            result = client_local_storage.put(self.UPDATE_TEMPLATE.format(TEMPLATE_ID), data=data)
+        assert result.status_code == HTTPStatus.OK
+        result = client_local_storage.patch(self.UPDATE_TEMPLATE_DETAILS.format(TEMPLATE_ID),
+                                            json={"tags": ["revised"]})
+        assert result.status_code == HTTPStatus.OK
+
+        revisions = TemplateRevision.query.filter_by(template_id=TEMPLATE_ID).order_by(TemplateRevision.revision).all()
+        assert [revision.revision for revision in revisions] == [2, 3]
+        assert revisions[0].example_composition == TEMPLATE_DETAILS_1_UPDATE["example_composition"]
+        assert revisions[0].tags == [] and revisions[1].tags == ["revised"]
+        assert revisions[0].files["template"] is not None
+        # only the details changed, the files are the same
+        assert revisions[1].files == revisions[0].files
+
+    def test_template_detail_pinned_to_revision(self, client_local_storage):
+        with open(f'{CURRENT_TEST_PATH}/resources/{TEMPLATE_ID}.zip', 'rb') as file:
+            data: dict = {'template_details': json.dumps(TEMPLATE_DETAILS_1_UPDATE),
+                          'zipfile': (file, f'{TEMPLATE_ID}.zip')}
+            client_local_storage.put(self.UPDATE_TEMPLATE.format(TEMPLATE_ID), data=data)
+        client_local_storage.patch(self.UPDATE_TEMPLATE_DETAILS.format(TEMPLATE_ID), json={"tags": ["revised"]})
+
+        result = client_local_storage.get(f"/templates/{TEMPLATE_ID}?revision=2")
+        assert result.status_code == HTTPStatus.OK
+        assert result.json["tags"] == []
+        assert result.json["example_composition"] == TEMPLATE_DETAILS_1_UPDATE["example_composition"]
+        assert result.headers["Cache-Control"] == f"public, max-age={REVISION_MAX_AGE}, immutable"
+
+        result = client_local_storage.get(f"/templates/{TEMPLATE_ID}?revision=3")
+        assert result.status_code == HTTPStatus.OK
+        assert result.json["tags"] == ["revised"]
+
+        result = client_local_storage.get(f"/templates/{TEMPLATE_ID}?revision=4")
+        assert result.status_code == HTTPStatus.NOT_FOUND
+        assert get_message(result) == template_revision_not_found.format(TEMPLATE_ID, 4)
+
+        result = client_local_storage.get(f"/templates/{TEMPLATE_ID}?revision=first")
+        assert result.status_code == HTTPStatus.BAD_REQUEST
+
 
 @pytest.mark.usefixtures("populate_db_s3")
 @pytest.mark.usefixtures("setup_s3")
@@ -0,0 +1,66 @@
+import tempfile
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import NoResultFound
+
+from plato.db import db
+from plato.db.replicas import ReadReplicas, replica_binds
+
+FAILING_REPLICA_URL = "sqlite:////non/existent/directory/replica.db"
+
+
+def database_name(session) -> str:
+    return session.execute(text("SELECT name FROM database_name")).scalar_one()
+
+
+@pytest.fixture
+def replica_app():
+    with tempfile.TemporaryDirectory() as db_dir:
+        urls = {name: f"sqlite:///{db_dir}/{name}.db" for name in ("primary", "replica_a", "replica_b")}
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = urls.pop("primary")
+        app.config["SQLALCHEMY_BINDS"] = replica_binds([urls["replica_a"], FAILING_REPLICA_URL, urls["replica_b"]])
+        db.init_app(app)
+
+        with app.app_context():
+            for bind_key, name in ((None, "primary"), ("replica_0", "replica_a"), ("replica_2", "replica_b")):
+                with db.engines[bind_key].begin() as connection:
+                    connection.execute(text("CREATE TABLE database_name (name VARCHAR)"))
+                    connection.execute(text("INSERT INTO database_name VALUES (:name)"), {"name": name})
+            yield app
+
+
+class TestReadReplicas:
+
+    def test_reads_from_primary_without_replicas(self, replica_app):
+        read_replicas = ReadReplicas([])
+        assert read_replicas.read(database_name) == "primary"
+
+    def test_reads_rotate_between_replicas(self, replica_app):
+        read_replicas = ReadReplicas(["replica_0", "replica_2"])
+        assert {read_replicas.read(database_name) for _ in range(4)} == {"replica_a", "replica_b"}
+
+    def test_failing_replica_is_skipped(self, replica_app):
+        read_replicas = ReadReplicas(["replica_1", "replica_2"])
+        assert [read_replicas.read(database_name) for _ in range(4)] == ["replica_b"] * 4
+        assert list(read_replicas._failed_at) == ["replica_1"]
+
+    def test_falls_back_to_primary_when_all_replicas_fail(self, replica_app):
+        read_replicas = ReadReplicas(["replica_1"])
+        assert read_replicas.read(database_name) == "primary"
+
+    def test_no_result_is_read_from_primary(self, replica_app):
+        read_replicas = ReadReplicas(["replica_0"])
+        queried = []
+
+        def query(session) -> str:
+            name = database_name(session)
+            queried.append(name)
+            if name != "primary":
+                raise NoResultFound()
+            return name
+
+        assert read_replicas.read(query) == "primary"
+        assert queried == ["replica_a", "primary"]
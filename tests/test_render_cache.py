@@ -0,0 +1,77 @@
+import multiprocessing
+import tempfile
+
+import pytest
+
+from plato.compose import render_cache as render_cache_module
+from plato.compose.render_cache import RenderCache, template_key
+
+
+@pytest.fixture
+def cache_path():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        yield f"{cache_dir}/render_cache.db"
+
+
+@pytest.fixture
+def every_access_counts(monkeypatch):
+    monkeypatch.setattr(render_cache_module, "ACCESS_TIME_RESOLUTION", -1)
+
+
+def _get_cached(arguments) -> bytes:
+    cache_path, key = arguments
+    return RenderCache(cache_path, max_bytes=100).get(key)
+
+
+class TestRenderCache:
+
+    def test_get_or_render_renders_once(self, cache_path):
+        render_cache = RenderCache(cache_path, max_bytes=100)
+        renders = []
+
+        def render() -> bytes:
+            renders.append(1)
+            return b"rendered"
+
+        assert render_cache.get_or_render("key", render) == b"rendered"
+        assert render_cache.get_or_render("key", render) == b"rendered"
+        assert len(renders) == 1
+
+    def test_least_recently_used_evicted_over_budget(self, cache_path, every_access_counts):
+        render_cache = RenderCache(cache_path, max_bytes=100)
+        render_cache.put("first", b"1" * 40)
+        render_cache.put("second", b"2" * 40)
+        assert render_cache.get("first") is not None
+
+        render_cache.put("third", b"3" * 40)
+        assert render_cache.get("first") is not None
+        assert render_cache.get("second") is None
+        assert render_cache.get("third") is not None
+
+    def test_entry_over_budget_not_cached(self, cache_path):
+        render_cache = RenderCache(cache_path, max_bytes=100)
+        render_cache.put("large", b"l" * 101)
+        assert render_cache.get("large") is None
+
+    def test_shared_between_processes(self, cache_path):
+        RenderCache(cache_path, max_bytes=100).put("key", b"shared")
+        with multiprocessing.get_context("spawn").Pool(2) as pool:
+            assert pool.map(_get_cached, [(cache_path, "key")] * 2) == [b"shared"] * 2
+
+    def test_disabled_without_path(self):
+        render_cache = RenderCache(None, max_bytes=100)
+        render_cache.put("key", b"content")
+        assert render_cache.get("key") is None
+
+    def test_evict_template(self, cache_path):
+        render_cache = RenderCache(cache_path, max_bytes=100)
+        render_cache.put(template_key("template", "key"), b"template")
+        render_cache.put(template_key("template_b", "key"), b"template_b")
+        render_cache.put(template_key("template:b", "key"), b"template:b")
+        render_cache.put("qr:key", b"qr")
+
+        assert render_cache.evict_template("template") == 1
+        assert render_cache.get(template_key("template", "key")) is None
+        assert render_cache.get(template_key("template_b", "key")) == b"template_b"
+        assert render_cache.get(template_key("template:b", "key")) == b"template:b"
+        assert render_cache.get("qr:key") == b"qr"
@@ -0,0 +1,63 @@
+import pytest
+
+from plato.compose.scheduler import RenderScheduler, Priority, RenderQueueTimeout
+
+
+class TestRenderScheduler:
+
+    def test_interactive_before_bulk(self):
+        scheduler = RenderScheduler(capacity=1)
+        running = scheduler.submit(Priority.BULK, ["template"], "client_a")
+        bulk = scheduler.submit(Priority.BULK, ["template"], "client_a")
+        interactive = scheduler.submit(Priority.INTERACTIVE, ["template"], "client_b")
+        assert running.future.done()
+        assert not bulk.future.done() and not interactive.future.done()
+
+        scheduler.release(running)
+        assert interactive.future.done()
+        assert not bulk.future.done()
+
+        scheduler.release(interactive)
+        assert bulk.future.done()
+
+    def test_client_limit_does_not_block_other_clients(self):
+        scheduler = RenderScheduler(capacity=3, max_per_client=1)
+        first = scheduler.submit(Priority.BULK, ["template_a"], "client_a")
+        second = scheduler.submit(Priority.BULK, ["template_a"], "client_a")
+        other = scheduler.submit(Priority.BULK, ["template_b"], "client_b")
+        assert first.future.done()
+        assert not second.future.done()
+        assert other.future.done()
+
+        scheduler.release(first)
+        assert second.future.done()
+
+    def test_template_limit(self):
+        scheduler = RenderScheduler(capacity=3, max_per_template=1)
+        first = scheduler.submit(Priority.INTERACTIVE, ["template_a"], "client_a")
+        merged = scheduler.submit(Priority.BULK, ["template_a", "template_b"], "client_b")
+        other = scheduler.submit(Priority.BULK, ["template_b"], "client_c")
+        assert first.future.done()
+        assert not merged.future.done()
+        assert other.future.done()
+
+    def test_released_waiter_leaves_queue(self):
+        scheduler = RenderScheduler(capacity=1)
+        running = scheduler.submit(Priority.INTERACTIVE, ["template"], "client")
+        gave_up = scheduler.submit(Priority.INTERACTIVE, ["template"], "client")
+        waiting = scheduler.submit(Priority.INTERACTIVE, ["template"], "client")
+
+        scheduler.release(gave_up)
+        assert gave_up.future.cancelled()
+        scheduler.release(running)
+        assert waiting.future.done()
+
+    def test_slot_timeout(self):
+        scheduler = RenderScheduler(capacity=1, queue_timeout=0.01)
+        with scheduler.slot(Priority.INTERACTIVE, ["template"], "client"):
+            with pytest.raises(RenderQueueTimeout):
+                with scheduler.slot(Priority.INTERACTIVE, ["template"], "client"):
+                    pass
+
+        with scheduler.slot(Priority.INTERACTIVE, ["template"], "client"):
+            pass
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import json
+
 import boto3
 import pytest
 import pathlib
@@ -11,6 +13,8 @@ from plato.db.models import Template, db
 
 BUCKET_NAME = 'test_template_bucket'
 BASE_DIR = 'templating'
+CURRENT_BLOB = "a" * 64
+PAST_REVISION_BLOB = "b" * 64
 
 
 def get_template_file_path(template_id: str):
@@ -76,6 +80,18 @@ def populate_s3() -> None:
     write_to_s3(bucket_name=BUCKET_NAME, file_paths=[template_file_1])
 
 
+@pytest.fixture(scope='function')
+@mock_s3
+def populate_s3_with_blobs() -> None:
+    create_s3_bucket()
+
+    write_to_s3(bucket_name=BUCKET_NAME, file_paths=[get_template_file_path(template_id="0"),
+                                                     f"{BASE_DIR}/blobs/{CURRENT_BLOB}",
+                                                     f"{BASE_DIR}/blobs/{PAST_REVISION_BLOB}"])
+    with s3.open(BUCKET_NAME, key_id=f"{BASE_DIR}/manifests/0.json", mode="wb") as file:
+        file.write(json.dumps({"logo.png": CURRENT_BLOB}).encode("utf-8"))
+
+
 @pytest.fixture(scope='function')
 @mock_s3
 def populate_s3_with_missing_template_file() -> None:
@@ -104,6 +120,18 @@ class TestS3ApplicationSetup:
                 assert pathlib.Path(static_file_2).is_file()
                 assert pathlib.Path(template_file_1).is_file()
 
+    def test_only_blobs_of_current_templates_loaded(self, client_s3_storage, populate_s3_with_blobs):
+        with client_s3_storage.application.test_request_context():
+            with TemporaryDirectory() as temp:
+                template_dir_name = create_child_temp_folder(temp)
+                file_storage = client_s3_storage.application.config["storage"]
+                file_storage.load_templates(template_dir_name, BASE_DIR)
+
+                static_file = pathlib.Path(f'{template_dir_name}/{get_local_static_file_path("0", "logo.png")}')
+                assert static_file.read_text() == "I am file !"
+                assert pathlib.Path(f"{template_dir_name}/blobs/{CURRENT_BLOB}").is_file()
+                assert not pathlib.Path(f"{template_dir_name}/blobs/{PAST_REVISION_BLOB}").exists()
+
     def test_missing_template_file(self, client_s3_storage, populate_s3_with_missing_template_file):
         with client_s3_storage.application.test_request_context():
             with pytest.raises(NoIndexTemplateFound):
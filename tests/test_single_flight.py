@@ -0,0 +1,84 @@
+import multiprocessing
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from plato.compose.single_flight import SingleFlight
+
+RENDER_TIME = 0.5
+
+
+def _slow_render(counter, result: bytes = b"composed"):
+    with counter.get_lock():
+        counter.value += 1
+    time.sleep(RENDER_TIME)
+    return result
+
+
+def _render_in_process(lock_directory: str, counter, results):
+    single_flight = SingleFlight(lock_directory)
+    results.put(single_flight.do("a" * 64, lambda: _slow_render(counter)))
+
+
+class TestSingleFlight:
+
+    def test_concurrent_threads_render_once(self):
+        counter = multiprocessing.Value("i", 0)
+        single_flight = SingleFlight()
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda _: single_flight.do("key", lambda: _slow_render(counter)), range(10)))
+
+        assert counter.value == 1
+        assert results == [b"composed"] * 10
+
+    def test_different_keys_render_separately(self):
+        counter = multiprocessing.Value("i", 0)
+        single_flight = SingleFlight()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(lambda key: single_flight.do(key, lambda: _slow_render(counter, key.encode())),
+                                        ["key_1", "key_2"]))
+
+        assert counter.value == 2
+        assert results == [b"key_1", b"key_2"]
+
+    def test_error_is_raised_to_every_waiter(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+
+        def failing_render():
+            started.set()
+            time.sleep(RENDER_TIME)
+            raise ValueError("invalid")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(single_flight.do, "key", failing_render)
+            started.wait()
+            follower = executor.submit(single_flight.do, "key", failing_render)
+            for future in (leader, follower):
+                with pytest.raises(ValueError):
+                    future.result()
+
+    def test_sequential_calls_render_again(self):
+        counter = multiprocessing.Value("i", 0)
+        single_flight = SingleFlight()
+        single_flight.do("key", lambda: _slow_render(counter))
+        single_flight.do("key", lambda: _slow_render(counter))
+        assert counter.value == 2
+
+    def test_concurrent_processes_render_once(self):
+        context = multiprocessing.get_context("fork")
+        counter = context.Value("i", 0)
+        results = context.Queue()
+        with tempfile.TemporaryDirectory() as lock_directory:
+            processes = [context.Process(target=_render_in_process, args=(lock_directory, counter, results))
+                         for _ in range(4)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+            assert counter.value == 1
+            assert [results.get() for _ in processes] == [b"composed"] * 4
@@ -0,0 +1,83 @@
+import io
+import json
+import os
+import tarfile
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from plato.db import db
+from plato.db.models import Template
+from plato.settings import TEMPLATE_DIRECTORY_NAME
+from plato.util.snapshot import (MANIFEST_NAME, SNAPSHOT_FORMAT_VERSION, InvalidSnapshot, create_snapshot,
+                                 restore_snapshot, template_revisions)
+from tests.conftest import TEMPLATE_ID
+
+
+@pytest.fixture
+def template_directory():
+    with tempfile.TemporaryDirectory() as directory:
+        template_path = Path(directory, "templates", TEMPLATE_ID, TEMPLATE_ID)
+        template_path.parent.mkdir(parents=True)
+        template_path.write_text("<html></html>")
+        blob_path = Path(directory, "blobs", "ab", "abcd")
+        blob_path.parent.mkdir(parents=True)
+        blob_path.write_bytes(b"logo")
+        static_path = Path(directory, "static", TEMPLATE_ID, "logo.png")
+        static_path.parent.mkdir(parents=True)
+        os.link(blob_path, static_path)
+        yield directory
+
+
+@pytest.mark.usefixtures("populate_db")
+class TestSnapshot:
+
+    def test_create_restore_round_trip(self, client_local_storage, template_directory):
+        app = client_local_storage.application
+        with app.app_context(), tempfile.TemporaryDirectory() as restore_directory:
+            snapshot = io.BytesIO()
+            assert create_snapshot(snapshot, template_directory, template_revisions()) == 1
+
+            snapshot.seek(0)
+            target_directory = f"{restore_directory}/templates"
+            summary = restore_snapshot(snapshot, target_directory, app.config["storage"], TEMPLATE_DIRECTORY_NAME)
+            assert summary.templates == 1 and summary.refreshed_template_ids == []
+
+            assert Path(target_directory, "templates", TEMPLATE_ID, TEMPLATE_ID).read_text() == "<html></html>"
+            static_path = Path(target_directory, "static", TEMPLATE_ID, "logo.png")
+            assert static_path.read_bytes() == b"logo"
+            assert static_path.stat().st_ino == Path(target_directory, "blobs", "ab", "abcd").stat().st_ino
+
+    def test_templates_changed_since_are_loaded(self, client_local_storage, template_directory):
+        app = client_local_storage.application
+        file_storage = app.config["storage"]
+        file_storage.save_file(io.BytesIO(b"<html>updated</html>"),
+                               f"{TEMPLATE_DIRECTORY_NAME}/templates/{TEMPLATE_ID}/{TEMPLATE_ID}")
+        with app.app_context(), tempfile.TemporaryDirectory() as restore_directory:
+            snapshot = io.BytesIO()
+            create_snapshot(snapshot, template_directory, template_revisions())
+            template = Template.query.filter_by(id=TEMPLATE_ID).one()
+            template.revision += 1
+            db.session.commit()
+
+            snapshot.seek(0)
+            summary = restore_snapshot(snapshot, restore_directory, file_storage, TEMPLATE_DIRECTORY_NAME)
+            assert summary.refreshed_template_ids == [TEMPLATE_ID]
+            assert Path(restore_directory, "templates", TEMPLATE_ID, TEMPLATE_ID).read_text() == "<html>updated</html>"
+
+    def test_unsafe_path_rejected(self, client_local_storage):
+        snapshot = io.BytesIO()
+        manifest = json.dumps({"format_version": SNAPSHOT_FORMAT_VERSION, "revisions": {}}).encode()
+        with tarfile.open(fileobj=snapshot, mode="w:gz") as archive:
+            manifest_member = tarfile.TarInfo(MANIFEST_NAME)
+            manifest_member.size = len(manifest)
+            archive.addfile(manifest_member, io.BytesIO(manifest))
+            archive.addfile(tarfile.TarInfo("files/../outside"), io.BytesIO())
+        snapshot.seek(0)
+
+        with client_local_storage.application.app_context(), tempfile.TemporaryDirectory() as restore_directory:
+            with pytest.raises(InvalidSnapshot):
+                restore_snapshot(snapshot, restore_directory, client_local_storage.application.config["storage"],
+                                 TEMPLATE_DIRECTORY_NAME)
+            assert not Path(restore_directory).with_name("outside").exists()
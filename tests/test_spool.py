@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from plato.compose.spool import ChunkSpool
+
+
+class TestChunkSpool:
+
+    def test_written_without_waiting_for_the_reader(self):
+        spool = ChunkSpool(memory_size=10)
+        done = threading.Event()
+        chunks = [b"a" * 8, b"b" * 8, b"c" * 8]
+        writer = threading.Thread(target=spool.write_all, args=(iter(chunks), done.set))
+        writer.start()
+        # spooled to a temporary file past the memory size, with nothing read yet
+        assert done.wait(5)
+        writer.join()
+
+        assert b"".join(spool.read()) == b"".join(chunks)
+        spool.close()
+
+    def test_error_raised_after_the_chunks_before_it(self):
+        def chunks():
+            yield b"first"
+            raise ValueError("render failed")
+
+        spool = ChunkSpool()
+        spool.write_all(chunks())
+        read_chunks = spool.read()
+        assert next(read_chunks) == b"first"
+        with pytest.raises(ValueError, match="render failed"):
+            next(read_chunks)
+
+    def test_close_stops_the_writer(self):
+        spool = ChunkSpool()
+        written = []
+
+        def chunks():
+            for index in range(3):
+                written.append(index)
+                if index == 1:
+                    spool.close()
+                yield b"chunk"
+
+        spool.write_all(chunks())
+        assert written == [0, 1]
+        assert list(spool.read()) == []
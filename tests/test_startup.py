@@ -0,0 +1,35 @@
+import pytest
+from jinja2 import Environment as JinjaEnv
+
+from plato.file_storage import DiskFileStorage
+from plato.flask_app import create_app
+from plato.util.import_report import imported_modules
+from plato.util.setup_util import setup_swagger_ui
+
+HEAVY_MODULES = ["weasyprint", "qrcode", "PIL", "babel", "num2words", "tomlkit"]
+
+
+@pytest.mark.parametrize("module", ["main", "plato.flask_app", "plato.settings"])
+def test_heavy_modules_are_deferred(module):
+    top_level_modules = {imported_module.split(".")[0] for imported_module in imported_modules(module)}
+    assert top_level_modules.isdisjoint(HEAVY_MODULES)
+
+
+def test_swagger_config_is_loaded_when_the_docs_are_first_served(tmp_path):
+    config_loads = []
+
+    def load_swagger_config() -> dict:
+        config_loads.append(True)
+        return setup_swagger_ui("plato-api", "1.2.3")
+
+    app = create_app(db_url="sqlite://", template_static_directory=str(tmp_path), jinja_env=JinjaEnv(),
+                     swagger_ui_config=load_swagger_config, storage=DiskFileStorage(str(tmp_path)))
+    assert not config_loads
+
+    with app.test_client() as client:
+        spec = client.get("/apispec_1.json").json
+        client.get("/apispec_1.json")
+
+    assert spec["info"]["title"] == "plato-api"
+    assert spec["info"]["version"] == "1.2.3"
+    assert len(config_loads) == 1
@@ -0,0 +1,80 @@
+import io
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from plato.compose.render_cache import RenderCache, template_key
+from plato.db.models import TemplateRevision
+from plato.db.template_events import RevisionFilesUnavailable, TemplateChanged, TemplateSync
+from tests.test_file_storage import TEMPLATE_DIRECTORY_NAME
+
+
+@pytest.fixture
+def template_sync(disk_storage):
+    with tempfile.TemporaryDirectory() as target_directory:
+        render_cache = RenderCache(f"{target_directory}/render_cache.db", max_bytes=100)
+        yield TemplateSync(disk_storage, f"{target_directory}/templates", TEMPLATE_DIRECTORY_NAME, render_cache)
+
+
+def save_template(template_sync: TemplateSync, template_id: str, content: bytes) -> None:
+    template_sync.file_storage.save_file(io.BytesIO(content),
+                                         f"{TEMPLATE_DIRECTORY_NAME}/templates/{template_id}/{template_id}")
+
+
+class TestTemplateSync:
+
+    def local_template(self, template_sync: TemplateSync, template_id: str) -> Path:
+        return Path(f"{template_sync.target_directory}/templates/{template_id}/{template_id}")
+
+    def test_changed_template_pulled_and_evicted(self, template_sync):
+        save_template(template_sync, "template_a", b"<html>2</html>")
+        template_sync.render_cache.put(template_key("template_a", "key"), b"rendered")
+
+        assert template_sync.apply(TemplateChanged("template_a", 2))
+        assert self.local_template(template_sync, "template_a").read_bytes() == b"<html>2</html>"
+        assert template_sync.render_cache.get(template_key("template_a", "key")) is None
+        assert not self.local_template(template_sync, "template_b").exists()
+
+    def test_static_files_linked_to_their_blob(self, template_sync):
+        storage = template_sync.file_storage
+        save_template(template_sync, "template_a", b"<html>2</html>")
+        address = storage.save_blob(io.BytesIO(b"logo"), TEMPLATE_DIRECTORY_NAME)
+        storage.save_static_manifest("template_a", TEMPLATE_DIRECTORY_NAME, {"logo.png": address})
+
+        assert template_sync.apply(TemplateChanged("template_a", 2))
+        local_logo = Path(f"{template_sync.target_directory}/static/template_a/logo.png")
+        assert local_logo.read_bytes() == b"logo"
+        assert local_logo.samefile(storage.local_blob(TEMPLATE_DIRECTORY_NAME, address))
+
+    def test_older_revision_not_applied(self, template_sync):
+        save_template(template_sync, "template_a", b"<html>3</html>")
+        assert template_sync.apply(TemplateChanged("template_a", 3))
+
+        save_template(template_sync, "template_a", b"<html>2</html>")
+        assert not template_sync.apply(TemplateChanged("template_a", 2))
+        assert self.local_template(template_sync, "template_a").read_bytes() == b"<html>3</html>"
+
+    def test_revision_pinned(self, template_sync):
+        storage = template_sync.file_storage
+        files = {"template": storage.save_blob(io.BytesIO(b"<html>1</html>"), TEMPLATE_DIRECTORY_NAME),
+                 "static": {"logo.png": storage.save_blob(io.BytesIO(b"logo"), TEMPLATE_DIRECTORY_NAME)}}
+        revision = TemplateRevision(template_id="template_a", revision=1, schema={}, type="text/html", metadata_={},
+                                    example_composition={}, tags=[], files=files)
+
+        template = template_sync.pin_revision(revision)
+        assert template.revision == 1
+        assert template.files_id == "template_a@1"
+        assert self.local_template(template_sync, "template_a@1").read_bytes() == b"<html>1</html>"
+        assert Path(f"{template_sync.target_directory}/static/template_a@1/logo.png").read_bytes() == b"logo"
+        assert not self.local_template(template_sync, "template_a").exists()
+
+    def test_revision_without_files_not_pinned(self, template_sync):
+        revision = TemplateRevision(template_id="template_a", revision=1, schema={}, type="text/html", metadata_={},
+                                    example_composition={}, tags=[], files=None)
+        with pytest.raises(RevisionFilesUnavailable):
+            template_sync.pin_revision(revision)
+
+    def test_event_payload_round_trip(self):
+        event = TemplateChanged("template_a", 4)
+        assert TemplateChanged.from_payload(event.payload()) == event
@@ -0,0 +1,75 @@
+import base64
+import io
+import json
+
+import pytest
+
+from plato.db import db
+from plato.db.models import Template, TemplateRevision
+from plato.settings import TEMPLATE_DIRECTORY_NAME
+from plato.util.template_transfer import InvalidTemplateLine, export_templates, import_templates
+from tests.conftest import TEMPLATE_ID
+
+
+@pytest.mark.usefixtures("populate_db")
+class TestTemplateTransfer:
+
+    def test_export_import_round_trip(self, client_local_storage):
+        app = client_local_storage.application
+        file_storage = app.config["storage"]
+        file_storage.save_file(io.BytesIO(b"<html>{{ p.cert_name }}</html>"),
+                               f"{TEMPLATE_DIRECTORY_NAME}/templates/{TEMPLATE_ID}/{TEMPLATE_ID}")
+        file_storage.save_file(io.BytesIO(b"logo"), f"{TEMPLATE_DIRECTORY_NAME}/static/{TEMPLATE_ID}/logo.png")
+
+        with app.app_context():
+            output = io.StringIO()
+            assert export_templates(output, file_storage, TEMPLATE_DIRECTORY_NAME) == 1
+            exported = json.loads(output.getvalue())
+            assert set(exported["files"]) == {f"templates/{TEMPLATE_ID}/{TEMPLATE_ID}",
+                                              f"static/{TEMPLATE_ID}/logo.png"}
+
+            new_template = dict(exported, title="template_imported")
+            new_template["files"] = {"templates/template_imported/template_imported": exported["files"].popitem()[1]}
+            lines = [json.dumps(dict(exported, tags=["updated"])), json.dumps(new_template)]
+            summary = import_templates(lines, file_storage, TEMPLATE_DIRECTORY_NAME, batch_size=1)
+            assert summary.templates == 2 and summary.files == 2
+
+            updated_template = Template.query.filter_by(id=TEMPLATE_ID).one()
+            assert updated_template.tags == ["updated"]
+            assert updated_template.revision == 2
+            assert Template.query.filter_by(id="template_imported").one().revision == 1
+            assert file_storage.read_file(f"{TEMPLATE_DIRECTORY_NAME}/templates/template_imported/"
+                                          f"template_imported") is not None
+
+            imported_revision = TemplateRevision.query.filter_by(template_id="template_imported", revision=1).one()
+            assert imported_revision.files["template"] is not None
+            assert TemplateRevision.query.filter_by(template_id=TEMPLATE_ID, revision=2).one().tags == ["updated"]
+
+    def test_import_last_line_of_a_template_in_batch(self, client_local_storage):
+        app = client_local_storage.application
+        file_storage = app.config["storage"]
+        with app.app_context():
+            template_json = Template.query.filter_by(id=TEMPLATE_ID).one().json_dict()
+            template_file = f"templates/{TEMPLATE_ID}/{TEMPLATE_ID}"
+            lines = [json.dumps(dict(template_json, tags=["first"],
+                                     files={template_file: base64.b64encode(b"first").decode("ascii")})),
+                     json.dumps(dict(template_json, tags=["last"],
+                                     files={template_file: base64.b64encode(b"last").decode("ascii")}))]
+            summary = import_templates(lines, file_storage, TEMPLATE_DIRECTORY_NAME)
+            assert summary.templates == 1 and summary.files == 1
+
+            template = Template.query.filter_by(id=TEMPLATE_ID).one()
+            assert (template.revision, template.tags) == (2, ["last"])
+            revision = TemplateRevision.query.filter_by(template_id=TEMPLATE_ID, revision=2).one()
+            assert revision.tags == ["last"]
+            assert file_storage.read_file(f"{TEMPLATE_DIRECTORY_NAME}/{template_file}") == b"last"
+
+    def test_import_is_rolled_back_on_invalid_line(self, client_local_storage):
+        with client_local_storage.application.app_context():
+            template_json = Template.query.filter_by(id=TEMPLATE_ID).one().json_dict()
+            lines = [json.dumps(dict(template_json, title="template_not_imported")), "{not json"]
+            with pytest.raises(InvalidTemplateLine):
+                import_templates(lines, client_local_storage.application.config["storage"], TEMPLATE_DIRECTORY_NAME,
+                                 batch_size=1)
+
+            assert db.session.query(Template).filter_by(id="template_not_imported").first() is None
@@ -0,0 +1,22 @@
+import json
+
+from plato.compose.validation import compose_data_errors, validate_lines
+
+SCHEMA = {"type": "object",
+          "required": ["cert_name", "serial_number"],
+          "properties": {"cert_name": {"type": "string"}, "serial_number": {"type": "string"}}}
+
+
+class TestValidation:
+
+    def test_every_error_reported(self):
+        errors = compose_data_errors({"cert_name": 1}, SCHEMA)
+        assert {error["path"] for error in errors} == {"$", "$.cert_name"}
+        assert len(errors) == 2
+
+    def test_lines_validated_in_order(self):
+        lines = [json.dumps({"cert_name": "Ada", "serial_number": "1"}).encode("utf-8"), b"\n", b"[1"]
+        results = list(validate_lines(lines, SCHEMA))
+        assert [(result["line"], result["valid"]) for result in results] == [(1, True), (3, False)]
+        assert results[0]["errors"] == []
+        assert results[1]["errors"][0]["path"] is None